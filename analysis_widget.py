@@ -3,7 +3,8 @@ import sys
 from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QFont
 from PyQt5.QtWidgets import (QApplication, QCheckBox, QHBoxLayout, QLabel,
-                             QPushButton, QTextEdit, QVBoxLayout, QWidget)
+                             QPushButton, QSpinBox, QTextEdit, QVBoxLayout,
+                             QWidget)
 
 
 class LineWidget(QWidget):
@@ -53,6 +54,10 @@ class LineWidget(QWidget):
 
 class AnalysisWidget(QWidget):
     evaluationToggled = pyqtSignal(bool)
+    multiPVChanged = pyqtSignal(int)
+
+    MAX_LINES = 5
+    LINE_HEIGHT = 36
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -71,18 +76,43 @@ class AnalysisWidget(QWidget):
         )
         self.depth_label = QLabel("depth=0")
         self.depth_label.setFont(QFont("Arial", 10))
+        self.lines_spin = QSpinBox()
+        self.lines_spin.setRange(1, self.MAX_LINES)
+        self.lines_spin.setPrefix("Lines: ")
+        self.lines_spin.valueChanged.connect(self.set_multipv)
         header_layout.addWidget(self.check_analysis)
         header_layout.addWidget(self.depth_label)
         header_layout.addStretch()
+        header_layout.addWidget(self.lines_spin)
         main_layout.addLayout(header_layout)
 
-        # Lines container
+        # Lines container, one LineWidget per MultiPV line
         self.lines_layout = QVBoxLayout()
         self.lines_layout.setSpacing(8)
         main_layout.addLayout(self.lines_layout)
-        self.line_widget = LineWidget(self)
-        # Add sample lines
-        self.lines_layout.addWidget(self.line_widget)
+        self.line_widgets: list[LineWidget] = []
+        self.set_multipv(1)
+
+    @property
+    def line_widget(self) -> LineWidget:
+        return self.line_widgets[0]
+
+    def set_multipv(self, count: int):
+        count = max(1, min(self.MAX_LINES, count))
+        if self.lines_spin.value() != count:
+            # Re-enters through valueChanged with the clamped count
+            self.lines_spin.setValue(count)
+            return
+        while len(self.line_widgets) < count:
+            line_widget = LineWidget(self)
+            self.lines_layout.addWidget(line_widget)
+            self.line_widgets.append(line_widget)
+        while len(self.line_widgets) > count:
+            line_widget = self.line_widgets.pop()
+            self.lines_layout.removeWidget(line_widget)
+            line_widget.deleteLater()
+        self.setFixedHeight(64 + self.LINE_HEIGHT * count)
+        self.multiPVChanged.emit(count)
 
     def set_depth(self, depth: str):
         self.depth_label.setText(depth)
@@ -93,6 +123,16 @@ class AnalysisWidget(QWidget):
     def set_line_text(self, text: str):
         self.line_widget.line.setPlainText(text)
 
+    def set_line(self, index: int, score: str, text: str):
+        if 0 <= index < len(self.line_widgets):
+            self.line_widgets[index].score_label.setText(score)
+            self.line_widgets[index].line.setPlainText(text)
+
+    def clear_lines(self):
+        for line_widget in self.line_widgets:
+            line_widget.score_label.setText("")
+            line_widget.line.clear()
+
     def togle_analysis(self, value: bool):
         pass
 
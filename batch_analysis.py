@@ -0,0 +1,299 @@
+"""
+Batch engine annotation of a CQL result set.
+
+Every game in the results table is split into its mainline positions, which
+are evaluated with a fixed node or time budget by engines leased from the
+shared EnginePool. Each game gets ``[%eval]`` comments in its PGN plus an
+Eval (final position) and Swing (largest change between consecutive
+positions) column, so thousands of hits can be triaged by sorting.
+"""
+
+from collections import deque
+from io import StringIO
+
+import chess
+import chess.engine
+import chess.pgn
+from PyQt5 import QtCore
+
+from engine import ChessEngine
+from engine_pool import EnginePool
+from eval_cache import EvalCache
+
+MATE_SCORE = 10000
+
+
+def white_cp(score: tuple[str, int], turn: bool) -> int:
+    """Convert a side-to-move UCI score to white-POV centipawns."""
+    kind, value = score
+    if kind == "mate":
+        value = MATE_SCORE - abs(value) if value > 0 else -MATE_SCORE + abs(value)
+    return value if turn == chess.WHITE else -value
+
+
+def pov_score(score: tuple[str, int], turn: bool) -> chess.engine.PovScore:
+    kind, value = score
+    relative = chess.engine.Mate(value) if kind == "mate" else chess.engine.Cp(value)
+    return chess.engine.PovScore(relative, turn)
+
+
+class _GamePreparer(QtCore.QThread):
+    """
+    Parses the games of the result rows and lists their mainline positions.
+    One board is walked forward per game, so a game costs O(plies).
+    """
+
+    prepared = QtCore.pyqtSignal(dict, object)  # games by row index, task deque
+
+    def __init__(self, rows: list[dict], max_plies: int, parent=None):
+        super().__init__(parent)
+        self.rows = rows
+        self.max_plies = max_plies
+        self.stopped = False
+
+    def run(self):
+        games: dict[int, dict] = {}
+        tasks: deque[dict] = deque()
+        for row_idx, row in enumerate(self.rows):
+            if self.stopped:
+                return
+            entry = self._prepare_game(row_idx, row, tasks)
+            if entry is not None:
+                games[row_idx] = entry
+        self.prepared.emit(games, tasks)
+
+    def _prepare_game(self, row_idx: int, row: dict, tasks: deque) -> dict | None:
+        game = chess.pgn.read_game(StringIO(row.get("_pgn", "")))
+        if game is None:
+            return None
+        board = game.board()
+        nodes, turns, pending = [], [], 0
+        node = game
+        while node.variations and len(nodes) < self.max_plies:
+            node = node.variation(0)
+            board.push(node.move)
+            nodes.append(node)
+            turns.append(board.turn)
+            if board.is_game_over():
+                continue
+            tasks.append({"row": row_idx, "ply": len(nodes) - 1, "fen": board.fen()})
+            pending += 1
+        if not pending:
+            return None
+        return {
+            "game": game,
+            "nodes": nodes,
+            "turns": turns,  # side to move after each ply
+            "row": row,
+            "scores": {},
+            "pending": pending,
+        }
+
+
+class _EngineWorker(QtCore.QObject):
+    """Drives one leased engine through a queue of positions, one at a time."""
+
+    positionEvaluated = QtCore.pyqtSignal(object, object)  # task, info
+    idle = QtCore.pyqtSignal(object)
+    engineLost = QtCore.pyqtSignal(object)  # the engine died or never started
+
+    def __init__(self, engine: ChessEngine, mode: str, budget: int, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.mode = mode
+        self.budget = budget
+        self.task = None
+        self.info = None
+        self.evaluated = 0
+        self.engine.set_multipv(1)
+        self.engine.pvUpdated.connect(self.on_pv_updated)
+        self.engine.moveFound.connect(self.on_bestmove)
+        self.engine.errorOccurred.connect(self.on_engine_error)
+        self.engine.finished.connect(self.on_engine_finished)
+
+    def evaluate(self, task):
+        self.task = task
+        self.info = None
+        self.engine.send_position(task["fen"], self.mode, {self.mode: self.budget})
+
+    def on_pv_updated(self, info: dict):
+        if self.task is not None and info["multipv"] == 1 and info["score"]:
+            self.info = info
+
+    def on_bestmove(self, _):
+        task, self.task = self.task, None
+        if task is None:
+            return
+        self.evaluated += 1
+        self.positionEvaluated.emit(task, self.info)
+        self.idle.emit(self)
+
+    def on_engine_error(self, error):
+        if error == QtCore.QProcess.FailedToStart:
+            self.on_engine_finished()
+
+    def on_engine_finished(self, *_):
+        # A dead engine never sends bestmove; hand the task back instead
+        self.engineLost.emit(self)
+
+    def detach(self):
+        self.engine.pvUpdated.disconnect(self.on_pv_updated)
+        self.engine.moveFound.disconnect(self.on_bestmove)
+        self.engine.errorOccurred.disconnect(self.on_engine_error)
+        self.engine.finished.disconnect(self.on_engine_finished)
+
+
+class BatchAnnotator(QtCore.QObject):
+    progressUpdated = QtCore.pyqtSignal(int, int)  # games done, total games
+    gameAnnotated = QtCore.pyqtSignal(int, dict)  # row index, updated values
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, rows: list[dict], parent=None):
+        super().__init__(parent)
+        self.pool = EnginePool.instance()
+        self.eval_cache = EvalCache.instance()
+        config = self.pool.config
+        self.mode = config["batch_mode"]
+        self.budget = config["batch_budget"]
+        self.max_plies = config["batch_max_plies"]
+        self.cache_depth = (
+            self.budget if self.mode == "depth" else config["batch_cache_depth"]
+        )
+        self.rows = rows
+        self.games: dict[int, dict] = {}
+        self.queue: deque[dict] = deque()
+        self.workers: list[_EngineWorker] = []
+        self.preparer = None
+        self.done = 0
+        self.cancelled = False
+
+    def start(self) -> bool:
+        """Lease engines and prepare the games in the background."""
+        # Leave one engine for interactive viewers when the pool allows it
+        count = max(1, min(self.pool.available() - 1, len(self.rows)))
+        for _ in range(count):
+            if not self._add_worker():
+                break
+        if not self.workers:
+            return False
+        self.preparer = _GamePreparer(self.rows, self.max_plies, self)
+        self.preparer.prepared.connect(self.on_prepared)
+        self.preparer.start()
+        return True
+
+    def on_prepared(self, games: dict, tasks: deque):
+        self.preparer = None
+        if self.cancelled:
+            return
+        self.games = games
+        self.queue = tasks
+        self.progressUpdated.emit(0, len(self.games))
+        for worker in list(self.workers):
+            self.dispatch(worker)
+
+    def cancel(self):
+        self.cancelled = True
+        self._stop_preparer()
+        self.queue.clear()
+        for worker in list(self.workers):
+            worker.engine.send_command("stop")
+            self._retire(worker)
+
+    def _stop_preparer(self):
+        if self.preparer is not None:
+            self.preparer.prepared.disconnect()
+            self.preparer.stopped = True
+            self.preparer.wait()
+            self.preparer = None
+
+    def _add_worker(self) -> bool:
+        engine = self.pool.lease()
+        if engine is None:
+            return False
+        worker = _EngineWorker(engine, self.mode, self.budget, self)
+        worker.positionEvaluated.connect(self.on_position_evaluated)
+        worker.idle.connect(self.dispatch)
+        worker.engineLost.connect(self.on_engine_lost)
+        self.workers.append(worker)
+        return True
+
+    def on_engine_lost(self, worker: _EngineWorker):
+        task, worker.task = worker.task, None
+        if task is not None:
+            if task.get("retried"):
+                # The position crashed two engines; leave it without an eval
+                self.on_position_evaluated(task, None)
+            else:
+                task["retried"] = True
+                self.queue.appendleft(task)
+        if worker.engine.state() != QtCore.QProcess.NotRunning:
+            # The pool restarts it; the next search waits for its readyok
+            if self.preparer is None:
+                self.dispatch(worker)
+            return
+        replace = worker.evaluated > 0  # a working engine crashed; try another
+        self._retire(worker, finish=False)
+        if replace and not self.cancelled and self.queue and self._add_worker():
+            if self.preparer is None:
+                self.dispatch(self.workers[-1])
+        elif not self.workers:
+            self._stop_preparer()
+            self.finished.emit()
+
+    def dispatch(self, worker: _EngineWorker):
+        while not self.cancelled and self.queue:
+            task = self.queue.popleft()
+            cached = self.eval_cache.get(task["fen"])
+            if cached is None or cached["depth"] < self.cache_depth:
+                worker.evaluate(task)
+                return
+            self.on_position_evaluated(task, cached, cached=True)
+        self._retire(worker)
+
+    def on_position_evaluated(self, task: dict, info: dict | None, cached=False):
+        if info is not None and not cached:
+            self.eval_cache.put(task["fen"], info)
+        entry = self.games.get(task["row"])
+        if entry is None:
+            return
+        if info is not None:
+            entry["scores"][task["ply"]] = info["score"]
+        entry["pending"] -= 1
+        if entry["pending"] == 0:
+            self._finish_game(task["row"], entry)
+
+    def _finish_game(self, row_idx: int, entry: dict):
+        evals = []
+        for ply, (node, turn) in enumerate(zip(entry["nodes"], entry["turns"])):
+            score = entry["scores"].get(ply)
+            if score is None:
+                continue
+            node.set_eval(pov_score(score, turn))
+            evals.append(white_cp(score, turn))
+        del self.games[row_idx]
+        self.done += 1
+        self.progressUpdated.emit(self.done, self.done + len(self.games))
+        if not evals:
+            return
+        swing = max(
+            (abs(b - a) for a, b in zip(evals, evals[1:])), default=0
+        )
+        self.gameAnnotated.emit(
+            row_idx,
+            {
+                "Eval": f"{evals[-1] / 100:+.2f}",
+                "Swing": f"{swing / 100:.2f}",
+                "_eval": evals[-1] / 100,
+                "_swing": swing / 100,
+                "_pgn": str(entry["game"]).strip(),
+            },
+        )
+
+    def _retire(self, worker: _EngineWorker, finish: bool = True):
+        if worker not in self.workers:
+            return
+        worker.detach()
+        self.workers.remove(worker)
+        self.pool.release(worker.engine)
+        if finish and not self.workers:
+            self.finished.emit()
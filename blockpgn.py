@@ -0,0 +1,352 @@
+"""
+Block-compressed PGN databases (``.pgnb``).
+
+Games are packed, whole, into independently zlib-compressed blocks of
+about ``BLOCK_SIZE`` bytes. A block table maps every block to its place in
+the file and in the uncompressed text, and every game to its offset in
+the uncompressed text, so game N is read by decompressing one block.
+
+Layout::
+
+    MAGIC
+    block 0, block 1, ...                  zlib streams
+    <QQ  block count, game count
+    <Q   compressed offset of each block, then of the table itself
+    <Q   uncompressed offset of each block, then the total size
+    <Q   uncompressed offset of each game
+    <Q   offset of the table, then MAGIC
+
+``open_pgn`` gives a seekable view of the uncompressed text, so the header
+and position indexes, subsets and exact-position search work on ``.pgnb``
+files exactly as on plain PGN. Convert with ``convert_to_block_pgn`` or
+``python blockpgn.py input.pgn[.gz|.bz2|.xz|.zst] output.pgnb``.
+"""
+
+import io
+import lzma
+import os
+import re
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+from PyQt5 import QtCore
+
+MAGIC = b"QCQLPGNB"
+BLOCK_SIZE = 1 << 20
+BLOCK_SUFFIX = ".pgnb"
+TAG_RE = re.compile(rb'^\[(\w+)\s+"(.*)"\]\s*$')
+TERMINATIONS = (b"1-0", b"0-1", b"1/2-1/2", b"*")
+
+
+def is_block_pgn(path: str) -> bool:
+    return path.lower().endswith(BLOCK_SUFFIX)
+
+
+def _read_array(f, count: int) -> array:
+    values = array("Q")
+    values.frombytes(f.read(8 * count))
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def _array_bytes(values) -> bytes:
+    values = array("Q", values)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+class BlockPgnWriter:
+    """Writes games (raw PGN bytes, in order) into a ``.pgnb`` file."""
+
+    def __init__(self, path: str, block_size: int = BLOCK_SIZE):
+        self.f = open(path, "wb")
+        self.f.write(MAGIC)
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.block_offsets = array("Q")
+        self.block_starts = array("Q")
+        self.game_offsets = array("Q")
+        self.size = 0  # uncompressed bytes written so far
+
+    def add_game(self, game: bytes):
+        if self.buffer and len(self.buffer) + len(game) > self.block_size:
+            self._flush()
+        self.game_offsets.append(self.size + len(self.buffer))
+        self.buffer += game
+
+    def _flush(self):
+        self.block_offsets.append(self.f.tell())
+        self.block_starts.append(self.size)
+        self.f.write(zlib.compress(bytes(self.buffer), 6))
+        self.size += len(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        if self.buffer:
+            self._flush()
+        table = self.f.tell()
+        self.f.write(struct.pack("<QQ", len(self.block_offsets), len(self.game_offsets)))
+        self.f.write(_array_bytes(list(self.block_offsets) + [table]))
+        self.f.write(_array_bytes(list(self.block_starts) + [self.size]))
+        self.f.write(_array_bytes(self.game_offsets))
+        self.f.write(struct.pack("<Q", table) + MAGIC)
+        self.f.close()
+
+    def abort(self):
+        """Close without writing the table; the file is not readable."""
+        self.f.close()
+
+
+class BlockPgnReader:
+    """Random access to the games of a ``.pgnb`` file."""
+
+    CACHED_BLOCKS = 8
+
+    def __init__(self, path: str):
+        self.path = path
+        self.f = open(path, "rb")
+        self.f.seek(-16, os.SEEK_END)
+        table, magic = struct.unpack("<Q8s", self.f.read(16))
+        self.f.seek(0)
+        if magic != MAGIC or self.f.read(len(MAGIC)) != MAGIC:
+            self.f.close()
+            raise ValueError(f"{path} is not a block-compressed PGN file")
+        self.f.seek(table)
+        blocks, games = struct.unpack("<QQ", self.f.read(16))
+        self.block_offsets = _read_array(self.f, blocks + 1)
+        self.block_starts = _read_array(self.f, blocks + 1)
+        self.game_offsets = _read_array(self.f, games)
+        self.size = self.block_starts[-1]
+        self.cache: OrderedDict[int, bytes] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.game_offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def block_at(self, offset: int) -> int:
+        """Block holding uncompressed byte ``offset``."""
+        return bisect_right(self.block_starts, offset) - 1
+
+    def block(self, number: int) -> bytes:
+        data = self.cache.get(number)
+        if data is None:
+            start, end = self.block_offsets[number], self.block_offsets[number + 1]
+            self.f.seek(start)
+            data = zlib.decompress(self.f.read(end - start))
+            self.cache[number] = data
+            while len(self.cache) > self.CACHED_BLOCKS:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(number)
+        return data
+
+    def span(self, first: int, last: int) -> tuple[int, int]:
+        """Uncompressed byte range ``[start, end)`` of games first..last."""
+        start = self.game_offsets[first - 1]
+        end = self.game_offsets[last] if last < len(self) else self.size
+        return start, end
+
+    def game(self, number: int) -> bytes:
+        """Raw text of game ``number``; decompresses at most one block."""
+        start, end = self.span(number, number)
+        block = self.block_at(start)
+        base = self.block_starts[block]
+        return self.block(block)[start - base : end - base]
+
+
+class BlockPgnFile(io.RawIOBase):
+    """Seekable read-only view of the uncompressed text of a ``.pgnb`` file."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.reader = BlockPgnReader(path)
+        self.size = self.reader.size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        if self.position >= self.size:
+            return 0
+        block = self.reader.block_at(self.position)
+        data = self.reader.block(block)
+        start = self.position - self.reader.block_starts[block]
+        count = min(len(buffer), len(data) - start)
+        buffer[:count] = data[start : start + count]
+        self.position += count
+        return count
+
+    def close(self):
+        if not self.closed:
+            self.reader.close()
+        super().close()
+
+
+def open_pgn(path: str):
+    """Binary file object over the PGN text of a plain or ``.pgnb`` file."""
+    if is_block_pgn(path):
+        return io.BufferedReader(BlockPgnFile(path), BLOCK_SIZE)
+    return open(path, "rb")
+
+
+def stream_size(f) -> int:
+    """Size of the PGN text behind a file object from ``open_pgn``."""
+    raw = getattr(f, "raw", f)
+    if isinstance(raw, BlockPgnFile):
+        return raw.size
+    return os.fstat(f.fileno()).st_size
+
+
+class GameSplitter:
+    """
+    Finds where games start in PGN text fed line by line. A game starts on
+    a line that is a whole tag pair, outside any ``{...}`` comment, either
+    before any movetext or once the previous game's movetext has ended: at
+    a blank line or at its result. Tag-like lines inside comments or running
+    straight into movetext (``[%clk 0:01:00]``, diagrams) stay in the game.
+    """
+
+    def __init__(self):
+        self.in_tags = False
+        self.in_comment = False
+        self.movetext = False  # the current game has movetext
+        self.ended = False  # ... and it has ended
+        self.tag = None  # TAG_RE match of the last tag line
+
+    def starts_game(self, line: bytes) -> bool:
+        """Feed the next line; True when it is the first tag of a new game."""
+        self.tag = None
+        if not self.in_comment and line.startswith(b"["):
+            match = TAG_RE.match(line)
+            if match and (self.in_tags or self.ended or not self.movetext):
+                self.tag = match
+                new_game = not self.in_tags
+                if new_game:
+                    self.in_tags = True
+                    self.movetext = self.ended = False
+                return new_game
+            if self.in_tags:
+                return False  # a malformed tag of the tag section
+        stripped = line.strip()
+        if not stripped:
+            if self.movetext and not self.in_comment:
+                self.ended = True
+            return False
+        self.in_tags = False
+        self.movetext = True
+        self.ended = False
+        self.in_comment = self._still_in_comment(line)
+        if not self.in_comment and stripped.endswith(TERMINATIONS):
+            self.ended = True
+        return False
+
+    def _still_in_comment(self, line: bytes) -> bool:
+        in_comment, pos = self.in_comment, 0
+        while True:
+            if in_comment:
+                end = line.find(b"}", pos)
+                if end < 0:
+                    return True
+                in_comment, pos = False, end + 1
+            else:
+                start = line.find(b"{", pos)
+                # Nothing opens a comment after a ';' rest-of-line comment
+                if start < 0 or 0 <= line.find(b";", pos, start):
+                    return False
+                in_comment, pos = True, start + 1
+
+
+def convert_to_block_pgn(source: str, dest: str, progress=None) -> int:
+    """
+    Convert a plain or compressed PGN into ``dest``; returns the game count.
+    ``dest`` only appears once every game was read: a source that fails to
+    decompress halfway leaves no truncated file behind.
+    """
+    from compressed import open_decompressed
+
+    partial = dest + ".part"
+    writer = BlockPgnWriter(partial)
+    game = bytearray()
+    splitter = GameSplitter()
+    count = 0
+    try:
+        with open_decompressed(source) as f:
+            for line in f:
+                if splitter.starts_game(line) and game.strip():
+                    writer.add_game(bytes(game))
+                    game.clear()
+                    count += 1
+                    if progress and count % 10000 == 0:
+                        progress(count)
+                game += line
+        if game.strip():
+            writer.add_game(bytes(game))
+            count += 1
+        writer.close()
+    except BaseException:
+        writer.abort()
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+    os.replace(partial, dest)
+    return count
+
+
+class ConvertWorker(QtCore.QThread):
+    finished = QtCore.pyqtSignal(str, int)  # destination, games
+    failed = QtCore.pyqtSignal(str)
+    progress = QtCore.pyqtSignal(int)
+
+    def __init__(self, source: str, dest: str, parent=None):
+        super().__init__(parent)
+        self.source = source
+        self.dest = dest
+
+    def run(self):
+        try:
+            count = convert_to_block_pgn(self.source, self.dest, self.progress.emit)
+        except (OSError, EOFError, ValueError, zlib.error, lzma.LZMAError) as e:
+            self.failed.emit(f"Could not convert {self.source}: {e}")
+            return
+        self.finished.emit(self.dest, count)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python blockpgn.py INPUT.pgn[.gz|.bz2|.xz|.zst] OUTPUT.pgnb")
+        sys.exit(2)
+    games = convert_to_block_pgn(
+        sys.argv[1], sys.argv[2], lambda n: print(f"{n} games", end="\r")
+    )
+    print(f"{games} games written to {sys.argv[2]}")
@@ -11,8 +11,6 @@ from PyQt5.QtCore import QUrl, QSize, Qt
 from PyQt5.QtGui import QFont
 import re
 import sys
-from io import StringIO
-import chess.pgn
 from chessboard import ChessBoard
 from movemanager import MoveManager
 import qtawesome as qta
@@ -21,7 +19,9 @@ from pgn_browser import PGNBrowser as PGN_Browser
 from viewer import PGNHeaderWidget
 from analysis_widget import AnalysisWidget
 from bar import EvalBar
-from engine import ChessEngine
+from engine import ChessEngine, MultiPVTable
+from engine_pool import EnginePool
+from eval_cache import EvalCache
 
 text = """[Event "?"]
 [Site "?"]
@@ -72,7 +72,7 @@ class PGNBrowser(QWidget):
         layout = QHBoxLayout()
 
         self.setLayout(layout)
-        self.move_manager = MoveManager(game_info.get("PGN"))
+        self.move_manager = MoveManager(game_info.get("PGN"), game_info.get("Game"))
         self.set_html_style(html_style)
         chess_bar_layout = QHBoxLayout()
         chess_bar_layout.setContentsMargins(0, 0, 0, 0)
@@ -84,7 +84,6 @@ class PGNBrowser(QWidget):
         pgn_area_layout = QVBoxLayout()
         layout.addLayout(pgn_area_layout)
         self.analysis_widget = AnalysisWidget(self)
-        self.analysis_widget.setFixedHeight(100)
         self.header_widget = PGNHeaderWidget(game_info)
         self.browser = PGN_Browser(self, self.move_manager)
 
@@ -140,7 +139,11 @@ class PGNBrowser(QWidget):
         pgn_area_layout.addLayout(self.navigation_layout)
         pgn_area_layout.addLayout(actions_layout)
 
-        self.engine = ChessEngine("stockfish", self)
+        self.engine: ChessEngine | None = None
+        self.pv_table = MultiPVTable(1)
+        self.eval_cache = EvalCache.instance()
+        self._deepest: dict | None = None  # deepest multipv-1 info, to cache
+        self._cached_depth = 0
         self.display_pgn()
         self.analysis_widget.check_analysis.toggled.connect(self.toggle_analysis)
         self.chessboard.moveMade.connect(self.handle_move)
@@ -157,12 +160,31 @@ class PGNBrowser(QWidget):
         self.move_manager.pgnChanged.connect(lambda _: self.display_pgn())
         self.browser.anchorClicked.connect(self.on_anchor_clicked)
         self.chessboard.fenChanged.connect(self.send_position)
-        self.engine.cpScoreFound.connect(self.get_score)
-        self.engine.depthChanged.connect(
-            lambda depth: self.analysis_widget.set_depth(f"depth={depth}")
+        self.analysis_widget.multiPVChanged.connect(self.set_multipv)
+
+    def lease_engine(self) -> bool:
+        """Take a warm engine from the shared pool and hook up its signals."""
+        if self.engine is not None:
+            return True
+        self.engine = EnginePool.instance().lease()
+        if self.engine is None:
+            return False
+        self.engine.pvUpdated.connect(self.on_pv_updated)
+        self.engine.set_multipv(self.pv_table.size)
+        return True
+
+    def release_engine(self):
+        if self.engine is None:
+            return
+        self.store_eval()
+        self.engine.pvUpdated.disconnect(self.on_pv_updated)
+        EnginePool.instance().release(self.engine)
+        self.engine = None
+
+    def on_depth_changed(self, depth: int, cached: bool = False):
+        self.analysis_widget.set_depth(
+            f"depth={depth} (cached)" if cached else f"depth={depth}"
         )
-        self.engine.lineFound.connect(self.on_lines_found)
-        self.engine.mateFound.connect(self.get_mate)
 
     def flip_board(self):
         self.chessboard.flip()
@@ -234,8 +256,30 @@ class PGNBrowser(QWidget):
      """
 
     def send_position(self):
+        if self.engine is None or not self.analysis_widget.check_analysis.isChecked():
+            return
         self.engine.send_command("stop")
-        self.engine.send_position(self.chessboard.fen(), "depth", options={"depth": 60})
+        self.store_eval()
+        fen = self.chessboard.fen()
+        self.pv_table.reset(fen)
+        self.analysis_widget.clear_lines()
+        self._cached_depth = 0
+        depth = EnginePool.instance().config["analysis_depth"]
+        cached = self.eval_cache.get(fen)
+        if cached is not None:
+            self.on_pv_updated(cached)
+            self._deepest = None
+            self._cached_depth = cached["depth"]
+            self.on_depth_changed(cached["depth"], cached=True)
+            # Only search when more depth or more lines than stored are wanted
+            if cached["depth"] >= depth and self.pv_table.size == 1:
+                return
+        self.engine.send_position(fen, "depth", options={"depth": depth})
+
+    def store_eval(self):
+        if self._deepest is not None:
+            self.eval_cache.put(self.pv_table.fen, self._deepest)
+            self._deepest = None
 
     def show_variations(self):
         variations = self.move_manager.get_current_node_variations()
@@ -245,19 +289,36 @@ class PGNBrowser(QWidget):
         score = max(-10, min(10, score))
         return int((score + 10) / 20 * 1000)
 
-    def on_lines_found(self, lines: list[str]):
-        board = chess.Board(self.chessboard.fen())
-        if len(lines) >= 1:
-            move1_uci = lines[0]
-            move1 = chess.Move.from_uci(move1_uci)
-            if move1 not in board.legal_moves:
-                return
-        header = f'[FEN "{self.chessboard.fen()}"]\n\n'
-        pgn = header + " ".join(lines)
-        move1_uci = lines[0]
-        move1 = chess.Move.from_uci(move1_uci)
-        game = chess.pgn.read_game(StringIO(pgn))
-        self.analysis_widget.set_line_text(str(game.mainline_moves()))
+    def on_pv_updated(self, info: dict):
+        is_main = info["multipv"] == 1
+        if is_main and info["depth"] < self._cached_depth:
+            # Keep showing the deeper cached line until the search passes it
+            return
+        index = self.pv_table.update(info)
+        if index is None:
+            return
+        line = self.pv_table.lines[index]
+        self.analysis_widget.set_line(index, line["score_text"], line["san"])
+        if not is_main:
+            return
+        if info["depth"] > self._cached_depth:
+            self._deepest = info
+            self.on_depth_changed(info["depth"])
+        if info["score"] is not None:
+            kind, value = info["score"]
+            if kind == "cp":
+                self.get_score(value)
+            elif kind == "mate":
+                self.get_mate(value)
+
+    def set_multipv(self, count: int):
+        self.pv_table.resize(count)
+        if self.engine is None:
+            return
+        self.engine.send_command("stop")
+        self.engine.set_multipv(count)
+        if self.analysis_widget.check_analysis.isChecked():
+            self.send_position()
 
     def get_score(self, score: int):
         if self.chessboard.turn:
@@ -272,7 +333,6 @@ class PGNBrowser(QWidget):
                 score = abs(score)
         self.bar.setEngineScore({"type": "cp", "value": score})
         self.bar.setToolTip(str(score / 100))
-        self.analysis_widget.set_score(str(score / 100))
 
     def get_mate(self, matein: int):
         if matein == 0:
@@ -287,20 +347,19 @@ class PGNBrowser(QWidget):
                 self.bar.setEngineScore({"type": "mate", "value": matein})
             else:
                 self.bar.setEngineScore({"type": "mate", "value": -matein})
-        self.analysis_widget.set_score(f"M{matein}")
         self.bar.setToolTip(f"M{matein}")
 
     def toggle_analysis(self, toggle: bool):
         if toggle:
-            if self.engine.is_running():
-                self.bar.show()
-                self.send_position()
+            if not self.lease_engine():
+                self.analysis_widget.set_depth("no engine available")
+                self.analysis_widget.check_analysis.setChecked(False)
                 return
-            self.engine.start()
             self.bar.show()
             self.send_position()
         else:
-            self.engine.send_command("stop")
+            if self.engine is not None:
+                self.engine.send_command("stop")
             self.bar.hide()
 
     def save_pgn(self):
@@ -0,0 +1,570 @@
+"""
+SQLite header catalog.
+
+The headers of every opened PGN file are imported once into
+data/catalog.sqlite, one row per game with its CQL game number and byte
+offset, and indexed on players, date, Elo, ECO, event and result. Like the
+header index, the import remembers a FileState of the file, so after a
+change only the games from the first changed block onwards are imported
+again.
+
+The catalog backs the Browse Catalog window, where sorting and filtering
+run as SQL over the whole file instead of over Python rows. Query results
+are joined against it by game number, or by their headers when the number
+is not known, and the latest result set of each file is kept in the
+``results`` table, so scripts can query both, e.g.::
+
+    SELECT g.white, g.black, g.date FROM results r
+    JOIN games g ON g.file_id = r.file_id AND g.number = r.number
+    JOIN files f ON f.id = r.file_id
+    WHERE f.path = '/path/to/file.pgn' ORDER BY g.date
+"""
+
+import os
+import pickle
+import sqlite3
+from bisect import bisect_right
+
+from PyQt5 import QtCore, QtWidgets
+
+from blockpgn import is_block_pgn
+from pgn_index import FileState, RESULTS, iter_game_headers, parse_header_filter
+
+CATALOG_FILE = "data/catalog.sqlite"
+# Table column -> PGN tag
+TAG_COLUMNS = {
+    "event": "Event",
+    "site": "Site",
+    "date": "Date",
+    "round": "Round",
+    "white": "White",
+    "black": "Black",
+    "white_elo": "WhiteElo",
+    "black_elo": "BlackElo",
+    "result": "Result",
+    "eco": "ECO",
+}
+INDEXED_COLUMNS = (
+    "white", "black", "date", "white_elo", "black_elo", "eco", "event", "result"
+)
+# Values python-chess gives missing Seven Tag Roster tags; stored the same
+# way so result rows join on them
+ROSTER_DEFAULTS = {
+    "Event": "?",
+    "Site": "?",
+    "Date": "????.??.??",
+    "Round": "?",
+    "White": "?",
+    "Black": "?",
+    "Result": "*",
+}
+# Headers identifying a game when joining results against the catalog
+MATCH_COLUMNS = ("white", "black", "date", "round", "event")
+
+
+def _elo(value: str) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _year(date: str) -> int | None:
+    return _elo(date[:4])
+
+
+def _match_value(column: str, value: str) -> str:
+    return value.replace(".", "-") if column == "date" else value
+
+
+def filter_clause(text: str) -> tuple[str, list]:
+    """
+    SQL condition and parameters for a header filter in the syntax of
+    ``parse_header_filter``; plain words match players and events.
+    Raises ValueError on malformed filters.
+    """
+    if ":" not in text:
+        words = text.split()
+        clause = " AND ".join(
+            "(white LIKE ? OR black LIKE ? OR event LIKE ?)" for _ in words
+        )
+        return clause, [f"%{word}%" for word in words for _ in range(3)]
+    clauses, params = [], []
+    for predicate in parse_header_filter(text):
+        field = predicate[0]
+        if field in ("white", "black", "event"):
+            clauses.append(f"{field} LIKE ?")
+            params.append(f"%{predicate[1]}%")
+        elif field == "player":
+            clauses.append("(white LIKE ? OR black LIKE ?)")
+            params += [f"%{predicate[1]}%"] * 2
+        elif field == "result":
+            clauses.append("result = ?")
+            params.append(predicate[1])
+        elif field == "year":
+            clauses.append("year BETWEEN ? AND ?")
+            params += predicate[1:]
+        elif field == "elo":
+            clauses.append("white_elo BETWEEN ? AND ? AND black_elo BETWEEN ? AND ?")
+            params += predicate[1:] * 2
+        elif field in ("whiteelo", "blackelo"):
+            column = "white_elo" if field == "whiteelo" else "black_elo"
+            clauses.append(f"{column} BETWEEN ? AND ?")
+            params += predicate[1:]
+        else:
+            raise ValueError(f"'{field}' filters are not available in the catalog")
+    return " AND ".join(clauses), params
+
+
+class HeaderCatalog:
+    """
+    Game headers of every imported PGN file. Each thread opens its own
+    HeaderCatalog; the main thread shares ``instance()``.
+    """
+
+    _instance = None
+
+    @classmethod
+    def instance(cls) -> "HeaderCatalog":
+        if cls._instance is None:
+            cls._instance = HeaderCatalog()
+        return cls._instance
+
+    def __init__(self, path: str = CATALOG_FILE):
+        self.conn = sqlite3.connect(path, timeout=30)
+        # Readers keep browsing while a worker imports
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                game_count INTEGER NOT NULL,
+                state BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS games (
+                file_id INTEGER NOT NULL,
+                number INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                event TEXT, site TEXT, date TEXT, round TEXT,
+                white TEXT, black TEXT, white_elo INTEGER, black_elo INTEGER,
+                result TEXT, eco TEXT, year INTEGER,
+                PRIMARY KEY (file_id, number)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS results (
+                file_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                number INTEGER NOT NULL,
+                PRIMARY KEY (file_id, position)
+            ) WITHOUT ROWID;"""
+        )
+        for column in INDEXED_COLUMNS + ("year",):
+            self.conn.execute(
+                f"CREATE INDEX IF NOT EXISTS games_{column} "
+                f"ON games (file_id, {column})"
+            )
+        self.conn.commit()
+
+    def file_id(self, pgnfile: str) -> int | None:
+        row = self.conn.execute(
+            "SELECT id FROM files WHERE path = ?", (os.path.abspath(pgnfile),)
+        ).fetchone()
+        return row[0] if row else None
+
+    # ---------- Import ----------
+    def sync(self, pgnfile: str, progress=None) -> int | None:
+        """
+        Import the games of ``pgnfile`` that are new or changed since the
+        last import. Returns the first game number imported, or None when
+        the catalog was already up to date.
+        """
+        path = os.path.abspath(pgnfile)
+        row = self.conn.execute(
+            "SELECT id, state FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        keep, start = 0, 0
+        if row is not None:
+            file_id, state = row[0], pickle.loads(row[1])
+            changed = state.changed_from(path)
+            if changed is None:
+                return None
+            if is_block_pgn(path):
+                changed = 0  # .pgnb files are rewritten whole by the converter
+            # The game before the first changed byte may run into the change
+            (before,) = self.conn.execute(
+                "SELECT COUNT(*) FROM games WHERE file_id = ? AND offset < ?",
+                (file_id, changed),
+            ).fetchone()
+            keep = max(0, before - 1)
+            offset = self.conn.execute(
+                "SELECT offset FROM games WHERE file_id = ? AND number = ?",
+                (file_id, keep + 1),
+            ).fetchone()
+            start = offset[0] if offset and keep else 0
+            self.conn.execute(
+                "DELETE FROM games WHERE file_id = ? AND number > ?", (file_id, keep)
+            )
+        else:
+            file_id = self.conn.execute(
+                "INSERT INTO files (path, game_count, state) VALUES (?, 0, ?)",
+                (path, pickle.dumps(FileState())),
+            ).lastrowid
+
+        def rows():
+            for number, (offset, headers) in enumerate(
+                iter_game_headers(path, start), keep + 1
+            ):
+                values = {
+                    column: headers.get(tag, ROSTER_DEFAULTS.get(tag, ""))
+                    for column, tag in TAG_COLUMNS.items()
+                }
+                values["white_elo"] = _elo(values["white_elo"])
+                values["black_elo"] = _elo(values["black_elo"])
+                if values["result"] not in RESULTS:
+                    values["result"] = "*"
+                if progress and number % 10000 == 0:
+                    progress(number)
+                yield (file_id, number, offset, *values.values(), _year(values["date"]))
+
+        columns = ", ".join(TAG_COLUMNS)
+        self.conn.executemany(
+            f"INSERT INTO games (file_id, number, offset, {columns}, year) "
+            f"VALUES ({', '.join('?' * (len(TAG_COLUMNS) + 4))})",
+            rows(),
+        )
+        (count,) = self.conn.execute(
+            "SELECT COUNT(*) FROM games WHERE file_id = ?", (file_id,)
+        ).fetchone()
+        self.conn.execute(
+            "UPDATE files SET game_count = ?, state = ? WHERE id = ?",
+            (count, pickle.dumps(FileState.capture(path)), file_id),
+        )
+        self.conn.commit()
+        return keep + 1
+
+    # ---------- Queries ----------
+    def count(self, pgnfile: str, where: str = "", params=()) -> int:
+        file_id = self.file_id(pgnfile)
+        if file_id is None:
+            return 0
+        condition = f" AND ({where})" if where else ""
+        (count,) = self.conn.execute(
+            f"SELECT COUNT(*) FROM games WHERE file_id = ?{condition}",
+            (file_id, *params),
+        ).fetchone()
+        return count
+
+    def rows(
+        self,
+        pgnfile: str,
+        where: str = "",
+        params=(),
+        order: str = "number",
+        descending: bool = False,
+        limit: int = -1,
+        offset: int = 0,
+    ) -> list[tuple]:
+        """``(number, *TAG_COLUMNS)`` rows of the games matching ``where``."""
+        if order != "number" and order not in TAG_COLUMNS:
+            raise ValueError(f"Unknown catalog column: {order}")
+        file_id = self.file_id(pgnfile)
+        if file_id is None:
+            return []
+        condition = f" AND ({where})" if where else ""
+        direction = "DESC" if descending else "ASC"
+        return self.conn.execute(
+            f"SELECT number, {', '.join(TAG_COLUMNS)} FROM games "
+            f"WHERE file_id = ?{condition} "
+            f"ORDER BY {order} {direction}, number {direction} LIMIT ? OFFSET ?",
+            (file_id, *params, limit, offset),
+        ).fetchall()
+
+    def join_results(
+        self,
+        pgnfile: str,
+        rows: list[dict],
+        ranges: list[tuple[int, int]] | None = None,
+    ) -> list[int | None]:
+        """
+        Game numbers of result ``rows`` (dicts with PGN tag keys); None for
+        rows the catalog has no game for. Rows that carry the ``_number`` of
+        a game of ``pgnfile`` keep it. The others are matched by their
+        headers among the games the search scanned, the ``(first, last)``
+        ``ranges`` or the whole file: cql writes its matches in file order,
+        so each row takes the first game with its headers after the game of
+        the row before. The numbers become the stored result set of
+        ``pgnfile``.
+        """
+        file_id = self.file_id(pgnfile)
+        if file_id is None:
+            return [None] * len(rows)
+        path = os.path.abspath(pgnfile)
+        numbers = [
+            row.get("_number")
+            if row.get("_source") and os.path.abspath(row["_source"]) == path
+            else None
+            for row in rows
+        ]
+        # Dates are compared with '-' separators on both sides: the result
+        # table shows them that way, and some files already store them so
+        keys = {
+            position: tuple(
+                _match_value(c, row.get(TAG_COLUMNS[c], "")) for c in MATCH_COLUMNS
+            )
+            for position, row in enumerate(rows)
+            if numbers[position] is None
+        }
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS matched "
+            f"(position INTEGER PRIMARY KEY, {', '.join(MATCH_COLUMNS)})"
+        )
+        self.conn.execute("DELETE FROM matched")
+        self.conn.executemany(
+            "INSERT INTO matched VALUES (?, ?, ?, ?, ?, ?)",
+            ((position, *key) for position, key in keys.items()),
+        )
+        scope = ""
+        if ranges is not None:
+            self.conn.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS scanned (first INTEGER, last INTEGER)"
+            )
+            self.conn.execute("DELETE FROM scanned")
+            self.conn.executemany("INSERT INTO scanned VALUES (?, ?)", ranges)
+            scope = (
+                "AND EXISTS (SELECT 1 FROM scanned "
+                "WHERE number BETWEEN scanned.first AND scanned.last)"
+            )
+        game_columns = ", ".join(
+            "replace(date, '.', '-')" if c == "date" else c for c in MATCH_COLUMNS
+        )
+        games: dict[tuple, list[int]] = {}
+        for number, *key in self.conn.execute(
+            f"""SELECT number, {game_columns} FROM games
+            WHERE file_id = ? AND (white, black) IN (SELECT white, black FROM matched)
+            {scope} ORDER BY number""",
+            (file_id,),
+        ):
+            games.setdefault(tuple(key), []).append(number)
+        used = set(numbers)
+        previous = 0
+        for position, key in keys.items():
+            candidates = games.get(key, [])
+            start = bisect_right(candidates, previous)
+            # Results of several runs shown together may restart the order
+            number = next(
+                (n for n in candidates[start:] if n not in used),
+                next((n for n in candidates[:start] if n not in used), None),
+            )
+            if number is None:
+                continue
+            numbers[position] = previous = number
+            used.add(number)
+        self.conn.execute("DELETE FROM results WHERE file_id = ?", (file_id,))
+        self.conn.executemany(
+            "INSERT INTO results (file_id, position, number) VALUES (?, ?, ?)",
+            (
+                (file_id, position, number)
+                for position, number in enumerate(numbers)
+                if number is not None
+            ),
+        )
+        self.conn.commit()
+        return numbers
+
+    def close(self):
+        self.conn.close()
+
+
+class CatalogWorker(QtCore.QThread):
+    """Imports (or brings up to date) the catalog rows of one PGN file."""
+
+    finished = QtCore.pyqtSignal(str)
+    failed = QtCore.pyqtSignal(str)
+    progress = QtCore.pyqtSignal(int)
+
+    def __init__(self, parent=None, pgnfile: str = ""):
+        super().__init__(parent)
+        self.pgnfile = pgnfile
+
+    def run(self):
+        try:
+            catalog = HeaderCatalog()
+            try:
+                catalog.sync(self.pgnfile, self.progress.emit)
+            finally:
+                catalog.close()
+        except (OSError, sqlite3.Error) as e:
+            self.failed.emit(f"Could not update the catalog of {self.pgnfile}: {e}")
+            return
+        self.finished.emit(self.pgnfile)
+
+
+class ResultsJoinWorker(QtCore.QThread):
+    """
+    Joins result rows against the catalog of their files (path -> rows and
+    the game ranges the search scanned, or None for the whole file).
+    """
+
+    joined = QtCore.pyqtSignal(str, list)  # pgnfile, game numbers of its rows
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent=None, groups: dict[str, tuple] | None = None):
+        super().__init__(parent)
+        self.groups = groups or {}
+
+    def run(self):
+        try:
+            catalog = HeaderCatalog()
+            try:
+                for pgnfile, (rows, ranges) in self.groups.items():
+                    self.joined.emit(
+                        pgnfile, catalog.join_results(pgnfile, rows, ranges)
+                    )
+            finally:
+                catalog.close()
+        except sqlite3.Error as e:
+            self.failed.emit(f"Could not join the results with the catalog: {e}")
+
+
+class CatalogModel(QtCore.QAbstractTableModel):
+    """
+    Games of one file straight from the catalog. Rows are fetched in pages
+    as the view scrolls, and sorting is an ORDER BY on an indexed column.
+    """
+
+    HEADERS = ["#"] + list(TAG_COLUMNS.values())
+    PAGE = 500
+
+    def __init__(self, catalog: HeaderCatalog, pgnfile: str, parent=None):
+        super().__init__(parent)
+        self.catalog = catalog
+        self.pgnfile = pgnfile
+        self.where, self.params = "", []
+        self.order, self.descending = "number", False
+        self._rows: list[tuple] = []
+        self.total = 0
+        self.reload()
+
+    def set_filter(self, text: str):
+        """Apply a header filter; raises ValueError when it is malformed."""
+        text = text.strip()
+        self.where, self.params = filter_clause(text) if text else ("", [])
+        self.reload()
+
+    def reload(self):
+        self.beginResetModel()
+        self.total = self.catalog.count(self.pgnfile, self.where, self.params)
+        self._rows = []
+        self.endResetModel()
+        self.fetchMore()
+
+    def rowCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()) -> bool:
+        return not parent.isValid() and len(self._rows) < self.total
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return
+        rows = self.catalog.rows(
+            self.pgnfile,
+            self.where,
+            self.params,
+            self.order,
+            self.descending,
+            self.PAGE,
+            len(self._rows),
+        )
+        if not rows:
+            return
+        first = len(self._rows)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(rows) - 1)
+        self._rows += rows
+        self.endInsertRows()
+
+    def data(self, index: QtCore.QModelIndex, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        value = self._rows[index.row()][index.column()]
+        return "" if value is None else value
+
+    def headerData(self, section: int, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return section + 1
+
+    def sort(self, column: int, order=QtCore.Qt.AscendingOrder):
+        self.order = "number" if column == 0 else list(TAG_COLUMNS)[column - 1]
+        self.descending = order == QtCore.Qt.DescendingOrder
+        self.reload()
+
+    def row_dict(self, row_idx: int) -> dict:
+        """
+        PGN tag -> value for a row, plus its game ``Number`` and the
+        ``Source`` file it numbers.
+        """
+        row = self._rows[row_idx]
+        game = {
+            tag: "" if value is None else str(value)
+            for tag, value in zip(TAG_COLUMNS.values(), row[1:])
+        }
+        game["Number"] = row[0]
+        game["Source"] = self.pgnfile
+        return game
+
+
+class CatalogBrowser(QtWidgets.QDialog):
+    """Every game of the open file, sortable and filterable through SQL."""
+
+    gameSelected = QtCore.pyqtSignal(dict)
+
+    def __init__(self, pgnfile: str, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Catalog - {os.path.basename(pgnfile)}")
+        self.resize(1000, 600)
+        self.model = CatalogModel(HeaderCatalog.instance(), pgnfile, self)
+
+        self.filter_edit = QtWidgets.QLineEdit(self)
+        self.filter_edit.setPlaceholderText(
+            'Filter, e.g. Carlsen or player:"Carlsen, Magnus" year:2015-2020 elo:>=2600'
+        )
+        self.table = QtWidgets.QTableView(self)
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(0, QtCore.Qt.AscendingOrder)
+        self.info_label = QtWidgets.QLabel(self)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.filter_edit)
+        layout.addWidget(self.table, 1)
+        layout.addWidget(self.info_label)
+
+        # Filter once typing pauses, not on every key
+        self.filter_timer = QtCore.QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(300)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        self.filter_edit.textChanged.connect(lambda _: self.filter_timer.start())
+        self.table.doubleClicked.connect(
+            lambda index: self.gameSelected.emit(self.model.row_dict(index.row()))
+        )
+        self.update_info()
+
+    def apply_filter(self):
+        try:
+            self.model.set_filter(self.filter_edit.text())
+        except ValueError as e:
+            self.info_label.setText(str(e))
+            return
+        self.update_info()
+
+    def update_info(self):
+        self.info_label.setText(f"{self.model.total} games")
@@ -42,6 +42,7 @@ class ChessBoard(QtWidgets.QWidget, chess.Board):
     GameOver = QtCore.pyqtSignal()
     fenChanged = QtCore.pyqtSignal(str)
     moveMade = QtCore.pyqtSignal(str)
+    findPositionRequested = QtCore.pyqtSignal(str)
 
     def __init__(
         self,
@@ -166,12 +167,15 @@ class ChessBoard(QtWidgets.QWidget, chess.Board):
         menu = QtWidgets.QMenu(self)
         menu.addAction("Flip board")
         menu.addSeparator()
+        menu.addAction("Find this position in database")
 
         action = menu.exec_(a0.globalPos())
         if action is None:
             return
         if action.text() == "Flip board":
             self.flip()
+        elif action.text() == "Find this position in database":
+            self.findPositionRequested.emit(self.fen())
 
     def paintEvent(self, a0):
         super().paintEvent(a0)
@@ -0,0 +1,154 @@
+"""
+Context-aware completion index for the CQL editor.
+
+Entries come from data/filters.json (filters and piece designators, with
+their parameters and arguments) and data/cmd.json (options usable in the
+``cql(...)`` header). They are stored in a prefix trie whose nodes keep
+the best few entries below them, so a lookup costs O(len(prefix)) plus a
+small re-ranking by editing context, no matter how many entries exist.
+"""
+
+import json
+import re
+
+FILTERS_FILE = "data/filters.json"
+CMD_FILE = "data/cmd.json"
+
+# Editing contexts, see context_at()
+STATEMENT = "statement"
+AFTER_ARROW = "after_arrow"
+PIECE = "piece"
+HEADER = "header"
+
+# Entry kinds boosted in each context, best first
+CONTEXT_KINDS = {
+    STATEMENT: ("filter", "piece", "header"),
+    AFTER_ARROW: ("position", "filter", "piece", "header"),
+    PIECE: ("piece", "filter", "header"),
+    HEADER: ("header", "filter", "piece"),
+}
+ARROW_RE = re.compile(r"(-->|->|<--|<-)\s*$")
+
+
+class _Node:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children: dict[str, "_Node"] = {}
+        self.top: list[dict] = []
+
+
+class CompletionIndex:
+    """Prefix trie over completion entries; build lazily with ``instance()``."""
+
+    PER_NODE = 64  # entries kept at each node, enough for every context
+
+    _instance = None
+
+    @classmethod
+    def instance(cls) -> "CompletionIndex":
+        if cls._instance is None:
+            cls._instance = cls.from_files()
+        return cls._instance
+
+    @classmethod
+    def from_files(cls) -> "CompletionIndex":
+        entries = []
+        try:
+            with open(FILTERS_FILE, "r") as f:
+                for item in json.load(f):
+                    entries.append(cls._filter_entry(item))
+        except Exception as e:
+            print("Error loading filters.", e)
+        try:
+            with open(CMD_FILE, "r") as f:
+                for item in json.load(f):
+                    entries.append(cls._header_entry(item))
+        except Exception as e:
+            print("Error loading command line options.", e)
+        return cls(entries)
+
+    @staticmethod
+    def _filter_entry(item: dict) -> dict:
+        if item.get("link", "").startswith("piecedesignator"):
+            kind = "piece"
+        elif not item.get("arguments") and not item.get("parameters"):
+            # No arguments: a plain position test such as check or mate
+            kind = "position"
+        else:
+            kind = "filter"
+        detail = " ".join(p for p in (item.get("parameters"), item.get("arguments")) if p)
+        return {
+            "name": item["name"],
+            "kind": kind,
+            "detail": detail,
+            "example": item.get("example", ""),
+        }
+
+    @staticmethod
+    def _header_entry(item: dict) -> dict:
+        name = item["option"].split("/")[0].strip().lstrip("-")
+        return {
+            "name": name,
+            "kind": "header",
+            "detail": "",
+            "example": item.get("description", ""),
+        }
+
+    def __init__(self, entries: list[dict]):
+        self.root = _Node()
+        seen = set()
+        for rank, entry in enumerate(entries):
+            # filters.json lists some names twice (child, in, piece ...)
+            key = (entry["name"], entry["kind"])
+            if key in seen:
+                continue
+            seen.add(key)
+            entry["rank"] = rank
+            self._insert(entry)
+
+    def _insert(self, entry: dict):
+        node = self.root
+        self._keep(node, entry)
+        for char in entry["name"].lower():
+            node = node.children.setdefault(char, _Node())
+            self._keep(node, entry)
+
+    def _keep(self, node: _Node, entry: dict):
+        if len(node.top) < self.PER_NODE:
+            node.top.append(entry)
+
+    def complete(self, prefix: str, context: str = STATEMENT, limit: int = 20) -> list[dict]:
+        """Best entries starting with ``prefix`` for the editing ``context``."""
+        node = self.root
+        for char in prefix.lower():
+            node = node.children.get(char)
+            if node is None:
+                return []
+        kinds = CONTEXT_KINDS.get(context, CONTEXT_KINDS[STATEMENT])
+
+        def score(entry):
+            kind = entry["kind"]
+            # Position tests rank with filters outside of the arrow context
+            if kind == "position" and "position" not in kinds:
+                kind = "filter"
+            exact_case = not entry["name"].startswith(prefix)
+            return (kinds.index(kind), exact_case, len(entry["name"]), entry["rank"])
+
+        return sorted(node.top, key=score)[:limit]
+
+
+def context_at(line_before: str, in_header: bool) -> str:
+    """
+    Classify the cursor position: inside the ``cql(...)`` header, inside a
+    ``[...]`` piece designator, right after a ``->``/``-->`` arrow, or at a
+    statement.
+    """
+    if in_header:
+        return HEADER
+    if line_before.rfind("[") > line_before.rfind("]"):
+        return PIECE
+    word_start = len(line_before) - len(re.search(r"\w*$", line_before).group())
+    if ARROW_RE.search(line_before[:word_start]):
+        return AFTER_ARROW
+    return STATEMENT
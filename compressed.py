@@ -0,0 +1,149 @@
+"""
+Compressed PGN input.
+
+``.pgn.gz``, ``.pgn.bz2``, ``.pgn.xz`` and ``.pgn.zst`` files are never
+decompressed to disk. Each cql run gets a named pipe (FIFO) as its
+``-input`` and a PipeFeeder thread that decompresses the archive into it,
+so the scan starts at once and needs no temporary space. Games are
+counted by a StreamCounter over the same decompressed stream.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import shutil
+import subprocess
+import tempfile
+
+from PyQt5 import QtCore
+
+from blockpgn import BlockPgnReader, GameSplitter, is_block_pgn, open_pgn
+
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".xz", ".zst")
+CHUNK_SIZE = 1 << 20
+
+
+def is_compressed(path: str) -> bool:
+    return path.lower().endswith(COMPRESSED_SUFFIXES)
+
+
+def open_decompressed(path: str):
+    """Binary file object with the decompressed content of ``path``."""
+    if is_block_pgn(path):
+        return open_pgn(path)
+    lower = path.lower()
+    if lower.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if lower.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if lower.endswith(".xz"):
+        return lzma.open(path, "rb")
+    if lower.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+        if zstandard is not None:
+            reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+            return io.BufferedReader(reader, CHUNK_SIZE)
+        if shutil.which("zstd"):
+            process = subprocess.Popen(["zstd", "-dc", path], stdout=subprocess.PIPE)
+            return process.stdout
+        raise OSError("Reading .zst files needs the zstandard package or the zstd tool")
+    return open(path, "rb")
+
+
+class PipeFeeder(QtCore.QThread):
+    """
+    Decompresses ``path`` into a fresh FIFO until the reader is done.
+    ``span`` limits the stream to a byte range of the PGN text; for a
+    ``.pgnb`` file it can be given as ``gamenumbers`` instead, so only the
+    blocks holding those games are decompressed.
+    """
+
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(
+        self,
+        path: str,
+        parent=None,
+        gamenumbers: tuple[int, int] | None = None,
+        span: tuple[int, int] | None = None,
+    ):
+        super().__init__(parent)
+        self.path = path
+        self.span = span
+        if span is None and gamenumbers is not None and is_block_pgn(path):
+            with BlockPgnReader(path) as reader:
+                self.span = reader.span(*gamenumbers)
+        self.stopped = False
+        self.tempdir = tempfile.mkdtemp(prefix="qcql-pipe-")
+        # cql sees "<name>.pgn"
+        name = os.path.basename(path)
+        if is_compressed(name) or is_block_pgn(name):
+            name = os.path.splitext(name)[0]
+        if is_block_pgn(path):
+            name += ".pgn"
+        self.fifo = os.path.join(self.tempdir, name)
+        os.mkfifo(self.fifo)
+
+    def run(self):
+        try:
+            with open_decompressed(self.path) as source, open(self.fifo, "wb") as pipe:
+                remaining = None
+                if self.span is not None:
+                    source.seek(self.span[0])
+                    remaining = self.span[1] - self.span[0]
+                while not self.stopped and remaining != 0:
+                    size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+                    chunk = source.read(size)
+                    if not chunk:
+                        break
+                    pipe.write(chunk)
+                    if remaining is not None:
+                        remaining -= len(chunk)
+        except BrokenPipeError:
+            pass  # cql exited or was killed before reading everything
+        except (OSError, EOFError, ValueError, lzma.LZMAError) as e:
+            self.failed.emit(f"Could not decompress {self.path}: {e}")
+
+    def stop(self):
+        """Unblock and end the thread, then remove the FIFO."""
+        self.stopped = True
+        for _ in range(20):
+            if not self.isRunning():
+                break
+            # A writer still waiting for its reader is released by opening
+            # and closing the read end
+            try:
+                os.close(os.open(self.fifo, os.O_RDONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+            self.wait(100)
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+
+class StreamCounter(QtCore.QThread):
+    """Counts the games of a compressed PGN by their tag sections."""
+
+    countFinished = QtCore.pyqtSignal(int)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, path: str, parent=None):
+        super().__init__(parent)
+        self.path = path
+
+    def run(self):
+        count = 0
+        splitter = GameSplitter()
+        try:
+            with open_decompressed(self.path) as source:
+                for line in source:
+                    if splitter.starts_game(line):
+                        count += 1
+        except (OSError, EOFError, lzma.LZMAError) as e:
+            self.failed.emit(f"Could not decompress {self.path}: {e}")
+            return
+        self.countFinished.emit(count)
@@ -0,0 +1,222 @@
+"""
+Databases made of several PGN files.
+
+A PgnDatabase is a directory (or an explicit list) of PGN files searched as
+one target. Games are numbered globally in file order, so game 1 of the
+second file follows the last game of the first. Every file keeps its own
+game count and header index under ``data/index``; the DatabaseLoader
+computes them in parallel, and queries are fanned out as one job per file.
+"""
+
+import os
+
+from PyQt5 import QtCore
+
+from blockpgn import BLOCK_SUFFIX, BlockPgnReader, is_block_pgn
+from pgn_index import HeaderIndexWorker
+from process import CounterProcess
+
+SOURCE_TAG = "SourceFile"
+
+
+def tag_games(pgn_text: str, tag: str, value: str) -> str:
+    """Add ``[tag "value"]`` to the tag section of every game in ``pgn_text``."""
+    lines = []
+    in_tags = False
+    for line in pgn_text.splitlines():
+        if line.startswith("["):
+            if not in_tags:
+                lines.append(f'[{tag} "{value}"]')
+                in_tags = True
+        elif line.strip():
+            in_tags = False
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class PgnDatabase:
+    """Ordered PGN files with per-file counts and header indexes."""
+
+    def __init__(self, files: list[str]):
+        self.files = files
+        self.counts: dict[str, int] = {}
+        self.indexes: dict = {}
+
+    @classmethod
+    def from_path(cls, path: str) -> "PgnDatabase":
+        """A single file, or every ``.pgn``/``.pgnb`` file of a directory by name."""
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.lower().endswith((".pgn", BLOCK_SUFFIX))
+            )
+        else:
+            files = [path]
+        return cls(files)
+
+    @property
+    def name(self) -> str:
+        if len(self.files) == 1:
+            return os.path.basename(self.files[0])
+        folder = os.path.dirname(self.files[0]) if self.files else ""
+        return f"{os.path.basename(folder) or folder} ({len(self.files)} files)"
+
+    def __len__(self) -> int:
+        return sum(self.counts.values())
+
+    def counted(self) -> bool:
+        return len(self.counts) == len(self.files)
+
+    def indexed(self) -> bool:
+        return len(self.indexes) == len(self.files)
+
+    # ---------- Global game numbers ----------
+    def offset(self, pgnfile: str) -> int:
+        """Global number of the game before the first game of ``pgnfile``."""
+        total = 0
+        for name in self.files:
+            if name == pgnfile:
+                return total
+            total += self.counts.get(name, 0)
+        raise KeyError(pgnfile)
+
+    def locate(self, number: int) -> tuple[str, int]:
+        """``(file, game number in file)`` of global game ``number``."""
+        for name in self.files:
+            count = self.counts.get(name, 0)
+            if number <= count:
+                return name, number
+            number -= count
+        raise IndexError("game number out of range")
+
+    def split(self, numbers: list[int]) -> dict[str, list[int]]:
+        """Group ascending global game numbers by file, as local numbers."""
+        groups: dict[str, list[int]] = {}
+        position = 0
+        offset = 0
+        for name in self.files:
+            end = offset + self.counts.get(name, 0)
+            local = []
+            while position < len(numbers) and numbers[position] <= end:
+                local.append(numbers[position] - offset)
+                position += 1
+            if local:
+                groups[name] = local
+            offset = end
+        return groups
+
+    def select(self, predicates: list[tuple]) -> list[int]:
+        """Global numbers of the games matching header ``predicates``."""
+        numbers = []
+        offset = 0
+        for name in self.files:
+            numbers += [offset + n for n in self.indexes[name].select(predicates)]
+            offset += self.counts.get(name, 0)
+        return numbers
+
+
+class DatabaseLoader(QtCore.QObject):
+    """
+    Counts the games of every file and loads (or builds) its header index,
+    running up to ``parallel`` counters and index workers at a time.
+    """
+
+    fileCounted = QtCore.pyqtSignal(str, int)
+    countsReady = QtCore.pyqtSignal()
+    indexReady = QtCore.pyqtSignal(str, object)
+    indexesReady = QtCore.pyqtSignal()
+
+    def __init__(self, database: PgnDatabase, parallel: int = 0, parent=None):
+        super().__init__(parent)
+        self.database = database
+        self.parallel = parallel or os.cpu_count() or 1
+        self.to_count = list(database.files)
+        self.to_index = list(database.files)
+        self.workers: list[HeaderIndexWorker] = []
+
+    def start(self):
+        for _ in range(min(self.parallel, len(self.to_count))):
+            self._count_next()
+        # Index builds are Python-bound; two at a time keeps the UI responsive
+        for _ in range(min(2, self.parallel, len(self.to_index))):
+            self._index_next()
+
+    def _count_next(self):
+        if not self.to_count:
+            return
+        pgnfile = self.to_count.pop(0)
+        if is_block_pgn(pgnfile):
+            # The block table already knows the game count
+            try:
+                with BlockPgnReader(pgnfile) as reader:
+                    count = len(reader)
+            except (OSError, ValueError):
+                self.on_count_failed(pgnfile)
+            else:
+                self.on_counted(pgnfile, count)
+            return
+        counter = CounterProcess(self, pgnfile)
+        counter.countFinished.connect(lambda count: self.on_counted(pgnfile, count))
+        counter.errorOccurred.connect(
+            lambda error: self.on_count_failed(pgnfile)
+            if error == QtCore.QProcess.FailedToStart
+            else None
+        )
+        counter.start()
+
+    def on_counted(self, pgnfile: str, count: int):
+        self._set_count(pgnfile, count)
+        self._count_next()
+
+    def on_count_failed(self, pgnfile: str):
+        # The header index counts the games as well
+        self._count_next()
+
+    def _set_count(self, pgnfile: str, count: int):
+        new = pgnfile not in self.database.counts
+        self.database.counts[pgnfile] = count
+        if new:
+            self.fileCounted.emit(pgnfile, count)
+            if self.database.counted():
+                self.countsReady.emit()
+
+    def _index_next(self):
+        if not self.to_index:
+            return
+        pgnfile = self.to_index.pop(0)
+        worker = HeaderIndexWorker(self, pgnfile)
+        worker.finished.connect(self.on_index_ready)
+        self.workers.append(worker)
+        worker.start()
+
+    def on_index_ready(self, index):
+        self.database.indexes[index.pgnfile] = index
+        # The index numbers games exactly as cql does; trust it over the counter
+        self._set_count(index.pgnfile, len(index))
+        self.indexReady.emit(index.pgnfile, index)
+        if self.database.indexed():
+            self.indexesReady.emit()
+        self._index_next()
+
+    def refresh(self, pgnfile: str) -> bool:
+        """
+        Bring the index of ``pgnfile`` up to date after it changed on disk.
+        Returns False while that file is still being indexed; try later.
+        """
+        if pgnfile in self.to_index or any(
+            w.isRunning() and w.pgnfile == pgnfile for w in self.workers
+        ):
+            return False
+        self.database.indexes.pop(pgnfile, None)
+        worker = HeaderIndexWorker(self, pgnfile)
+        worker.finished.connect(self.on_index_ready)
+        self.workers.append(worker)
+        worker.start()
+        return True
+
+    def stop(self):
+        """Start nothing more and drop the results still in flight."""
+        self.to_count.clear()
+        self.to_index.clear()
+        self.blockSignals(True)
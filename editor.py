@@ -1,5 +1,7 @@
-from PyQt5.QtCore import Qt, QRegularExpression, QSize, QRect
+from PyQt5.QtCore import Qt, QSize, QRect
 from PyQt5.QtGui import (
+    QStandardItem,
+    QStandardItemModel,
     QSyntaxHighlighter,
     QTextCharFormat,
     QColor,
@@ -13,39 +15,218 @@ from PyQt5.QtWidgets import (
     QPlainTextEdit,
     QCompleter,
     QTextEdit,
+    QLineEdit,
+    QSpinBox,
     QApplication,
 )
 import sys
 import re
 
+from completion import CompletionIndex, context_at
+
+
+# ===================================================
+#                CQL keyword tables
+# ===================================================
+CQL_KEYWORDS = [
+    "abs",
+    "Aa",
+    "and",
+    "ascii",
+    "assert",
+    "atomic",
+    "between",
+    "black",
+    "btm",
+    "castle",
+    "check",
+    "child",
+    "child",
+    "comment",
+    "connectedpawns",
+    "consecutivemoves",
+    "countmoves",
+    "currentmove",
+    "currentposition",
+    "currenttransform",
+    "dark",
+    "date",
+    "depth",
+    "dictionary",
+    "distance",
+    "doubledpawns",
+    "down",
+    "echo",
+    "eco",
+    "elo",
+    "event",
+    "eventdate",
+    "false",
+    "fen",
+    "file",
+    "find",
+    "flip",
+    "flipcolor",
+    "fliphorizontal",
+    "flipvertical",
+    "from",
+    "function",
+    "gamenumber",
+    "hascomment",
+    "idealmate",
+    "idealstalemate",
+    "if",
+    "in",
+    "in",
+    "indexof",
+    "initial",
+    "initialposition",
+    "int",
+    "isbound",
+    "isolatedpawns",
+    "isunbound",
+    "lastgamenumber",
+    "lca",
+    "legal",
+    "left",
+    "pseudolegal",
+    "light",
+    "local",
+    "loop",
+    "lowercase",
+    "mainline",
+    "makesquare",
+    "mate",
+    "message",
+    "modelmate",
+    "modelstalemate",
+    "movenumber",
+    "northeast",
+    "northwest",
+    "not",
+    "notransform",
+    "nullmove",
+    "o-o",
+    "o-o-o",
+    "or",
+    "originalcomment",
+    "parent",
+    "passedpawns",
+    "path",
+    "pathcount",
+    "pathcountunfocused",
+    "pathlastposition",
+    "pathstatus",
+    "persistent",
+    "piece",
+    "piecename",
+    "piece",
+    "pieceid",
+    "pin",
+    "player",
+    "ply",
+    "position",
+    "positionid",
+    "power",
+    "primary",
+    "pseudolegal",
+    "puremate",
+    "purestalemate",
+    "rank",
+    "ray",
+    "readfile",
+    "removecomment",
+    "result",
+    "reversecolor",
+    "right",
+    "rotate45",
+    "rotate90",
+    "secondary",
+    "shift",
+    "shifthorizontal",
+    "shiftvertical",
+    "sidetomove",
+    "site",
+    "sort",
+    "sqrt",
+    "square",
+    "stalemate",
+    "tag",
+    "terminal",
+    "to",
+    "true",
+    "try",
+    "type",
+    "typename",
+    "unbind",
+    "up",
+    "uppercase",
+    "variation",
+    "virtualmainline",
+    "while",
+    "white",
+    "wtm",
+    "year",
+]
+CQL_FUNCTIONS = ["cql", "writefile", "readfile", "settag", "str", "max", "min"]
+
 
 # ===================================================
 #                Syntax Highlighter
 # ===================================================
 class SqlHighlighter(QSyntaxHighlighter):
     """
-    SQL Syntax Highlighter supporting:
-    - Keywords, functions
+    CQL syntax highlighter built on a single-pass lexer:
+    - Keywords, functions, piece designators and squares
     - Strings (single & double)
     - Numbers
     - Operators & punctuation
     - Single-line and multi-line comments
     Theme-aware colors.
+
+    Each block is lexed once into (start, length, format name) spans; the
+    only state carried between blocks is "inside a /* comment", so
+    QSyntaxHighlighter re-lexes the edited block and continues only while
+    that state changes. Spans are cached by (state, text) so rehighlighting
+    and repeated lines cost a dictionary lookup.
     """
 
+    TOKEN_RE = re.compile(
+        r"""
+        (?P<block_comment>/\*)
+        |(?P<line_comment>//.*)
+        |(?P<string>"[^"\\]*(?:\\.[^"\\]*)*"|'[^'\\]*(?:\\.[^'\\]*)*')
+        |(?P<number>\b\d+(?:\.\d+)?\b)
+        |(?P<word>[A-Za-z_][A-Za-z0-9_]*)
+        |(?P<operator>[+\-*/=<>|!&]+)
+        |(?P<open_paren>\()
+        |(?P<close_paren>\))
+        |(?P<open_bracket>\[)
+        |(?P<close_bracket>\])
+        |(?P<punct>[,;])
+        |(?P<dot>\.)
+        |(?P<other>\S)
+        """,
+        re.VERBOSE,
+    )
+    COMMENT_END_RE = re.compile(r"\*/")
+    IN_COMMENT = 1
+    CACHE_SIZE = 4096
+
+    PIECE_DESIGNATORS = frozenset(
+        ["a", "b", "k", "n", "p", "q", "r", "c", "d", "e", "f", "g", "h"]
+        + [f"{chr(file)}{rank}" for file in range(97, 105) for rank in range(1, 9)]
+    )
+    KEYWORDS = frozenset(k.lower() for k in CQL_KEYWORDS)
+    FUNCTIONS = frozenset(f.lower() for f in CQL_FUNCTIONS)
+
     def __init__(self, document, theme: str = "light"):
         super().__init__(document)
-        self.rules: list[tuple[QRegularExpression, QTextCharFormat]] = []
-        self.commentStart = QRegularExpression(r"/\*")
-        self.commentEnd = QRegularExpression(r"\*/")
         self.multiLineCommentFormat = QTextCharFormat()
         self.multiLineCommentFormat.setForeground(QColor("#6A9955"))  # green-ish
-
-        self._keyword_regex = None
-        self._function_regex = None
+        self._span_cache: dict[tuple[int, str], tuple[list, int]] = {}
 
         self._init_formats(theme)
-        self._compile_rules()
 
     # ---------- Theme handling ----------
     def _init_formats(self, theme: str):
@@ -78,271 +259,102 @@ class SqlHighlighter(QSyntaxHighlighter):
         self.fmt_piece_designator.setForeground(color("#950BB1", "#2FDBD3"))
         self.fmt_piece_designator.setFontWeight(QFont.Bold)
 
+        self._formats = {
+            "keyword": self.fmt_keyword,
+            "function": self.fmt_function,
+            "string": self.fmt_string,
+            "number": self.fmt_number,
+            "comment": self.fmt_comment,
+            "block_comment": self.multiLineCommentFormat,
+            "operator": self.fmt_operator,
+            "piece": self.fmt_piece_designator,
+        }
+
     def setTheme(self, theme: str):
         """Call this when toggling theme; then rehighlight."""
+        # Cached spans hold format names, so they stay valid across themes
         self._init_formats(theme)
-        self.rules.clear()
-        self._compile_rules()
         self.rehighlight()
 
-    # ---------- Patterns ----------
-    def _compile_rules(self):
-        keywords = [
-            "abs",
-            "Aa",
-            "and",
-            "ascii",
-            "assert",
-            "atomic",
-            "between",
-            "black",
-            "btm",
-            "castle",
-            "check",
-            "child",
-            "child",
-            "comment",
-            "connectedpawns",
-            "consecutivemoves",
-            "countmoves",
-            "currentmove",
-            "currentposition",
-            "currenttransform",
-            "dark",
-            "date",
-            "depth",
-            "dictionary",
-            "distance",
-            "doubledpawns",
-            "down",
-            "echo",
-            "eco",
-            "elo",
-            "event",
-            "eventdate",
-            "false",
-            "fen",
-            "file",
-            "find",
-            "flip",
-            "flipcolor",
-            "fliphorizontal",
-            "flipvertical",
-            "from",
-            "function",
-            "gamenumber",
-            "hascomment",
-            "idealmate",
-            "idealstalemate",
-            "if",
-            "in",
-            "in",
-            "indexof",
-            "initial",
-            "initialposition",
-            "int",
-            "isbound",
-            "isolatedpawns",
-            "isunbound",
-            "lastgamenumber",
-            "lca",
-            "legal",
-            "left",
-            "pseudolegal",
-            "light",
-            "local",
-            "loop",
-            "lowercase",
-            "mainline",
-            "makesquare",
-            "mate",
-            "message",
-            "modelmate",
-            "modelstalemate",
-            "movenumber",
-            "northeast",
-            "northwest",
-            "not",
-            "notransform",
-            "nullmove",
-            "o-o",
-            "o-o-o",
-            "or",
-            "originalcomment",
-            "parent",
-            "passedpawns",
-            "path",
-            "pathcount",
-            "pathcountunfocused",
-            "pathlastposition",
-            "pathstatus",
-            "persistent",
-            "piece",
-            "piecename",
-            "piece",
-            "pieceid",
-            "pin",
-            "player",
-            "ply",
-            "position",
-            "positionid",
-            "power",
-            "primary",
-            "pseudolegal",
-            "puremate",
-            "purestalemate",
-            "rank",
-            "ray",
-            "readfile",
-            "removecomment",
-            "result",
-            "reversecolor",
-            "right",
-            "rotate45",
-            "rotate90",
-            "secondary",
-            "shift",
-            "shifthorizontal",
-            "shiftvertical",
-            "sidetomove",
-            "site",
-            "sort",
-            "sqrt",
-            "square",
-            "stalemate",
-            "tag",
-            "terminal",
-            "to",
-            "true",
-            "try",
-            "type",
-            "typename",
-            "unbind",
-            "up",
-            "uppercase",
-            "variation",
-            "virtualmainline",
-            "while",
-            "white",
-            "wtm",
-            "year",
-        ]
-        functions = ["cql", "writefile", "readfile", "settag", "str", "max", "min"]
-        piece_designators = [
-            "A",
-            "a",
-            "B",
-            "b",
-            "K",
-            "k",
-            "N",
-            "n",
-            "P",
-            "p",
-            "Q",
-            "q",
-            "R",
-            "r",
-        ]
-        files = ["c", "d", "e", "f", "g", "h"]
-        squares = [
-            f"{chr(file)}{column}" for file in range(97, 105) for column in range(1, 9)
-        ]
-        piece_designators.extend(squares)
-        piece_designators.extend(files)
-        # Keywords
-        kw_pattern = r"\b(" + "|".join(keywords) + r")\b"
-        self._keyword_regex = QRegularExpression(kw_pattern)
-        self._keyword_regex.setPatternOptions(QRegularExpression.CaseInsensitiveOption)
-        self.rules.append((self._keyword_regex, self.fmt_keyword))
-
-        # Functions (before functions' '(' )
-        fn_pattern = r"\b(" + "|".join(functions) + r")(?=\s*\()"
-        self._function_regex = QRegularExpression(fn_pattern)
-        self._function_regex.setPatternOptions(QRegularExpression.CaseInsensitiveOption)
-        self.rules.append((self._function_regex, self.fmt_function))
-
-        # Parameters (everything inside parentheses)
-        param_pattern = r"\(([^)]*)\)"
-        self._param_regex = QRegularExpression(param_pattern)
-        self.rules.append((self._param_regex, self.fmt_string))
-
-        # Strings: single & double quotes (per-line)
-        self.rules.append(
-            (QRegularExpression(r"'[^'\\]*(\\.[^'\\]*)*'"), self.fmt_string)
-        )
-        self.rules.append(
-            (QRegularExpression(r'"[^"\\]*(\\.[^"\\]*)*"'), self.fmt_string)
-        )
-
-        # Numbers
-        self.rules.append((QRegularExpression(r"\b\d+(\.\d+)?\b"), self.fmt_number))
-
-        # /* */ comments
-        self.rules.append(
-            (
-                QRegularExpression(
-                    r"/\*.*?\*/", QRegularExpression.DotMatchesEverythingOption
-                ),
-                self.fmt_comment,
-            )
-        )
-        # inside brackets
-        self.rules.append(
-            (
-                QRegularExpression(r"\[.*?\]"),
-                self.fmt_keyword,
-            )
-        )
-        # Piece designators
-        pi_pattern = r"\b(" + "|".join(piece_designators) + r")\b"
-        self._pi_regex = QRegularExpression(pi_pattern)
-        self._pi_regex.setPatternOptions(QRegularExpression.CaseInsensitiveOption)
-        self.rules.append((self._pi_regex, self.fmt_piece_designator))
-
-        # Operators & punctuation
-        self.rules.append((QRegularExpression(r"[+\-*/=<>\|!&_]+"), self.fmt_operator))
-        self.rules.append((QRegularExpression(r"[(),;]"), self.fmt_operator))
-        self.rules.append((QRegularExpression(r"[.]"), self.fmt_keyword))
+    # ---------- Lexer ----------
+    def lex(self, text: str, in_comment: bool) -> tuple[list, int]:
+        """Spans ``(start, length, format name)`` and the block end state."""
+        spans = []
+        pos = 0
+        paren_depth = 0
+        bracket_depth = 0
+        if in_comment:
+            end = self.COMMENT_END_RE.search(text)
+            if end is None:
+                return [(0, len(text), "block_comment")], self.IN_COMMENT
+            spans.append((0, end.end(), "block_comment"))
+            pos = end.end()
+        while True:
+            m = self.TOKEN_RE.search(text, pos)
+            if m is None:
+                return spans, 0
+            kind = m.lastgroup
+            start, end = m.span()
+            pos = end
+            if kind == "block_comment":
+                close = self.COMMENT_END_RE.search(text, end)
+                if close is None:
+                    spans.append((start, len(text) - start, "block_comment"))
+                    return spans, self.IN_COMMENT
+                spans.append((start, close.end() - start, "block_comment"))
+                pos = close.end()
+                continue
+            name = self._classify(kind, m.group(), text, end, paren_depth, bracket_depth)
+            if kind == "open_paren":
+                paren_depth += 1
+            elif kind == "close_paren":
+                paren_depth = max(0, paren_depth - 1)
+            elif kind == "open_bracket":
+                bracket_depth += 1
+            elif kind == "close_bracket":
+                bracket_depth = max(0, bracket_depth - 1)
+            if name:
+                spans.append((start, end - start, name))
+
+    def _classify(self, kind, value, text, end, paren_depth, bracket_depth):
+        if kind == "line_comment":
+            return "comment"
+        if kind in ("string", "number", "operator"):
+            return kind
+        if kind in ("open_paren", "close_paren", "punct"):
+            return "operator"
+        if kind in ("open_bracket", "close_bracket", "dot"):
+            return "keyword"
+        if kind == "word":
+            word = value.lower()
+            if word in self.PIECE_DESIGNATORS:
+                return "piece"
+            if word in self.FUNCTIONS and text[end:].lstrip().startswith("("):
+                return "function"
+            if paren_depth:
+                # Parameters, e.g. cql(input foo.pgn)
+                return "string"
+            if word in self.KEYWORDS or bracket_depth:
+                return "keyword"
+            return None
+        # Any other character
+        if paren_depth:
+            return "string"
+        return "keyword" if bracket_depth else None
 
     # ---------- Highlight ----------
     def highlightBlock(self, text: str):
-        # Apply single-line rules
-        for regex, fmt in self.rules:
-            it = regex.globalMatch(text)
-            while it.hasNext():
-                m = it.next()
-                start = m.capturedStart()
-                length = m.capturedLength()
-                if start >= 0 and length > 0:
-                    self.setFormat(start, length, fmt)
-
-        # Handle multi-line comments /* ... */
-        self.setCurrentBlockState(0)
-
-        start_idx = 0
-        if self.previousBlockState() != 1:
-            start_match = self.commentStart.match(text, 0)
-            start_idx = start_match.capturedStart()
-        else:
-            start_idx = 0
-
-        while start_idx >= 0:
-            end_match = self.commentEnd.match(text, start_idx)
-            end_idx = end_match.capturedStart()
-
-            if end_idx == -1:
-                # Comment continues to next line
-                self.setFormat(
-                    start_idx, len(text) - start_idx, self.multiLineCommentFormat
-                )
-                self.setCurrentBlockState(1)
-                break
-            else:
-                length = end_idx - start_idx + end_match.capturedLength()
-                self.setFormat(start_idx, length, self.multiLineCommentFormat)
-                start_match = self.commentStart.match(text, start_idx + length)
-                start_idx = start_match.capturedStart()
+        in_comment = self.previousBlockState() == self.IN_COMMENT
+        key = (in_comment, text)
+        cached = self._span_cache.get(key)
+        if cached is None:
+            if len(self._span_cache) >= self.CACHE_SIZE:
+                self._span_cache.clear()
+            cached = self._span_cache[key] = self.lex(text, in_comment)
+        spans, state = cached
+        for start, length, name in spans:
+            self.setFormat(start, length, self._formats[name])
+        self.setCurrentBlockState(state)
 
 
 # ===================================================
@@ -367,6 +379,8 @@ class AutoCompleteTextEdit(QPlainTextEdit):
     def __init__(self, parent=None):
         super().__init__(parent)
         self._completer = None
+        self._completion_model = None
+        self._error_selections = []
 
         # line number area
         self.lineNumberArea = LineNumberArea(self)
@@ -462,7 +476,33 @@ class AutoCompleteTextEdit(QPlainTextEdit):
             selection.cursor = self.textCursor()
             selection.cursor.clearSelection()
             extraSelections.append(selection)
-        self.setExtraSelections(extraSelections)
+        self.setExtraSelections(extraSelections + self._error_selections)
+
+    # ---- SYNTAX ERRORS ----
+    def set_errors(self, errors: list):
+        """Underline the reported error locations (1-based line/column)."""
+        self._error_selections = []
+        for error in errors:
+            block = self.document().findBlockByNumber(max(error["line"], 1) - 1)
+            if not block.isValid():
+                block = self.document().lastBlock()
+            cursor = self.textCursor()
+            cursor.setPosition(block.position())
+            if error["column"] > 0:
+                cursor.movePosition(
+                    cursor.Right, cursor.MoveAnchor, min(error["column"] - 1, block.length() - 1)
+                )
+                cursor.select(cursor.WordUnderCursor)
+            if not cursor.hasSelection():
+                cursor.movePosition(cursor.EndOfBlock, cursor.KeepAnchor)
+            selection = QTextEdit.ExtraSelection()
+            selection.format.setUnderlineStyle(QTextCharFormat.WaveUnderline)
+            selection.format.setUnderlineColor(QColor(220, 38, 38))
+            selection.format.setToolTip(error["message"])
+            selection.cursor = cursor
+            self._error_selections.append(selection)
+        self.setToolTip("\n".join(e["message"] for e in errors))
+        self.highlightCurrentLine()
 
     # ---- AUTOCOMPLETE ----
     def setCompleter(self, completer: QCompleter):
@@ -475,6 +515,43 @@ class AutoCompleteTextEdit(QPlainTextEdit):
         completer.setCompletionMode(QCompleter.PopupCompletion)
         completer.activated.connect(self.insertCompletion)
 
+    def enableIndexCompletion(self):
+        """
+        Complete from the CompletionIndex trie instead of filtering a word
+        list: the model holds only the ranked candidates for the prefix.
+        """
+        self._completion_model = QStandardItemModel(self)
+        completer = QCompleter(self._completion_model, self)
+        completer.setCompletionRole(Qt.UserRole)
+        self.setCompleter(completer)
+        completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+
+    def completionContext(self) -> str:
+        tc = self.textCursor()
+        line_before = tc.block().text()[: tc.positionInBlock()]
+        in_header = False
+        # The cql(...) header sits at the top; only look there near the top
+        if tc.blockNumber() < 20:
+            text_before = self.toPlainText()[: tc.position()]
+            header = re.match(r"\s*cql\s*\(", text_before, re.I)
+            in_header = bool(header) and ")" not in text_before[header.end():]
+        return context_at(line_before, in_header)
+
+    def updateIndexCompletions(self, prefix: str) -> int:
+        entries = CompletionIndex.instance().complete(prefix, self.completionContext())
+        model = self._completion_model
+        model.clear()
+        for entry in entries:
+            label = entry["name"]
+            if entry["detail"]:
+                label += f"  {entry['detail']}"
+            item = QStandardItem(label)
+            item.setData(entry["name"], Qt.UserRole)
+            if entry["example"]:
+                item.setToolTip(entry["example"])
+            model.appendRow(item)
+        return len(entries)
+
     def completer(self):
         return self._completer
 
@@ -511,7 +588,12 @@ class AutoCompleteTextEdit(QPlainTextEdit):
             self._completer.popup().hide()
             return
 
-        self._completer.setCompletionPrefix(prefix)
+        if self._completion_model is not None:
+            if not self.updateIndexCompletions(prefix):
+                self._completer.popup().hide()
+                return
+        else:
+            self._completer.setCompletionPrefix(prefix)
         cr = self.cursorRect()
         cr.setWidth(
             self._completer.popup().sizeHintForColumn(0)
@@ -701,14 +783,33 @@ class SqlEditorWidget(QWidget):
         # --- Highlighter (theme-aware)
         self.highlighter = SqlHighlighter(self.editor.document(), theme="dark")
 
-        # --- Completer
-        completer = QCompleter(sorted(SQL_KEYWORDS_FOR_COMPLETER, key=str.lower))
-        completer.setCaseSensitivity(Qt.CaseInsensitive)
-        completer.setFilterMode(Qt.MatchContains)
-        self.editor.setCompleter(completer)
+        # --- Completer (trie over data/filters.json, loaded on first use)
+        self.editor.enableIndexCompletion()
+
+        # --- Header predicates pushed down before CQL runs
+        self.header_filter = QLineEdit(self)
+        self.header_filter.setPlaceholderText(
+            'Header filter, e.g. player:"Carlsen, Magnus" year:2015-2020 elo:>=2600'
+        )
+        self.header_filter.setToolTip(
+            "Fields: player, white, black, event, result, year, elo, whiteelo, "
+            "blackelo, material (e.g. material:KRvKB)"
+        )
+        self.header_filter.setClearButtonEnabled(True)
+        controls.addWidget(self.header_filter)
+
+        # --- Early termination while developing a query
+        self.first_matches = QSpinBox(self)
+        self.first_matches.setRange(0, 100000)
+        self.first_matches.setSingleStep(10)
+        self.first_matches.setPrefix("Stop after: ")
+        self.first_matches.setSpecialValueText("All matches")
+        self.first_matches.setToolTip("Pause the scan once this many games match")
+        controls.addWidget(self.first_matches)
 
         # --- Buttons / Controls
         root.addLayout(controls)
+
     def _fallback_uppercase_keywords(self, sql: str) -> str:
         # Minimal, non-invasive fallback: uppercase known tokens when bounded by word boundaries
 
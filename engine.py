@@ -1,93 +1,308 @@
 from typing import Literal
 
+import chess
 from PyQt5 import QtCore
 
 
+def parse_info(line: str) -> dict | None:
+    """Parse a UCI ``info`` line into a dict with multipv, depth, score and pv."""
+    tokens = line.split()
+    if not tokens or tokens[0] != "info" or "pv" not in tokens:
+        return None
+    info = {"multipv": 1, "depth": 0, "score": None, "pv": []}
+    i = 1
+    while i < len(tokens):
+        token = tokens[i]
+        if token == "pv":
+            info["pv"] = tokens[i + 1 :]
+            break
+        if token in ("multipv", "depth") and i + 1 < len(tokens):
+            try:
+                info[token] = int(tokens[i + 1])
+            except ValueError:
+                pass
+            i += 2
+            continue
+        if token == "score" and i + 2 < len(tokens):
+            try:
+                info["score"] = (tokens[i + 1], int(tokens[i + 2]))
+            except ValueError:
+                pass
+            i += 3
+            continue
+        i += 1
+    return info
+
+
+def format_score(score: tuple[str, int] | None, turn: bool) -> str:
+    """Format a side-to-move UCI score from white's point of view."""
+    if score is None:
+        return ""
+    kind, value = score
+    if turn == chess.BLACK:
+        value = -value
+    if kind == "mate":
+        return f"M{value}" if value > 0 else f"-M{abs(value)}"
+    return f"{value / 100:+.2f}"
+
+
+class PVFormatter:
+    """
+    Incremental UCI-to-SAN conversion for a single root position.
+
+    The board stays at the end of the previous PV, so a new PV sharing its
+    first k moves only pops back to ply k and pushes the remaining moves.
+    """
+
+    def __init__(self, fen: str = chess.STARTING_FEN):
+        self.reset(fen)
+
+    def reset(self, fen: str):
+        self.board = chess.Board(fen)
+        self.moves: list[str] = []
+        self.tokens: list[str] = []
+
+    def format(self, pv: list[str] | tuple[str, ...]) -> str | None:
+        """Return the numbered SAN text for ``pv`` or None if it is illegal."""
+        common = 0
+        for old, new in zip(self.moves, pv):
+            if old != new:
+                break
+            common += 1
+        while len(self.moves) > common:
+            self.board.pop()
+            self.moves.pop()
+            self.tokens.pop()
+        for uci in pv[common:]:
+            try:
+                move = chess.Move.from_uci(uci)
+            except ValueError:
+                return None
+            if not self.board.is_legal(move):
+                return None
+            san = self.board.san(move)
+            if self.board.turn == chess.WHITE:
+                san = f"{self.board.fullmove_number}. {san}"
+            elif not self.moves:
+                san = f"{self.board.fullmove_number}... {san}"
+            self.board.push(move)
+            self.moves.append(uci)
+            self.tokens.append(san)
+        return " ".join(self.tokens)
+
+
+class MultiPVTable:
+    """
+    Fixed-size table with the engine's best N lines for a single position.
+
+    SAN is computed once per PV change by a PVFormatter per row, which
+    reuses the SAN of the moves the new PV shares with the previous one.
+    """
+
+    def __init__(self, size: int = 1):
+        self.size = max(1, size)
+        self.fen = chess.STARTING_FEN
+        self.lines: list[dict | None] = [None] * self.size
+        self._formatters = [PVFormatter(self.fen) for _ in range(self.size)]
+
+    def reset(self, fen: str):
+        self.fen = fen
+        self.lines = [None] * self.size
+        for formatter in self._formatters:
+            formatter.reset(fen)
+
+    def resize(self, size: int):
+        self.size = max(1, size)
+        self.lines = (self.lines + [None] * self.size)[: self.size]
+        self._formatters = (
+            self._formatters
+            + [PVFormatter(self.fen) for _ in range(self.size)]
+        )[: self.size]
+
+    def update(self, info: dict) -> int | None:
+        """Store an info dict; returns the updated row index or None."""
+        index = info.get("multipv", 1) - 1
+        if not 0 <= index < self.size or not info.get("pv"):
+            return None
+        pv = tuple(info["pv"])
+        current = self.lines[index]
+        if current is not None and current["pv"] == pv:
+            san = current["san"]
+        else:
+            san = self._formatters[index].format(pv)
+            if san is None:
+                return None
+        turn = chess.Board(self.fen).turn
+        self.lines[index] = {
+            "depth": info.get("depth", 0),
+            "score": info.get("score"),
+            "score_text": format_score(info.get("score"), turn),
+            "pv": pv,
+            "san": san,
+        }
+        return index
+
+
 class ChessEngine(QtCore.QProcess):
     moveFound = QtCore.pyqtSignal(str)
     depthChanged = QtCore.pyqtSignal(int)
     lineFound = QtCore.pyqtSignal(list)
     cpScoreFound = QtCore.pyqtSignal(int)
     mateFound = QtCore.pyqtSignal(int)
+    pvUpdated = QtCore.pyqtSignal(dict)
+    readyOk = QtCore.pyqtSignal()
 
-    def __init__(self, engine_path, parent=None):
+    def __init__(self, engine_path, parent=None, options: dict | None = None):
         super().__init__(parent)
         self.engine_path = engine_path
+        self.options = dict(options or {})
+        self.multipv = 1
+        self.ready = False
+        self.was_ready = False  # answered readyok since it was last started
+        self._pending: list[str] = []
+        self._restart_pending = False
         self.setProcessChannelMode(QtCore.QProcess.MergedChannels)
         self.setProgram(self.engine_path)
         self.readyReadStandardOutput.connect(self.read_data)
         self.stateChanged.connect(self.on_state_changed)
+        self.started.connect(self.on_started)
+        self.finished.connect(self.on_finished)
 
     def read_data(self):
-        data = self.readAllStandardOutput().data().decode()
-        if "uciok" in data:
-            self.write("isready\n".encode())
-        pattern = QtCore.QRegularExpression(r"(depth\s+)(\d+)")
-        depth = pattern.match(data)
-        if depth.hasMatch():
-            self.depthChanged.emit(int(depth.captured(2)))
-        pattern = QtCore.QRegularExpression(r"(bestmove\s+)(\w+)")
-        best_move = pattern.match(data)
-
-        if best_move.hasMatch():
-            self.moveFound.emit(best_move.captured(2))
-        pv_pattern = QtCore.QRegularExpression(r"(pv\s+)(.*)")
-        pv_match = pv_pattern.match(data)
-        if pv_match.hasMatch():
-            pv_moves = pv_match.captured(2).split("pv")[-1].split()
-            self.lineFound.emit(pv_moves)
-        cp_pattern = QtCore.QRegularExpression(r"score cp (-?\d+)")
-        cp_match = cp_pattern.match(data)
-        if cp_match.hasMatch():
-            self.cpScoreFound.emit(int(cp_match.captured(1)))
-        if "mate" in data:
-            mate_pattern = QtCore.QRegularExpression(r"score mate (-?\d+)")
-            for line in data.splitlines():
-                mate_match = mate_pattern.match(line)
-                if mate_match.hasMatch():
-                    self.mateFound.emit(int(mate_match.captured(1)))
-            for line in data.splitlines():
-                match_pv = pv_pattern.match(line)
-                parts = match_pv.captured(0).split("pv")
-                if len(parts) > 2:
-                    moves = parts[-1].split()
-                    self.lineFound.emit(moves)
+        while self.canReadLine():
+            line = self.readLine().data().decode(errors="replace").strip()
+            if line:
+                self.handle_line(line)
+
+    def handle_line(self, line: str):
+        if line == "uciok":
+            for name, value in self.options.items():
+                self._write(f"setoption name {name} value {value}")
+            if self.multipv != 1:
+                # Restarted under a viewer showing several lines
+                self._write(f"setoption name MultiPV value {self.multipv}")
+            self._write("isready")
+            return
+        if line == "readyok":
+            if not self.ready:
+                self.ready = True
+                self.was_ready = True
+                for command in self._pending:
+                    self._write(command)
+                self._pending.clear()
+                self.readyOk.emit()
+            return
+        if line.startswith("bestmove"):
+            parts = line.split()
+            if len(parts) > 1:
+                self.moveFound.emit(parts[1])
+            return
+        info = parse_info(line)
+        if info is None:
+            return
+        self.pvUpdated.emit(info)
+        if info["multipv"] != 1:
+            return
+        self.depthChanged.emit(info["depth"])
+        self.lineFound.emit(info["pv"])
+        if info["score"] is not None:
+            kind, value = info["score"]
+            if kind == "cp":
+                self.cpScoreFound.emit(value)
+            elif kind == "mate":
+                self.mateFound.emit(value)
 
     def set_threads(self, threads):
-        self.write(f"setoption name Threads value {threads}\n".encode())
+        self.set_option("Threads", threads)
+
+    def set_option(self, name: str, value):
+        self.options[name] = value
+        self.send_command(f"setoption name {name} value {value}")
+
+    def set_multipv(self, count: int):
+        self.multipv = max(1, count)
+        self.send_command(f"setoption name MultiPV value {self.multipv}")
 
     def send_position(
-        self, position: str, mode: Literal["depth", "time"], options: dict
+        self, position: str, mode: Literal["depth", "time", "nodes"], options: dict
     ):
         self.send_command(f"position fen {position}")
         if mode == "depth":
-            self.send_command(f"go depth {options.get("depth")}")
+            self.send_command(f"go depth {options.get('depth')}")
         elif mode == "time":
-            self.send_command(f"go time {options.get("time")}")
+            self.send_command(f"go movetime {options.get('time')}")
+        elif mode == "nodes":
+            self.send_command(f"go nodes {options.get('nodes')}")
 
-    def set_settings(self, settings: dict):
-        if self.state() == QtCore.QProcess.Running:
-            self.quit()
-            self.waitForFinished()
-            self.engine_path = settings["path"]
+    def start_uci(self):
+        """Start the process without blocking; readyOk fires once it is usable."""
+        if self.is_running():
+            return
+        self.ready = False
+        self.was_ready = False
         self.setProgram(self.engine_path)
-        self.set_threads(settings["threads"])
         self.start()
-        self.waitForReadyRead()
-        self.send_command("uci")
+
+    def set_settings(self, settings: dict):
+        """Apply path/threads/hash; restarts the process only if the path changed."""
+        if "threads" in settings:
+            self.options["Threads"] = settings["threads"]
+        if "hash" in settings:
+            self.options["Hash"] = settings["hash"]
+        path = settings.get("path", self.engine_path)
+        if not self.is_running():
+            self.engine_path = path
+            self.start_uci()
+            return
+        if path == self.engine_path:
+            self.send_command("stop")
+            for name, value in self.options.items():
+                self.send_command(f"setoption name {name} value {value}")
+            return
+        self.engine_path = path
+        self._restart_pending = True
+        self._write("quit")
+
+    def resync(self):
+        """
+        Hold back further commands until the engine answers ``isready``.
+        Its ``readyok`` comes after everything printed for earlier commands,
+        such as the ``bestmove`` of a stopped search.
+        """
+        if not self.ready:
+            return  # commands are already held until the first readyok
+        self.ready = False
+        self._write("isready")
 
     def send_command(self, command: str):
+        if self.state() == QtCore.QProcess.NotRunning:
+            return  # dead and not restarting; nothing would ever read it
+        if not self.ready:
+            self._pending.append(command)
+            return
+        self._write(command)
+
+    def _write(self, command: str):
         if self.state() == QtCore.QProcess.Running and self.isWritable():
             self.write(f"{command}\n".encode())
 
     def quit(self):
         if self.state() == QtCore.QProcess.Running:
-            self.send_command("quit")
+            self._write("quit")
             self.waitForFinished()
 
     def is_running(self):
         return self.state() == QtCore.QProcess.Running
 
+    def on_started(self):
+        self._write("uci")
+
+    def on_finished(self, _, __):
+        self.ready = False
+        if self._restart_pending:
+            self._restart_pending = False
+            self.start_uci()
+
     def on_state_changed(self, state):
         if state == QtCore.QProcess.Running:
             print("Engine is running")
@@ -0,0 +1,222 @@
+import json
+
+from PyQt5 import QtCore, QtWidgets
+
+from engine import ChessEngine
+
+ENGINE_CONFIG_FILE = "data/engine.json"
+DEFAULT_ENGINE_CONFIG = {
+    "path": "stockfish",
+    "threads": 1,
+    "hash": 64,
+    "warm_engines": 1,
+    "max_engines": 4,
+    "analysis_depth": 60,
+    "batch_mode": "nodes",
+    "batch_budget": 200000,
+    "batch_max_plies": 160,
+    # Cached evals at least this deep are reused by batch runs that search
+    # by nodes or time; depth runs reuse those as deep as their budget
+    "batch_cache_depth": 18,
+}
+
+
+def load_engine_config() -> dict:
+    config = dict(DEFAULT_ENGINE_CONFIG)
+    try:
+        with open(ENGINE_CONFIG_FILE, "r") as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print("Error loading engine config.", e)
+    return config
+
+
+def save_engine_config(config: dict):
+    with open(ENGINE_CONFIG_FILE, "w") as f:
+        json.dump(config, f, indent=4)
+
+
+class EnginePool(QtCore.QObject):
+    """
+    Application-wide pool of warm UCI engines shared by all viewer windows.
+
+    Engines are started in the background with ``uci``/``isready`` done and
+    Hash/Threads applied from one config. Viewers lease an engine, connect
+    to its signals and release it when done; at most ``max_engines``
+    processes ever exist. A released engine only goes back to the idle
+    list once it has answered ``readyok``, so the output of its last search
+    never reaches the next viewer. An engine that crashes after it was
+    working is restarted in place while leased, so its viewer keeps it, and
+    replaced otherwise; one that fails to start is dropped.
+    """
+
+    engineReleased = QtCore.pyqtSignal()
+
+    _instance = None
+
+    @classmethod
+    def instance(cls) -> "EnginePool":
+        if cls._instance is None:
+            cls._instance = EnginePool()
+        return cls._instance
+
+    def __init__(self, config: dict | None = None, parent=None):
+        super().__init__(parent)
+        self.config = config or load_engine_config()
+        self.idle: list[ChessEngine] = []
+        self.leased: list[ChessEngine] = []
+        self.draining: list[ChessEngine] = []  # released, waiting for readyok
+
+    def engine_options(self) -> dict:
+        return {"Threads": self.config["threads"], "Hash": self.config["hash"]}
+
+    def warm_up(self):
+        """Start idle engines until ``warm_engines`` are available."""
+        while len(self.idle) < self.config["warm_engines"] and self._can_spawn():
+            self.idle.append(self._spawn())
+
+    def lease(self) -> ChessEngine | None:
+        """Return an engine, preferring one that already answered readyok."""
+        engine = next((e for e in self.idle if e.ready), None)
+        if engine is None and self.idle:
+            engine = self.idle[0]
+        if engine is None and self._can_spawn():
+            engine = self._spawn()
+        if engine is None:
+            return None
+        if engine in self.idle:
+            self.idle.remove(engine)
+        self.leased.append(engine)
+        self.warm_up()
+        return engine
+
+    def release(self, engine: ChessEngine):
+        if engine not in self.leased:
+            return
+        self.leased.remove(engine)
+        if not engine.is_running():
+            engine.deleteLater()
+            self.warm_up()
+            return
+        engine.send_command("stop")
+        engine.set_multipv(1)
+        engine.send_command("ucinewgame")
+        engine.resync()
+        self.draining.append(engine)
+
+    def available(self) -> int:
+        return len(self.idle) + self.config["max_engines"] - self._count()
+
+    def apply_config(self, config: dict):
+        """Share new path/threads/hash settings with every pooled engine."""
+        self.config.update(config)
+        save_engine_config(self.config)
+        settings = {
+            "path": self.config["path"],
+            "threads": self.config["threads"],
+            "hash": self.config["hash"],
+        }
+        for engine in self.idle + self.leased + self.draining:
+            engine.set_settings(settings)
+
+    def shutdown(self):
+        for engine in self.idle + self.leased + self.draining:
+            engine.quit()
+        self.idle.clear()
+        self.leased.clear()
+        self.draining.clear()
+
+    def _count(self) -> int:
+        return len(self.idle) + len(self.leased) + len(self.draining)
+
+    def _can_spawn(self) -> bool:
+        return self._count() < self.config["max_engines"]
+
+    def _spawn(self) -> ChessEngine:
+        engine = ChessEngine(self.config["path"], self, self.engine_options())
+        engine.finished.connect(lambda *_, e=engine: self._on_engine_finished(e))
+        engine.errorOccurred.connect(
+            lambda error, e=engine: self._on_engine_error(e, error)
+        )
+        engine.readyOk.connect(lambda e=engine: self._on_engine_ready(e))
+        engine.start_uci()
+        return engine
+
+    def _on_engine_ready(self, engine: ChessEngine):
+        if engine in self.draining:
+            self.draining.remove(engine)
+            self.idle.append(engine)
+            self.engineReleased.emit()
+
+    def _on_engine_finished(self, engine: ChessEngine):
+        # An engine restarting for a new path is already starting again here
+        if engine.state() != QtCore.QProcess.NotRunning:
+            return
+        # Only respawn engines that worked: a binary that crashes at once
+        # would otherwise be restarted forever
+        respawn = (
+            engine.exitStatus() == QtCore.QProcess.CrashExit and engine.was_ready
+        )
+        if engine in self.leased:
+            if respawn:
+                # Commands its viewer sent meanwhile run once it is ready again
+                engine.start_uci()
+            return  # otherwise dropped when it is released
+        self._drop(engine)
+        if respawn:
+            self.warm_up()
+
+    def _on_engine_error(self, engine: ChessEngine, error):
+        if error == QtCore.QProcess.FailedToStart and engine not in self.leased:
+            self._drop(engine)
+
+    def _drop(self, engine: ChessEngine):
+        for engines in (self.idle, self.draining):
+            if engine in engines:
+                engines.remove(engine)
+                engine.deleteLater()
+
+
+class EngineSettingsDialog(QtWidgets.QDialog):
+    """Engine path, threads and hash for every pooled engine."""
+
+    def __init__(self, config: dict, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Engine Settings")
+        self.path_edit = QtWidgets.QLineEdit(config["path"], self)
+        browse = QtWidgets.QPushButton("Browse...", self)
+        browse.clicked.connect(self.browse)
+        path_row = QtWidgets.QHBoxLayout()
+        path_row.addWidget(self.path_edit)
+        path_row.addWidget(browse)
+        self.threads_spin = QtWidgets.QSpinBox(self)
+        self.threads_spin.setRange(1, 512)
+        self.threads_spin.setValue(config["threads"])
+        self.hash_spin = QtWidgets.QSpinBox(self)
+        self.hash_spin.setRange(1, 1 << 20)
+        self.hash_spin.setSuffix(" MB")
+        self.hash_spin.setValue(config["hash"])
+        buttons = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel, self
+        )
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        form = QtWidgets.QFormLayout(self)
+        form.addRow("Engine", path_row)
+        form.addRow("Threads", self.threads_spin)
+        form.addRow("Hash", self.hash_spin)
+        form.addRow(buttons)
+
+    def browse(self):
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Select UCI Engine")
+        if path:
+            self.path_edit.setText(path)
+
+    def values(self) -> dict:
+        return {
+            "path": self.path_edit.text().strip(),
+            "threads": self.threads_spin.value(),
+            "hash": self.hash_spin.value(),
+        }
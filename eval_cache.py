@@ -0,0 +1,129 @@
+import atexit
+import sqlite3
+import time
+
+import chess
+import chess.polyglot
+
+EVAL_CACHE_FILE = "data/evalcache.sqlite"
+
+
+def position_key(fen: str) -> int:
+    """Zobrist hash of the position as a signed 64-bit SQLite integer."""
+    key = chess.polyglot.zobrist_hash(chess.Board(fen))
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+class EvalCache:
+    """
+    On-disk store of engine evaluations keyed by position hash.
+
+    Each entry keeps depth, score and PV of the deepest search seen for the
+    position (depth-preferred replacement). When the table grows past
+    ``max_entries`` the least recently used entries are evicted.
+
+    Writes are committed in batches, every ``COMMIT_EVERY`` changes or
+    ``COMMIT_SECONDS``, and at exit; a crash loses at most that much.
+    """
+
+    COMMIT_EVERY = 64
+    COMMIT_SECONDS = 5.0
+
+    _instance = None
+
+    @classmethod
+    def instance(cls) -> "EvalCache":
+        if cls._instance is None:
+            cls._instance = EvalCache()
+        return cls._instance
+
+    def __init__(self, path: str = EVAL_CACHE_FILE, max_entries: int = 500000):
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS evals (
+                key INTEGER PRIMARY KEY,
+                depth INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                value INTEGER NOT NULL,
+                pv TEXT NOT NULL,
+                used REAL NOT NULL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS evals_used ON evals (used)")
+        self.conn.commit()
+        self._count = self.conn.execute("SELECT COUNT(*) FROM evals").fetchone()[0]
+        self._changes = 0
+        self._committed_at = time.monotonic()
+        atexit.register(self.flush)
+
+    def get(self, fen: str) -> dict | None:
+        key = position_key(fen)
+        row = self.conn.execute(
+            "SELECT depth, kind, value, pv FROM evals WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.conn.execute("UPDATE evals SET used = ? WHERE key = ?", (time.time(), key))
+        self._changed()
+        depth, kind, value, pv = row
+        return {"multipv": 1, "depth": depth, "score": (kind, value), "pv": pv.split()}
+
+    def put(self, fen: str, info: dict):
+        """Store a multipv-1 info dict unless a deeper entry already exists."""
+        if not info.get("score") or not info.get("pv"):
+            return
+        key = position_key(fen)
+        kind, value = info["score"]
+        values = (info["depth"], kind, value, " ".join(info["pv"]), time.time(), key)
+        row = self.conn.execute(
+            "SELECT depth FROM evals WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.conn.execute(
+                "INSERT INTO evals (depth, kind, value, pv, used, key) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                values,
+            )
+            self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+        elif info["depth"] >= row[0]:
+            self.conn.execute(
+                "UPDATE evals SET depth = ?, kind = ?, value = ?, pv = ?, used = ? "
+                "WHERE key = ?",
+                values,
+            )
+        else:
+            return
+        self._changed()
+
+    def _changed(self):
+        self._changes += 1
+        if (
+            self._changes >= self.COMMIT_EVERY
+            or time.monotonic() - self._committed_at >= self.COMMIT_SECONDS
+        ):
+            self.flush()
+
+    def flush(self):
+        """Commit the pending writes."""
+        if self._changes:
+            self.conn.commit()
+            self._changes = 0
+        self._committed_at = time.monotonic()
+
+    def _evict(self):
+        # Drop an extra 10% so eviction does not run on every insert
+        excess = self._count - int(self.max_entries * 0.9)
+        self.conn.execute(
+            "DELETE FROM evals WHERE key IN "
+            "(SELECT key FROM evals ORDER BY used LIMIT ?)",
+            (excess,),
+        )
+        self._count -= excess
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        self.conn.close()
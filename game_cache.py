@@ -0,0 +1,236 @@
+"""
+Binary game cache.
+
+Parsing PGN with python-chess means parsing every SAN move and checking
+it is legal. The game cache stores each game once it has been parsed, in a
+compact form that is rebuilt into a ``chess.pgn.Game`` without any of
+that: the viewer and position-search results load games from it directly.
+
+It is filled during the position index pass, which parses every game
+anyway, and is kept next to the other indexes under ``data/index``.
+Set ``game_cache`` to false in data/index.json to skip it.
+
+Encoding of one game::
+
+    varint  tag count, then (name, value) pairs as codes into the
+            string table shared by every game of the file
+    node    the game root, then its children depth-first
+
+    node:   u16 move (not for the root): from | to << 6 | promotion << 12
+            u8 flags: 1 comment, 2 starting comment, 4 nags
+            [varint length + UTF-8 comment] [same for the starting comment]
+            [varint nag count + one byte per nag]
+            varint number of variations, then each of them
+"""
+
+import json
+import os
+import pickle
+from array import array
+
+import chess
+import chess.pgn
+
+from pgn_index import index_dir
+
+INDEX_CONFIG_FILE = "data/index.json"
+DEFAULT_INDEX_CONFIG = {
+    "game_cache": True,
+}
+
+COMMENT = 1
+STARTING_COMMENT = 2
+NAGS = 4
+
+
+def load_index_config() -> dict:
+    config = dict(DEFAULT_INDEX_CONFIG)
+    try:
+        with open(INDEX_CONFIG_FILE, "r") as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print("Error loading index config.", e)
+    return config
+
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_text(out: bytearray, text: str):
+    raw = text.encode("utf-8")
+    _write_varint(out, len(raw))
+    out += raw
+
+
+def _read_text(data: bytes, pos: int) -> tuple[str, int]:
+    length, pos = _read_varint(data, pos)
+    return data[pos : pos + length].decode("utf-8"), pos + length
+
+
+def encode_game(game: chess.pgn.Game, codes: dict[str, int], strings: list[str]) -> bytes:
+    """
+    Encode ``game``. Tag names and values are looked up in ``codes`` and
+    appended to ``strings`` when new.
+    """
+    out = bytearray()
+
+    def code(text: str) -> int:
+        number = codes.get(text)
+        if number is None:
+            number = codes[text] = len(strings)
+            strings.append(text)
+        return number
+
+    _write_varint(out, len(game.headers))
+    for name, value in game.headers.items():
+        _write_varint(out, code(name))
+        _write_varint(out, code(value))
+
+    # Depth-first without recursion: long games are deeper than the
+    # interpreter's recursion limit
+    stack = [game]
+    while stack:
+        node = stack.pop()
+        if node.parent is not None:
+            move = node.move
+            out += (
+                move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+            ).to_bytes(2, "little")
+        starting_comment = getattr(node, "starting_comment", "")
+        flags = (
+            (COMMENT if node.comment else 0)
+            | (STARTING_COMMENT if starting_comment else 0)
+            | (NAGS if node.nags else 0)
+        )
+        out.append(flags)
+        if node.comment:
+            _write_text(out, node.comment)
+        if starting_comment:
+            _write_text(out, starting_comment)
+        if node.nags:
+            nags = sorted(nag for nag in node.nags if nag < 256)
+            _write_varint(out, len(nags))
+            out += bytes(nags)
+        _write_varint(out, len(node.variations))
+        stack.extend(reversed(node.variations))
+    return bytes(out)
+
+
+def _read_node(node: chess.pgn.GameNode, data: bytes, pos: int) -> tuple[int, int]:
+    """Fill in the annotations of ``node``; returns its variation count."""
+    flags = data[pos]
+    pos += 1
+    if flags & COMMENT:
+        node.comment, pos = _read_text(data, pos)
+    if flags & STARTING_COMMENT:
+        node.starting_comment, pos = _read_text(data, pos)
+    if flags & NAGS:
+        count, pos = _read_varint(data, pos)
+        node.nags = set(data[pos : pos + count])
+        pos += count
+    return _read_varint(data, pos)
+
+
+def decode_game(data: bytes, strings: list[str]) -> chess.pgn.Game:
+    """Rebuild a game from ``encode_game`` output; no move is parsed or checked."""
+    count, pos = _read_varint(data, 0)
+    headers = []
+    for _ in range(count):
+        name, pos = _read_varint(data, pos)
+        value, pos = _read_varint(data, pos)
+        headers.append((strings[name], strings[value]))
+    game = chess.pgn.Game(headers)
+    children, pos = _read_node(game, data, pos)
+    # [node, variations still to read], innermost last
+    pending = [[game, children]]
+    while pending:
+        entry = pending[-1]
+        if not entry[1]:
+            pending.pop()
+            continue
+        entry[1] -= 1
+        value = int.from_bytes(data[pos : pos + 2], "little")
+        pos += 2
+        move = chess.Move(value & 63, value >> 6 & 63, value >> 12 or None)
+        node = chess.pgn.ChildNode(entry[0], move)
+        children, pos = _read_node(node, data, pos)
+        pending.append([node, children])
+    return game
+
+
+class GameCache:
+    """Encoded games of one PGN file, numbered like its header index."""
+
+    VERSION = 1
+
+    def __init__(self, pgnfile: str):
+        self.pgnfile = pgnfile
+        self.strings: list[str] = []
+        self.codes: dict[str, int] = {}
+        self.offsets = array("Q", [0])
+        self.data = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def add(self, game: chess.pgn.Game | None):
+        """Append the next game; None keeps the numbering for an unreadable one."""
+        if game is not None:
+            self.data += encode_game(game, self.codes, self.strings)
+        self.offsets.append(len(self.data))
+
+    def truncate(self, count: int):
+        """Keep games 1..``count`` only."""
+        del self.data[self.offsets[count] :]
+        del self.offsets[count + 1 :]
+
+    def game(self, number: int) -> chess.pgn.Game | None:
+        if not 1 <= number <= len(self):
+            return None
+        start, end = self.offsets[number - 1], self.offsets[number]
+        if start == end:
+            return None
+        return decode_game(bytes(self.data[start:end]), self.strings)
+
+    # ---------- Persistence ----------
+    @staticmethod
+    def path_for(pgnfile: str) -> str:
+        return os.path.join(index_dir(pgnfile), "games.bin")
+
+    def save(self):
+        state = (self.VERSION, self.strings, self.offsets, bytes(self.data))
+        with open(self.path_for(self.pgnfile), "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, pgnfile: str) -> "GameCache | None":
+        try:
+            with open(cls.path_for(pgnfile), "rb") as f:
+                version, strings, offsets, data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        if version != cls.VERSION:
+            return None
+        cache = cls(pgnfile)
+        cache.strings = strings
+        cache.codes = {text: code for code, text in enumerate(strings)}
+        cache.offsets = offsets
+        cache.data = bytearray(data)
+        return cache
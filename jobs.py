@@ -0,0 +1,462 @@
+"""
+Background query jobs.
+
+Every query run becomes a QueryJob with its own cql process, its own query
+file and its own result set. The JobScheduler starts queued jobs while
+their threads fit in the CPU budget from data/jobs.json, so several
+queries, possibly on different PGN files, run side by side while earlier
+results stay browsable in the JobsPanel.
+
+When the byte offsets of its games are known (a plain PGN file with a
+header index, or a ``.pgnb`` file), a job scans them in windows of
+``window_games`` game numbers, each fed to cql as its own byte span.
+Stopping a job kills cql at once but keeps the matches of every finished
+window, and a stopped job can be resumed from the first game it did not
+finish. Other files are scanned in a single pass: cql would have to read
+every game before each window again, so windowing them is an opt-in
+(``window_unindexed``).
+"""
+
+import json
+import os
+
+from PyQt5 import QtCore, QtWidgets
+
+from blockpgn import is_block_pgn
+from compressed import is_compressed
+from pgn_index import file_signature
+from process import CQLProcess, count_games
+
+JOBS_CONFIG_FILE = "data/jobs.json"
+DEFAULT_JOBS_CONFIG = {
+    "cpu_budget": 0,  # 0 uses every core
+    "threads_per_job": 2,
+    "window_games": 20000,
+    "window_unindexed": False,
+}
+
+QUEUED = "Queued"
+RUNNING = "Running"
+DONE = "Done"
+FAILED = "Failed"
+CANCELLED = "Cancelled"
+STOPPED = "Stopped"
+
+
+def load_jobs_config() -> dict:
+    config = dict(DEFAULT_JOBS_CONFIG)
+    try:
+        with open(JOBS_CONFIG_FILE, "r") as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print("Error loading jobs config.", e)
+    return config
+
+
+class QueryJob(QtCore.QObject):
+    changed = QtCore.pyqtSignal(object)  # job
+    finished = QtCore.pyqtSignal(object)  # job
+    messageReceived = QtCore.pyqtSignal(object, str)
+    errorReceived = QtCore.pyqtSignal(object, str)
+
+    def __init__(
+        self,
+        job_id: int,
+        cqlquery: str,
+        pgnfile: str,
+        gamenumbers: tuple[int, int] | None,
+        progress_range: tuple[int, int],
+        extra_args: list[str] | None = None,
+        threads: int = 1,
+        window_games: int = 0,
+        prior_results: str = "",
+        header_index=None,
+        window_unindexed: bool = False,
+        parent=None,
+    ):
+        super().__init__(parent)
+        self.job_id = job_id
+        self.cqlquery = cqlquery
+        self.pgnfile = pgnfile
+        self.gamenumbers = gamenumbers
+        self.minimum, self.maximum = progress_range
+        self.threads = threads
+        self.extra_args = list(extra_args or []) + ["-threads", str(threads)]
+        self.first, self.last = gamenumbers or (1, self.maximum)
+        # Byte offsets of the games of a plain PGN file, to feed cql spans
+        self.header_index = (
+            header_index
+            if header_index is not None
+            and not is_compressed(pgnfile)
+            and not is_block_pgn(pgnfile)
+            else None
+        )
+        spans = self.header_index is not None or is_block_pgn(pgnfile)
+        # Without a known game count the file is scanned in a single run
+        if not (gamenumbers or self.maximum > 0) or not (spans or window_unindexed):
+            window_games = 0
+        self.window_games = window_games
+        self.next_game = self.first
+        self.window_end = self.last
+        self.stopping = False
+        self.error = ""  # first error cql reported, if any
+        self.status = QUEUED
+        self.progress = self.minimum
+        # Matches of finished windows, after those of earlier runs if any
+        self.results: list[str] = [prior_results] if prior_results.strip() else []
+        self.window_results: list[str] = []
+        self.stats: dict = {}
+        self.matches = count_games(prior_results)
+        self.owned_files: list[str] = []  # temporary inputs removed when done
+        self.source = ""  # database file the job searches, if any
+        self.cache_key = None  # set when the results go to the result cache
+
+        self.process = CQLProcess(self)
+        self.process.gamesReceived.connect(self.window_results.append)
+        self.process.progressUpdated.connect(self.on_progress)
+        self.process.statsReceived.connect(self.stats.update)
+        self.process.messageReceived.connect(lambda m: self.messageReceived.emit(self, m))
+        self.process.errorReceived.connect(self.on_error)
+        self.process.finished.connect(self.on_finished)
+        self.process.errorOccurred.connect(self.on_process_error)
+
+    @property
+    def title(self) -> str:
+        lines = [line.strip() for line in self.cqlquery.splitlines() if line.strip()]
+        body = [line for line in lines if not line.lower().startswith("cql")] or lines
+        return body[0] if body else ""
+
+    @property
+    def result_text(self) -> str:
+        return "\n".join(self.results)
+
+    @property
+    def succeeded(self) -> bool:
+        """Every game was scanned and cql exited cleanly without errors."""
+        return self.status == DONE and not self.error
+
+    def start(self):
+        self.status = RUNNING
+        self.stopping = False
+        self.error = ""
+        self.changed.emit(self)
+        if self.window_games and not self.has_more():
+            # Nothing left to scan, e.g. no games appended since the last run
+            QtCore.QTimer.singleShot(
+                0, lambda: self.on_finished(0, QtCore.QProcess.NormalExit)
+            )
+            return
+        self._next_window()
+
+    def _next_window(self):
+        self.window_results.clear()
+        if not self.window_games:
+            gamenumbers = self.gamenumbers
+        else:
+            self.window_end = min(self.next_game + self.window_games - 1, self.last)
+            gamenumbers = (self.next_game, self.window_end)
+        self.process.search(
+            self.cqlquery,
+            self.pgnfile,
+            gamenumbers,
+            self.extra_args,
+            self._span(gamenumbers),
+        )
+
+    def _span(self, gamenumbers) -> tuple[int, int] | None:
+        """Byte range of ``gamenumbers`` in a plain PGN file, if indexed."""
+        index = self.header_index
+        if gamenumbers is None or index is None or gamenumbers[1] > len(index):
+            return None
+        try:
+            size, mtime = file_signature(self.pgnfile)
+        except OSError:
+            return None
+        if (size, mtime) != (index.file_state.size, index.file_state.mtime):
+            return None  # changed since it was indexed; offsets may be stale
+        return (
+            index.game_span(gamenumbers[0], size)[0],
+            index.game_span(gamenumbers[1], size)[1],
+        )
+
+    def has_more(self) -> bool:
+        return bool(self.window_games) and self.next_game <= self.last
+
+    def cancel(self):
+        if self.status == QUEUED and self.next_game == self.first:
+            self.status = CANCELLED
+            self.remove_owned_files()
+            self.changed.emit(self)
+            self.finished.emit(self)
+        elif self.status == QUEUED:
+            # A resumed job that has not restarted yet keeps its results
+            self.status = STOPPED
+            self.changed.emit(self)
+            self.finished.emit(self)
+        elif self.status == RUNNING:
+            self.stopping = True
+            self.process.kill()
+
+    def resume(self):
+        """Queue a stopped job again; it continues at ``next_game``."""
+        if self.status == STOPPED and self.has_more():
+            self.status = QUEUED
+            self.changed.emit(self)
+
+    def on_progress(self, number: int):
+        self.progress = number
+        self.changed.emit(self)
+
+    def on_error(self, error: str):
+        # cql may still be running; the job fails once it has finished, so
+        # the scheduler keeps counting its threads until then
+        if not self.error:
+            self.error = error
+        self.errorReceived.emit(self, error)
+
+    def on_process_error(self, error):
+        if error == QtCore.QProcess.FailedToStart:
+            self.status = FAILED
+            self.errorReceived.emit(self, "cql could not be started")
+            self.remove_owned_files()
+            self.finished.emit(self)
+
+    def on_finished(self, exitCode, exitStatus):
+        if self.stopping:
+            # The window cql was killed in is incomplete: drop its output
+            # and scan it again on resume
+            self.status = STOPPED
+            self.progress = max(self.minimum, self.next_game - 1)
+            self.changed.emit(self)
+            self.finished.emit(self)
+            return
+        if self.error or exitStatus != QtCore.QProcess.NormalExit or exitCode != 0:
+            # The output of this window may be incomplete: keep only the
+            # windows that finished cleanly
+            if not self.error:
+                self.error = (
+                    "cql crashed"
+                    if exitStatus != QtCore.QProcess.NormalExit
+                    else f"cql exited with code {exitCode}"
+                )
+                self.errorReceived.emit(self, self.error)
+            self.status = FAILED
+            self.remove_owned_files()
+            self.changed.emit(self)
+            self.finished.emit(self)
+            return
+        self.results.extend(r for r in self.window_results if r.strip())
+        self.matches = count_games(self.result_text)
+        if self.window_games:
+            self.next_game = self.window_end + 1
+        if self.status == RUNNING and self.has_more():
+            self.changed.emit(self)
+            self._next_window()
+            return
+        if self.status == RUNNING:
+            self.status = DONE
+            self.progress = self.maximum
+        self.remove_owned_files()
+        self.changed.emit(self)
+        self.finished.emit(self)
+
+    def remove_owned_files(self):
+        for path in self.owned_files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.owned_files.clear()
+
+
+class JobScheduler(QtCore.QObject):
+    jobAdded = QtCore.pyqtSignal(object)
+    jobFinished = QtCore.pyqtSignal(object)
+
+    def __init__(self, config: dict | None = None, parent=None):
+        super().__init__(parent)
+        self.config = config or load_jobs_config()
+        self.jobs: list[QueryJob] = []
+        self.next_id = 1
+
+    @property
+    def cpu_budget(self) -> int:
+        return self.config["cpu_budget"] or os.cpu_count() or 1
+
+    @property
+    def threads_per_job(self) -> int:
+        return max(1, min(self.config["threads_per_job"], self.cpu_budget))
+
+    def submit(
+        self,
+        cqlquery,
+        pgnfile,
+        gamenumbers,
+        progress_range,
+        extra_args=None,
+        prior_results="",
+        header_index=None,
+    ):
+        job = QueryJob(
+            self.next_id,
+            cqlquery,
+            pgnfile,
+            gamenumbers,
+            progress_range,
+            extra_args,
+            self.threads_per_job,
+            self.config["window_games"],
+            prior_results,
+            header_index,
+            self.config["window_unindexed"],
+            self,
+        )
+        self.next_id += 1
+        job.finished.connect(self.on_job_finished)
+        self.jobs.append(job)
+        self.jobAdded.emit(job)
+        self.schedule()
+        return job
+
+    def resume(self, job: QueryJob):
+        job.resume()
+        self.schedule()
+
+    def running(self) -> list[QueryJob]:
+        return [j for j in self.jobs if j.status == RUNNING]
+
+    def schedule(self):
+        """Start queued jobs, oldest first, while their threads fit the budget."""
+        used = sum(j.threads for j in self.running())
+        for job in self.jobs:
+            if job.status != QUEUED:
+                continue
+            # A lone job always runs, even on a budget smaller than one job
+            if used and used + job.threads > self.cpu_budget:
+                break
+            job.start()
+            used += job.threads
+
+    def on_job_finished(self, job: QueryJob):
+        self.jobFinished.emit(job)
+        self.schedule()
+
+    def remove_finished(self):
+        for job in [j for j in self.jobs if j.status in (DONE, FAILED, CANCELLED)]:
+            self.jobs.remove(job)
+            job.deleteLater()
+
+    def shutdown(self):
+        for job in self.jobs:
+            if job.status in (QUEUED, RUNNING):
+                job.cancel()
+        for job in self.jobs:
+            job.remove_owned_files()
+
+
+class JobsPanel(QtWidgets.QWidget):
+    """Table of query jobs; activating a row shows that job's results."""
+
+    resultsRequested = QtCore.pyqtSignal(object)  # job
+
+    COLUMNS = ["#", "Query", "File", "Status", "Progress", "Matches"]
+
+    def __init__(self, scheduler: JobScheduler, parent=None):
+        super().__init__(parent)
+        self.scheduler = scheduler
+        self.rows: dict[int, int] = {}  # job id -> table row
+
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setStretchLastSection(True)
+
+        self.cancel_button = QtWidgets.QPushButton("Stop", self)
+        self.resume_button = QtWidgets.QPushButton("Resume", self)
+        self.clear_button = QtWidgets.QPushButton("Clear Finished", self)
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addWidget(self.cancel_button)
+        buttons.addWidget(self.resume_button)
+        buttons.addWidget(self.clear_button)
+        buttons.addStretch(1)
+
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(4, 4, 4, 4)
+        layout.addWidget(self.table, 1)
+        layout.addLayout(buttons)
+
+        self.cancel_button.clicked.connect(self.cancel_selected)
+        self.resume_button.clicked.connect(self.resume_selected)
+        self.clear_button.clicked.connect(self.clear_finished)
+        self.table.cellDoubleClicked.connect(
+            lambda row, _: self.show_results(self.job_at(row))
+        )
+        scheduler.jobAdded.connect(self.add_job)
+
+    def add_job(self, job: QueryJob):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        self.rows[job.job_id] = row
+        job.changed.connect(self.update_job)
+        self.update_job(job)
+
+    def update_job(self, job: QueryJob):
+        row = self.rows.get(job.job_id)
+        if row is None:
+            return
+        span = max(1, job.maximum - job.minimum)
+        percent = min(100, max(0, (job.progress - job.minimum) * 100 // span))
+        values = [
+            str(job.job_id),
+            job.title,
+            os.path.basename(job.source or job.pgnfile),
+            (
+                f"Stopped before game {job.next_game}"
+                if job.status == STOPPED and job.has_more()
+                else job.status
+            ),
+            f"{percent}%",
+            str(job.matches) if job.status in (RUNNING, DONE, STOPPED) else "",
+        ]
+        for column, value in enumerate(values):
+            item = self.table.item(row, column)
+            if item is None:
+                self.table.setItem(row, column, QtWidgets.QTableWidgetItem(value))
+            elif item.text() != value:
+                item.setText(value)
+
+    def job_at(self, row: int) -> QueryJob | None:
+        for job in self.scheduler.jobs:
+            if self.rows.get(job.job_id) == row:
+                return job
+        return None
+
+    def selected_job(self) -> QueryJob | None:
+        rows = self.table.selectionModel().selectedRows()
+        return self.job_at(rows[0].row()) if rows else None
+
+    def show_results(self, job: QueryJob | None):
+        if job is not None and job.status in (DONE, STOPPED):
+            self.resultsRequested.emit(job)
+
+    def cancel_selected(self):
+        job = self.selected_job()
+        if job is not None:
+            job.cancel()
+
+    def resume_selected(self):
+        job = self.selected_job()
+        if job is not None:
+            self.scheduler.resume(job)
+
+    def clear_finished(self):
+        self.scheduler.remove_finished()
+        self.table.setRowCount(0)
+        self.rows.clear()
+        for job in self.scheduler.jobs:
+            self.add_job(job)
@@ -1,5 +1,7 @@
 import json
+import os
 import sys
+import tempfile
 from PyQt5.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -14,18 +16,54 @@ from PyQt5.QtWidgets import (
     QHBoxLayout,
     QLineEdit,
     QListWidget,
-    QProgressDialog,
     QFileDialog,
     QMessageBox,
 )
-from PyQt5.QtCore import Qt, QFile, pyqtSignal
+from PyQt5.QtCore import Qt, QFile, QFileSystemWatcher, QTimer, pyqtSignal
 from PyQt5.QtGui import QIcon
 import qtawesome as qta
 from editor import SqlEditorWidget
 from styles import DARK_QSS, LIGHT_QSS
 from parser import PgnTableWidget
 from browser import PGNBrowser
-from process import CQLProcess, CounterProcess
+from process import CounterProcess, QueryEstimator, WindowedSearch
+from jobs import DONE, QUEUED, RUNNING, STOPPED, JobScheduler, JobsPanel
+from result_cache import ResultCache, query_key
+from compressed import StreamCounter, is_compressed
+from blockpgn import BlockPgnReader, ConvertWorker, is_block_pgn
+from catalog import CatalogBrowser, CatalogWorker, ResultsJoinWorker
+from database import SOURCE_TAG, DatabaseLoader, PgnDatabase, tag_games
+from engine_pool import EnginePool, EngineSettingsDialog
+from batch_analysis import BatchAnnotator
+from pgn_index import (
+    INDEXED_FIELDS,
+    HeaderIndexWorker,
+    SubsetWorker,
+    parse_header_filter,
+    to_ranges,
+)
+from preview import SAMPLE_SIZE, QueryPreview
+from validator import QueryValidator
+from position_index import (
+    PositionIndexWorker,
+    parse_material,
+    iter_games,
+    read_game_text,
+)
+from query_analyzer import (
+    analyze_query,
+    command_line_options,
+    describe,
+    exact_position,
+    material_constraints,
+)
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
 
 
 def fa_icon(*names, color="#1F2937"):
@@ -141,9 +179,10 @@ class ChessboardDialog(QDialog):
         self.pgn_browser = PGNBrowser(game_info, html_style=html_style)
         layout.addWidget(self.pgn_browser)
 
-    def closeEvent(self, a0):
-        self.pgn_browser.engine.quit()
-        a0.accept()
+    def done(self, a0):
+        # Covers the close button and Esc, which both end in reject()
+        self.pgn_browser.release_engine()
+        super().done(a0)
 
 
 # ---------- Main Window ----------
@@ -157,6 +196,39 @@ class ChessCQLApp(QMainWindow):
 
         self.pgnfilename = None
         self.game_count = 0
+        self.header_index = None
+        self.position_index = None
+        self.game_cache = None
+        self.annotator = None
+        self.windowed_search = None
+        self.estimator = None
+        self.preview_sample = None  # temporary sample file of the live preview
+        self.sample_worker = None
+        self.subset_workers = []  # candidate games being copied to subset files
+        self.subset_ranges = {}  # subset file -> game ranges of the file it copies
+        self.results_scopes = {}  # file -> game ranges the shown results scanned
+        self.scheduler = JobScheduler(parent=self)
+        self.scheduler.jobFinished.connect(self.on_job_finished)
+        self.latest_jobs = []
+        self.database = None
+        self.database_loader = None
+        self.header_worker = None
+        self.position_worker = None
+        self.stream_counter = None
+        # Header catalog imports, one file at a time
+        self.catalog_worker = None
+        self.catalog_queue = []
+        self.cataloged = set()
+        self.join_worker = None
+        self.join_pending = None  # results waiting for the running join
+        # Indexes follow the open files as they change on disk
+        self.file_watcher = QFileSystemWatcher(self)
+        self.file_watcher.fileChanged.connect(self.on_file_changed)
+        self.changed_files = set()
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(2000)  # appends usually come in bursts
+        self.refresh_timer.timeout.connect(self.refresh_changed_files)
         # Build UI
         self._create_actions()
         self._create_menus()
@@ -174,52 +246,14 @@ class ChessCQLApp(QMainWindow):
 
         # Seed table with placeholder rows
         self.setStyleSheet(LIGHT_QSS)
-        self.cql = CQLProcess(self)
-        self.cql.gamesReceived.connect(self.on_games)
-        self.cql.errorReceived.connect(self.on_error_received)
-        self.cql.statsReceived.connect(self.on_info_received)
-        self.cql.messageReceived.connect(self.log_panel.append)
-
-    def on_info_received(self, cql_info: dict):
-        if isinstance(cql_info, dict):
-            numbermatches = cql_info.get("numbermatches")
-            if numbermatches:
-                self.results_table.set_info_text(
-                    f"{numbermatches} matches of {self.game_count} games"
-                )
-                self.status_bar.showMessage(
-                    f"{numbermatches} matches of {self.game_count} games"
-                )
-                self.log_panel.append(
-                    f"<span style='color:blue'>Matches: {numbermatches}</span><br>"
-                )
-            else:
-                for k, v in cql_info.items():
-                    self.log_panel.append(
-                        f"<span style='color:blue'>{k}: {v}</span><br>"
-                    )
+
+        # Warm engines so opening analysis in a viewer is instant
+        self.engine_pool = EnginePool.instance()
+        self.engine_pool.warm_up()
 
     def on_error_received(self, error: str):
         self.log_panel.insertHtml(f"<span style='color:red'>{error}</span><br>")
 
-    def show_progress(self):
-        dlg = QProgressDialog(
-            "Processing games...",
-            "Cancel",
-            0,
-            self.game_count,
-            self,
-            Qt.WindowCloseButtonHint,
-        )
-        dlg.setWindowTitle("Processing...")
-        self.cql.progressUpdated.connect(dlg.setValue)
-        dlg.canceled.connect(self.cql.terminate)
-        self.cql.finishedEXecution.connect(dlg.close)
-
-        dlg.setWindowModality(Qt.ApplicationModal)
-        dlg.setValue(0)
-        dlg.exec_()
-
     # ----- Actions with Icons -----
     def _create_actions(self):
         # File
@@ -230,6 +264,15 @@ class ChessCQLApp(QMainWindow):
         self.act_open_pgn.setStatusTip("Open a PGN file")
         self.act_open_pgn.triggered.connect(self.open_pgn_file)
 
+        self.act_open_folder = QAction(
+            fa_icon("fa5s.folder", "fa.folder"), "Open PGN Folder", self
+        )
+        self.act_open_folder.setShortcut("Ctrl+Shift+O")
+        self.act_open_folder.setStatusTip(
+            "Open every PGN file of a folder as one database"
+        )
+        self.act_open_folder.triggered.connect(self.open_pgn_folder)
+
         self.act_save_query = QAction(
             fa_icon("fa5s.save", "fa.save"), "Save Query", self
         )
@@ -264,6 +307,51 @@ class ChessCQLApp(QMainWindow):
         self.act_templates.setShortcut("Ctrl+T")
         self.act_templates.triggered.connect(self.show_query_templates)
 
+        self.act_estimate = QAction(
+            fa_icon("fa5s.stopwatch", "fa.clock-o"), "Estimate Query Cost", self
+        )
+        self.act_estimate.setShortcut("Ctrl+E")
+        self.act_estimate.setStatusTip(
+            "Run the query on a random sample of games and project matches and time"
+        )
+        self.act_estimate.triggered.connect(self.estimate_query)
+
+        self.act_browse_catalog = QAction(
+            fa_icon("fa5s.table", "fa.table"), "Browse Catalog", self
+        )
+        self.act_browse_catalog.setShortcut("Ctrl+B")
+        self.act_browse_catalog.setStatusTip(
+            "Sort and filter every game of the open file by its headers"
+        )
+        self.act_browse_catalog.setEnabled(False)
+        self.act_browse_catalog.triggered.connect(self.browse_catalog)
+
+        self.act_convert = QAction(
+            fa_icon("fa5s.file-archive", "fa.file-archive-o"),
+            "Convert to Block-Compressed PGN",
+            self,
+        )
+        self.act_convert.setStatusTip(
+            "Write a .pgnb copy of a PGN file: compressed, with fast access to any game"
+        )
+        self.act_convert.triggered.connect(self.convert_to_block_pgn)
+
+        self.act_annotate = QAction(
+            fa_icon("fa5s.chess", "fa.cogs"), "Annotate Results with Engine", self
+        )
+        self.act_annotate.setStatusTip(
+            "Evaluate every result game and add Eval/Swing columns"
+        )
+        self.act_annotate.triggered.connect(self.annotate_results)
+
+        self.act_engine_settings = QAction(
+            fa_icon("fa5s.sliders-h", "fa.sliders"), "Engine Settings", self
+        )
+        self.act_engine_settings.setStatusTip(
+            "Engine path, threads and hash of the shared analysis engines"
+        )
+        self.act_engine_settings.triggered.connect(self.edit_engine_settings)
+
         # View – theme toggle (checkable) + reset layout
         self.act_theme = QAction(self._theme_icon(), "Dark Mode", self)
         self.act_theme.setCheckable(True)
@@ -289,10 +377,19 @@ class ChessCQLApp(QMainWindow):
         self.act_clear.setShortcut("Ctrl+L")
         self.act_clear.triggered.connect(self.clear_results_placeholder)
 
-        # Optional Stop (placeholder, disabled initially)
+        # Stop a scan keeping its partial results, and continue it later
         self.act_stop = QAction(fa_icon("fa5s.stop", "fa.stop"), "Stop", self)
+        self.act_stop.setStatusTip("Stop the search and keep the matches found so far")
         self.act_stop.setEnabled(False)
-        self.act_stop.triggered.connect(lambda: self.log_panel.append("Stop clicked"))
+        self.act_stop.triggered.connect(self.stop_search)
+
+        self.act_continue = QAction(
+            fa_icon("fa5s.forward", "fa.forward"), "Continue Search", self
+        )
+        self.act_continue.setShortcut("Shift+F5")
+        self.act_continue.setStatusTip("Resume a paused or stopped scan")
+        self.act_continue.setEnabled(False)
+        self.act_continue.triggered.connect(self.continue_search)
 
     # ----- Menus -----
     def _create_menus(self):
@@ -300,6 +397,7 @@ class ChessCQLApp(QMainWindow):
 
         file_menu = menu_bar.addMenu("File")
         file_menu.addAction(self.act_open_pgn)
+        file_menu.addAction(self.act_open_folder)
         file_menu.addAction(self.act_save_query)
         file_menu.addAction(self.act_export_results)
 
@@ -315,6 +413,11 @@ class ChessCQLApp(QMainWindow):
 
         tools_menu = menu_bar.addMenu("Tools")
         tools_menu.addAction(self.act_templates)
+        tools_menu.addAction(self.act_estimate)
+        tools_menu.addAction(self.act_browse_catalog)
+        tools_menu.addAction(self.act_convert)
+        tools_menu.addAction(self.act_annotate)
+        tools_menu.addAction(self.act_engine_settings)
 
     # ----- Toolbar -----
     def _create_toolbar(self):
@@ -323,6 +426,7 @@ class ChessCQLApp(QMainWindow):
         toolbar.setMovable(True)
         toolbar.addAction(self.act_run)
         toolbar.addAction(self.act_stop)
+        toolbar.addAction(self.act_continue)
         toolbar.addSeparator()
         toolbar.addAction(self.act_clear)
         self.addToolBar(toolbar)
@@ -335,6 +439,7 @@ class ChessCQLApp(QMainWindow):
 
         # Double-click a row to open the chessboard dialog
         self.results_table.gameSelected.connect(self.show_chessboard_dialog)
+        self.results_table.rowsLoaded.connect(self.on_results_loaded)
 
     # ----- Docks (CQL editor + Logs) -----
     def _create_docks(self):
@@ -366,6 +471,42 @@ class ChessCQLApp(QMainWindow):
         )
         self.addDockWidget(Qt.BottomDockWidgetArea, self.log_dock)
 
+        # Preview Dock
+        self.preview_dock = QDockWidget("Preview", self)
+        self.preview_dock.setObjectName("PreviewDock")
+        self.preview = QueryPreview(self)
+        self.preview_dock.setWidget(self.preview)
+        self.preview_dock.setFeatures(
+            QDockWidget.DockWidgetClosable
+            | QDockWidget.DockWidgetMovable
+            | QDockWidget.DockWidgetFloatable
+        )
+        self.addDockWidget(Qt.LeftDockWidgetArea, self.preview_dock)
+        self.cql_editor.editor.textChanged.connect(
+            lambda: self.preview.schedule(self.cql_editor.editor.toPlainText())
+        )
+
+        # Jobs Dock
+        self.jobs_dock = QDockWidget("Jobs", self)
+        self.jobs_dock.setObjectName("JobsDock")
+        self.jobs_panel = JobsPanel(self.scheduler, self)
+        self.jobs_panel.resultsRequested.connect(self.show_job_results)
+        self.jobs_dock.setWidget(self.jobs_panel)
+        self.jobs_dock.setFeatures(
+            QDockWidget.DockWidgetClosable
+            | QDockWidget.DockWidgetMovable
+            | QDockWidget.DockWidgetFloatable
+        )
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.jobs_dock)
+        self.tabifyDockWidget(self.log_dock, self.jobs_dock)
+
+        # Syntax errors are underlined in the editor while typing
+        self.validator = QueryValidator(self)
+        self.validator.validated.connect(self.cql_editor.editor.set_errors)
+        self.cql_editor.editor.textChanged.connect(
+            lambda: self.validator.schedule(self.cql_editor.editor.toPlainText())
+        )
+
     def _wire_view_menu_toggles(self):
         # Add toggle actions for docks into View menu (and give them icons)
         self.cql_toggle = self.cql_dock.toggleViewAction()
@@ -382,6 +523,20 @@ class ChessCQLApp(QMainWindow):
             self.log_toggle,
         )
 
+        self.preview_toggle = self.preview_dock.toggleViewAction()
+        self.preview_toggle.setIcon(fa_icon("fa5s.eye", "fa.eye"))
+        self.view_menu.insertAction(
+            self.view_menu.actions()[2] if len(self.view_menu.actions()) > 2 else None,
+            self.preview_toggle,
+        )
+
+        self.jobs_toggle = self.jobs_dock.toggleViewAction()
+        self.jobs_toggle.setIcon(fa_icon("fa5s.tasks", "fa.tasks"))
+        self.view_menu.insertAction(
+            self.view_menu.actions()[3] if len(self.view_menu.actions()) > 3 else None,
+            self.jobs_toggle,
+        )
+
     # ----- View Actions -----
     def _theme_icon(self) -> QIcon:
         # Show moon when the user can switch to dark; show sun when in dark mode.
@@ -411,18 +566,27 @@ class ChessCQLApp(QMainWindow):
         self.act_clear.setIcon(qta.icon("fa5s.trash", color=icon_color))
         self.act_reset_layout.setIcon(qta.icon("fa5s.window-restore", color=icon_color))
         self.act_open_pgn.setIcon(qta.icon("fa5s.folder-open", color=icon_color))
+        self.act_open_folder.setIcon(qta.icon("fa5s.folder", color=icon_color))
         self.act_save_query.setIcon(qta.icon("fa5s.save", color=icon_color))
         self.act_export_results.setIcon(qta.icon("fa5s.file-export", color=icon_color))
         self.act_redo.setIcon(qta.icon("fa5s.redo", color=icon_color))
         self.act_undo.setIcon(qta.icon("fa5s.undo", color=icon_color))
         self.cql_toggle.setIcon(qta.icon("fa5s.code", color=icon_color))
         self.log_toggle.setIcon(qta.icon("fa5s.terminal", color=icon_color))
+        self.preview_toggle.setIcon(qta.icon("fa5s.eye", color=icon_color))
+        self.jobs_toggle.setIcon(qta.icon("fa5s.tasks", color=icon_color))
         self.act_theme.setIcon(
             qta.icon(
                 "fa5s.moon" if not self.dark_mode else "fa5s.sun", color=icon_color
             )
         )
         self.act_templates.setIcon(qta.icon("fa5s.list", color=icon_color))
+        self.act_annotate.setIcon(qta.icon("fa5s.chess", color=icon_color))
+        self.act_estimate.setIcon(qta.icon("fa5s.stopwatch", color=icon_color))
+        self.act_convert.setIcon(qta.icon("fa5s.file-archive", color=icon_color))
+        self.act_browse_catalog.setIcon(qta.icon("fa5s.table", color=icon_color))
+        self.act_stop.setIcon(qta.icon("fa5s.stop", color=icon_color))
+        self.act_continue.setIcon(qta.icon("fa5s.forward", color=icon_color))
         # Add more actions as needed
 
     def reset_layout(self):
@@ -443,41 +607,949 @@ class ChessCQLApp(QMainWindow):
         dlg.exec_()
 
     def show_chessboard_dialog(self, game: dict):
-        ChessboardDialog(game, self, html_style=self.dark_mode).exec_()
+        cache = self.game_cache
+        # A game number only means something in the file it came from
+        if (
+            game.get("Number")
+            and cache is not None
+            and game.get("Source") == cache.pgnfile
+        ):
+            game["Game"] = cache.game(game["Number"])
+        dlg = ChessboardDialog(game, self, html_style=self.dark_mode)
+        dlg.pgn_browser.chessboard.findPositionRequested.connect(self.find_position)
+        dlg.exec_()
+
+    def find_position(self, fen: str) -> bool:
+        """
+        Answer an exact-position search from the position index. Returns
+        False when the index is not available yet.
+        """
+        if self.position_index is None:
+            self.status_bar.showMessage("The position index is still being built.")
+            return False
+        numbers = self.position_index.games(fen)
+        self.log_panel.append(
+            f"<span style='color:blue'>Position index: {len(numbers)} games reach "
+            f"{fen}</span><br>"
+        )
+        self.status_bar.showMessage(f"{len(numbers)} games reach this position")
+        if self.game_cache is not None:
+            # Parsed games straight from the cache, no PGN text in between
+            cache = self.game_cache
+            self.cancel_annotation()
+            self.results_table.clear()
+            self.results_table.load_games_threaded(
+                ((number, cache.game(number)) for number in numbers), cache.pgnfile
+            )
+        else:
+            index = self.header_index
+            self.cancel_annotation()
+            self.results_table.clear()
+            self.results_table.load_games_threaded(
+                iter_games(index, numbers), index.pgnfile
+            )
+        self.results_table.set_info_text(
+            f"{len(numbers)} matches of {self.game_count} games"
+        )
+        return True
 
     def run_query(self):
-        if not self.cql_editor.editor.toPlainText() or not self.pgnfilename:
+        if not self.cql_editor.editor.toPlainText() or not (
+            self.pgnfilename or self.database
+        ):
             QMessageBox.warning(
                 self,
                 "Missing PGN File",
                 "Please open a PGN file before running the query.",
             )
             return
-        self.cql.search(self.cql_editor.editor.toPlainText(), self.pgnfilename)
-        self.show_progress()
+        self.when_query_valid(self.run_valid_query)
+
+    def run_valid_query(self):
+        if self.database is not None:
+            self.run_database_query()
+            return
+        fen = exact_position(self.cql_editor.editor.toPlainText())
+        if fen is not None and self.position_index is not None:
+            self.find_position(fen)
+            return
+        try:
+            self.resolve_search_target(self.run_target)
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid Header Filter", str(e))
+
+    def run_target(self, pgnfile, gamenumbers, progress_range, extra_args):
+        limit = self.cql_editor.first_matches.value()
+        if limit:
+            first, last = gamenumbers or (1, progress_range[1])
+            self.start_windowed_search(pgnfile, first, last, extra_args, limit)
+            return
+        job = self.submit_job(pgnfile, gamenumbers, progress_range, extra_args)
+        self.latest_jobs = [job]
+        self.status_bar.showMessage(f"Job #{job.job_id} submitted")
+
+    # ----- Query jobs -----
+    def index_for(self, pgnfile: str):
+        """The header index of ``pgnfile``, if it is open and indexed."""
+        if self.database is not None:
+            index = self.database.indexes.get(pgnfile)
+        else:
+            index = self.header_index
+        if index is not None and index.pgnfile != pgnfile:
+            return None
+        return index
+
+    def submit_job(self, pgnfile, gamenumbers, progress_range, extra_args, source=""):
+        query = self.cql_editor.editor.toPlainText()
+        # Whole-file scans are cached; a re-run only scans appended games
+        cache_key = None
+        prior_results = ""
+        count = progress_range[1]
+        if gamenumbers is None and pgnfile == (source or self.pgnfilename) and count:
+            cache_key = query_key(query, extra_args)
+            entry = ResultCache.instance().get(cache_key, pgnfile)
+            if entry is not None and entry["last_game"] <= count:
+                gamenumbers = (entry["last_game"] + 1, count)
+                prior_results = entry["matches"]
+                self.log_panel.append(
+                    f"<span style='color:blue'>{os.path.basename(pgnfile)}: "
+                    f"reusing matches of games 1-{entry['last_game']}, "
+                    f"{count - entry['last_game']} new games to scan</span><br>"
+                )
+        # Game offsets let the job feed cql only the games it scans
+        index = self.index_for(pgnfile)
+        job = self.scheduler.submit(
+            query,
+            pgnfile,
+            gamenumbers,
+            progress_range,
+            extra_args,
+            prior_results,
+            index,
+        )
+        job.source = source
+        job.cache_key = cache_key
+        if pgnfile != (source or self.pgnfilename):
+            job.owned_files.append(pgnfile)
+        job.errorReceived.connect(
+            lambda job, error: self.on_error_received(f"Job #{job.job_id}: {error}")
+        )
+        job.messageReceived.connect(
+            lambda job, message: self.log_panel.append(f"Job #{job.job_id}: {message}")
+        )
+        self.act_stop.setEnabled(True)
+        self.act_continue.setEnabled(False)
+        return job
+
+    def on_job_finished(self, job):
+        self.log_panel.append(
+            f"<span style='color:blue'>Job #{job.job_id} {job.status.lower()}: "
+            f"{job.matches} matches</span><br>"
+        )
+        for name, value in job.stats.items():
+            self.log_panel.append(
+                f"<span style='color:blue'>{name}: {value}</span><br>"
+            )
+        ResultCache.instance().put_job(job)
+        self.act_stop.setEnabled(bool(self.scheduler.running()))
+        # Results of older jobs stay in the jobs panel until asked for; a
+        # search fanned out over several files is shown once every file is done
+        jobs = self.latest_jobs
+        if job not in jobs or any(j.status in (QUEUED, RUNNING) for j in jobs):
+            return
+        shown = [j for j in jobs if j.status in (DONE, STOPPED)]
+        if shown:
+            self.act_continue.setEnabled(
+                any(j.status == STOPPED and j.has_more() for j in jobs)
+            )
+            self.show_job_results(*shown)
+
+    def show_job_results(self, *jobs):
+        scopes = {}
+        for job in jobs:
+            source = job.source or self.pgnfilename
+            # Resumed whole-file scans also show the matches of earlier runs
+            scope = (
+                None
+                if job.cache_key
+                else self.search_scope(job.pgnfile, job.gamenumbers)
+            )
+            if scope is None or scopes.get(source, []) is None:
+                scopes[source] = None
+            else:
+                scopes[source] = scopes.get(source, []) + scope
+        if any(job.source for job in jobs):
+            self.on_games(
+                "\n".join(
+                    tag_games(job.result_text, SOURCE_TAG, os.path.basename(job.source))
+                    for job in jobs
+                ),
+                scopes,
+            )
+        else:
+            self.on_games("\n".join(job.result_text for job in jobs), scopes)
+        matches = sum(job.matches for job in jobs)
+        name = (
+            f"Job #{jobs[0].job_id}"
+            if len(jobs) == 1
+            else f"Jobs #{jobs[0].job_id}-{jobs[-1].job_id}"
+        )
+        stopped = [job for job in jobs if job.status == STOPPED]
+        if len(jobs) == 1 and stopped:
+            info = (
+                f"{name}: {matches} matches in games before "
+                f"{stopped[0].next_game} (stopped)"
+            )
+        else:
+            # Game-number ranges are inclusive; whole files and subset files
+            # have a progress range of (0, game count)
+            games = sum(job.maximum - max(job.minimum, 1) + 1 for job in jobs)
+            info = f"{name}: {matches} matches of {games} games"
+            if len(jobs) > 1:
+                info += f" in {len(jobs)} files"
+            if stopped:
+                info += f" ({len(stopped)} stopped)"
+        self.results_table.set_info_text(info)
+        self.status_bar.showMessage(f"Showing results of {name.lower()}")
+
+    def stop_search(self):
+        """Stop the running scan; whatever it found so far stays available."""
+        if self.windowed_search is not None and self.windowed_search.is_running():
+            self.windowed_search.cancel()
+            return
+        jobs = [j for j in self.latest_jobs if j.status in (QUEUED, RUNNING)]
+        if not jobs:
+            jobs = self.scheduler.running()[-1:]
+        for job in jobs:
+            job.cancel()
+
+    def continue_search(self):
+        jobs = [j for j in self.latest_jobs if j.status == STOPPED and j.has_more()]
+        if jobs:
+            self.act_continue.setEnabled(False)
+            self.act_stop.setEnabled(True)
+            for job in jobs:
+                self.scheduler.resume(job)
+            self.status_bar.showMessage(
+                f"Resuming {len(jobs)} stopped job(s) at game {jobs[0].next_game}"
+                if len(jobs) > 1
+                else f"Resuming job #{jobs[0].job_id} at game {jobs[0].next_game}"
+            )
+            return
+        self.continue_windowed_search()
+
+    # ----- Multi-file databases -----
+    def run_database_query(self):
+        """Fan the query out as one job per file of the open database."""
+        database = self.database
+        query = self.cql_editor.editor.toPlainText()
+        text = self.cql_editor.header_filter.text().strip()
+        predicates = parse_header_filter(text) if text else []
+        if any(p[0] == "material" for p in predicates):
+            QMessageBox.information(
+                self,
+                "Material Filter",
+                "Material filters need the position index of a single PGN file.",
+            )
+            return
+        inferred = analyze_query(query)
+        extra_args = command_line_options(inferred)
+        if inferred:
+            self.log_panel.append(
+                f"<span style='color:blue'>From query: {describe(list(inferred))}"
+                "</span><br>"
+            )
+        predicates += [p for p in inferred if p[0] in INDEXED_FIELDS]
+        if text and not database.indexed():
+            QMessageBox.information(
+                self, "Indexing", "The database indexes are still being built."
+            )
+            return
+        groups = None
+        if predicates and database.indexed():
+            numbers = database.select(predicates)
+            if not numbers:
+                QMessageBox.information(
+                    self, "No Games", "No games match the header filters."
+                )
+                return
+            self.log_panel.append(
+                f"<span style='color:blue'>Candidates: {len(numbers)} of "
+                f"{len(database)} games in {len(database.files)} files</span><br>"
+            )
+            groups = database.split(numbers)
+        if groups is None:
+            targets = [
+                (pgnfile, None, (0, database.counts.get(pgnfile, 0)), pgnfile)
+                for pgnfile in database.files
+            ]
+            self.submit_database_jobs(targets, extra_args)
+            return
+        files = [pgnfile for pgnfile in database.files if pgnfile in groups]
+        ready = {}
+
+        def target_ready(source, *target):
+            ready[source] = target
+            # Jobs are submitted together, in file order, once every subset
+            # file is written: the results are shown when all of them end
+            if len(ready) == len(files):
+                self.submit_database_jobs(
+                    [(*ready[pgnfile], pgnfile) for pgnfile in files], extra_args
+                )
+
+        for pgnfile in files:
+            self.subset_target(
+                database.indexes[pgnfile],
+                pgnfile,
+                groups[pgnfile],
+                lambda *target, source=pgnfile: target_ready(source, *target),
+            )
+
+    def submit_database_jobs(self, targets: list[tuple], extra_args):
+        """One job per ``(pgnfile, gamenumbers, progress range, source file)``."""
+        jobs = []
+        for pgnfile, gamenumbers, progress_range, source in targets:
+            jobs.append(
+                self.submit_job(
+                    pgnfile, gamenumbers, progress_range, extra_args, source=source
+                )
+            )
+        self.latest_jobs = jobs
+        self.status_bar.showMessage(
+            f"Searching {len(jobs)} files as jobs #{jobs[0].job_id}-{jobs[-1].job_id}"
+        )
+
+    def subset_target(self, index, pgnfile: str, numbers: list[int], then):
+        """
+        Call ``then(pgnfile, gamenumbers, progress range)`` with a -gamenumber
+        range of ``pgnfile``, or, for scattered games, with a subset file
+        once a SubsetWorker has written it.
+        """
+        ranges = to_ranges(numbers)
+        if len(ranges) == 1:
+            then(pgnfile, ranges[0], ranges[0])
+            return
+        fd, subset = tempfile.mkstemp(prefix="qcql-subset-", suffix=".pgn")
+        os.close(fd)
+        self.subset_ranges[subset] = ranges
+        worker = SubsetWorker(index, numbers, subset, self)
+        worker.finished.connect(lambda path: then(path, None, (0, len(numbers))))
+        worker.failed.connect(self.on_error_received)
+        for signal in (worker.finished, worker.failed):
+            signal.connect(lambda _, w=worker: self.subset_workers.remove(w))
+        self.subset_workers.append(worker)
+        self.status_bar.showMessage(f"Copying {len(numbers)} candidate games...")
+        worker.start()
+
+    def search_scope(self, pgnfile: str, gamenumbers) -> list | None:
+        """Game ranges of its source file a search of ``pgnfile`` scans."""
+        if pgnfile in self.subset_ranges:
+            return self.subset_ranges[pgnfile]
+        return [tuple(gamenumbers)] if gamenumbers else None
+
+    def open_pgn_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Open PGN Folder", "")
+        if not folder:
+            return
+        database = PgnDatabase.from_path(folder)
+        if not database.files:
+            QMessageBox.warning(
+                self, "No PGN Files", f"There are no .pgn files in {folder}."
+            )
+            return
+        self.close_database()
+        self.pgnfilename = None
+        self.header_index = None
+        self.position_index = None
+        self.game_cache = None
+        self.act_browse_catalog.setEnabled(False)
+        self.database = database
+        self.act_run.setEnabled(False)
+        self.status_bar.showMessage(f"Opening {database.name}... Please wait...")
+        self.database_loader = DatabaseLoader(database, parent=self)
+        self.database_loader.fileCounted.connect(
+            lambda pgnfile, count: self.status_bar.showMessage(
+                f"Counted {len(database.counts)} of {len(database.files)} files"
+            )
+        )
+        self.database_loader.countsReady.connect(self.on_database_counted)
+        self.database_loader.indexesReady.connect(self.on_database_indexed)
+        self.database_loader.indexReady.connect(
+            lambda pgnfile, _: self.catalog_file(pgnfile)
+        )
+        self.database_loader.start()
+        self.watch_files(database.files)
+
+    def close_database(self):
+        if self.database_loader is not None:
+            self.database_loader.stop()
+        self.database = None
+        self.database_loader = None
+
+    def on_database_counted(self):
+        database = self.database
+        self.game_count = len(database)
+        self.status_bar.showMessage(f"{database.name}: {self.game_count} games")
+        self.results_table.set_info_text(
+            f"{self.game_count} games in {len(database.files)} files"
+        )
+        self.act_run.setEnabled(True)
+        first = database.files[0]
+        size = min(database.counts[first], SAMPLE_SIZE)
+        self.preview.set_sample(first, (1, size), size)
+
+    def on_database_indexed(self):
+        database = self.database
+        self.game_count = len(database)
+        names = set()
+        for index in database.indexes.values():
+            names.update(index.players.top_names())
+        self.results_table.set_completion_names(sorted(names))
+        self.log_panel.append(
+            f"<span style='color:green'>Header indexes ready ({self.game_count} "
+            f"games in {len(database.files)} files)</span><br>"
+        )
+
+    # ----- Header catalog -----
+    def catalog_file(self, pgnfile: str):
+        """Import (or update) the catalog rows of ``pgnfile`` in the background."""
+        if pgnfile not in self.catalog_queue:
+            self.catalog_queue.append(pgnfile)
+        if self.catalog_worker is None or not self.catalog_worker.isRunning():
+            self._catalog_next()
+
+    def _catalog_next(self):
+        if not self.catalog_queue:
+            return
+        self.catalog_worker = CatalogWorker(self, self.catalog_queue.pop(0))
+        self.catalog_worker.finished.connect(self.on_catalog_ready)
+        self.catalog_worker.failed.connect(self.on_error_received)
+        self.catalog_worker.failed.connect(lambda _: self._catalog_next())
+        self.catalog_worker.start()
+
+    def on_catalog_ready(self, pgnfile: str):
+        self.cataloged.add(pgnfile)
+        if pgnfile == self.pgnfilename:
+            self.act_browse_catalog.setEnabled(True)
+        self._catalog_next()
+
+    def browse_catalog(self):
+        if self.pgnfilename not in self.cataloged:
+            self.status_bar.showMessage("The catalog of this file is still being built.")
+            return
+        browser = CatalogBrowser(self.pgnfilename, self)
+        browser.setAttribute(Qt.WA_DeleteOnClose)
+        browser.gameSelected.connect(self.open_catalog_game)
+        browser.show()
+
+    def open_catalog_game(self, game: dict):
+        # The browser may outlive the file it was opened on
+        index = self.index_for(game["Source"])
+        if index is None:
+            self.status_bar.showMessage(
+                f"{os.path.basename(game['Source'])} is no longer open."
+            )
+            return
+        game["PGN"] = read_game_text(index, game["Number"])
+        self.show_chessboard_dialog(game)
+
+    def on_results_loaded(self):
+        """Join the shown results against the catalog of their files."""
+        rows = self.results_table.model.rows()
+        if self.database is not None:
+            paths = {os.path.basename(name): name for name in self.database.files}
+            groups = {}
+            for row in rows:
+                groups.setdefault(paths.get(row.get("File")), []).append(row)
+        else:
+            groups = {self.pgnfilename: rows}
+        groups = {
+            pgnfile: (file_rows, self.results_scopes.get(pgnfile))
+            for pgnfile, file_rows in groups.items()
+            if pgnfile in self.cataloged
+        }
+        if not groups:
+            return
+        if self.join_worker is not None and self.join_worker.isRunning():
+            # Only the latest results are joined once the current join ends
+            self.join_pending = groups
+            return
+        self._join_results(groups)
+
+    def _join_results(self, groups: dict):
+        # Copies: the table may be reloaded while the worker reads them
+        self.join_worker = ResultsJoinWorker(
+            self,
+            {
+                pgnfile: ([dict(row) for row in file_rows], ranges)
+                for pgnfile, (file_rows, ranges) in groups.items()
+            },
+        )
+        self.join_worker.joined.connect(
+            lambda pgnfile, numbers: self.on_results_numbered(
+                groups[pgnfile][0], pgnfile, numbers
+            )
+        )
+        self.join_worker.failed.connect(self.on_error_received)
+        self.join_worker.finished.connect(self.on_results_joined)
+        self.join_worker.start()
+
+    @staticmethod
+    def on_results_numbered(rows: list[dict], pgnfile: str, numbers: list):
+        """
+        Give the result rows the game numbers the catalog found for them, so
+        the viewer can read those games from the game cache of ``pgnfile``.
+        """
+        for row, number in zip(rows, numbers):
+            if number is not None:
+                row["_number"] = number
+                row["_source"] = pgnfile
+
+    def on_results_joined(self):
+        groups, self.join_pending = self.join_pending, None
+        if groups is not None:
+            self._join_results(groups)
+
+    # ----- Sampling estimate -----
+    def estimate_query(self):
+        if self.database is not None:
+            QMessageBox.information(
+                self,
+                "Query Estimate",
+                "Estimates run on a single PGN file; open one of the database files.",
+            )
+            return
+        if not self.cql_editor.editor.toPlainText() or not self.pgnfilename:
+            QMessageBox.warning(
+                self,
+                "Missing PGN File",
+                "Please open a PGN file before estimating the query.",
+            )
+            return
+        self.when_query_valid(self.estimate_valid_query)
+
+    def estimate_valid_query(self):
+        try:
+            self.resolve_search_target(self.start_estimate)
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid Header Filter", str(e))
+
+    def start_estimate(self, pgnfile, gamenumbers, progress_range, extra_args):
+        first, last = gamenumbers or (1, progress_range[1])
+        if last < first:
+            return
+        if self.estimator is not None:
+            self.estimator.cancel()
+        self.estimator = QueryEstimator(
+            self.cql_editor.editor.toPlainText(),
+            pgnfile,
+            first,
+            last,
+            extra_args,
+            header_index=self.header_index,
+            parent=self,
+        )
+        if pgnfile != self.pgnfilename:
+            self.estimator.owned_files.append(pgnfile)  # a subset file
+        self.estimator.process.errorReceived.connect(self.on_error_received)
+        self.estimator.failed.connect(self.on_estimate_failed)
+        self.estimator.progressUpdated.connect(
+            lambda done, total: self.status_bar.showMessage(
+                f"Estimating: sample {done} of {total}"
+            )
+        )
+        self.estimator.estimateReady.connect(self.on_estimate_ready)
+        self.act_estimate.setEnabled(False)
+        self.estimator.start()
+
+    def on_estimate_failed(self, error: str):
+        self.act_estimate.setEnabled(True)
+        self.estimator = None
+        self.on_error_received(error)
+
+    def on_estimate_ready(self, estimate: dict):
+        self.act_estimate.setEnabled(True)
+        self.estimator = None
+        minutes, seconds = divmod(int(estimate["seconds"]), 60)
+        text = (
+            f"Sampled {estimate['sampled']} of {estimate['population']} games "
+            f"({estimate['sample_matches']} matches).<br>"
+            f"Projected matches: {estimate['matches']:.0f} "
+            f"(95% CI {estimate['low']:.0f}–{estimate['high']:.0f})<br>"
+            f"Speed: {estimate['games_per_sec']:.0f} games/sec<br>"
+            f"Projected time: {minutes}m {seconds:02d}s"
+        )
+        self.status_bar.showMessage("Estimate ready")
+        self.log_panel.append(f"<span style='color:blue'>{text}</span><br>")
+        QMessageBox.information(self, "Query Estimate", text)
+
+    # ----- Stop after N matches -----
+    def start_windowed_search(self, pgnfile, first, last, extra_args, limit):
+        if self.windowed_search is not None:
+            # A paused search can no longer be continued once replaced
+            self.windowed_search.discard()
+        self.latest_jobs = []
+        search = WindowedSearch(
+            self.cql_editor.editor.toPlainText(), pgnfile, first, last, extra_args, self
+        )
+        if pgnfile != self.pgnfilename:
+            search.owned_files.append(pgnfile)  # a subset file
+        search.process.errorReceived.connect(self.on_error_received)
+        search.process.messageReceived.connect(self.log_panel.append)
+        scopes = {self.pgnfilename: self.search_scope(pgnfile, (first, last))}
+        search.gamesReceived.connect(lambda games: self.on_games(games, scopes))
+        search.progressUpdated.connect(
+            lambda number: self.status_bar.showMessage(
+                f"Scanning game {number} of {last}, {search.matches} matches so far"
+            )
+        )
+        search.paused.connect(self.on_windowed_search_paused)
+        search.finished.connect(self.on_windowed_search_finished)
+        search.failed.connect(self.on_windowed_search_failed)
+        self.windowed_search = search
+        self.act_stop.setEnabled(True)
+        self.act_continue.setEnabled(False)
+        search.start(limit)
+
+    def continue_windowed_search(self):
+        search = self.windowed_search
+        if search is None or search.is_running() or not search.has_more():
+            return
+        self.act_stop.setEnabled(True)
+        self.act_continue.setEnabled(False)
+        search.resume(self.cql_editor.first_matches.value() or 1)
+
+    def on_windowed_search_paused(self, next_game: int):
+        search = self.windowed_search
+        self.act_stop.setEnabled(False)
+        self.act_continue.setEnabled(search.has_more())
+        self.results_table.set_info_text(
+            f"{search.matches} matches in games before {next_game}"
+        )
+        self.status_bar.showMessage(
+            f"Paused at game {next_game} of {search.last}; use Continue Search for more"
+        )
+
+    def on_windowed_search_finished(self):
+        search = self.windowed_search
+        self.act_stop.setEnabled(False)
+        self.act_continue.setEnabled(False)
+        self.results_table.set_info_text(f"{search.matches} matches")
+        self.status_bar.showMessage(f"Search finished: {search.matches} matches")
+
+    def on_windowed_search_failed(self, error: str):
+        search = self.windowed_search
+        if error != search.error:
+            self.on_error_received(error)  # cql's own errors are logged already
+        self.act_stop.setEnabled(False)
+        self.act_continue.setEnabled(False)
+        self.results_table.set_info_text(
+            f"{search.matches} matches in games before {search.next_game}"
+        )
+        self.status_bar.showMessage(f"Search failed: {error}")
+
+    def when_query_valid(self, then):
+        """
+        Call ``then()`` unless cql reports errors in the query: refuse to
+        scan the database with a query cql cannot parse. The verdict comes
+        from the validator, without blocking the GUI on a cql run.
+        """
+        self.validator.check(
+            self.cql_editor.editor.toPlainText(),
+            lambda errors: self.on_query_checked(errors, then),
+        )
+
+    def on_query_checked(self, errors: list[dict] | None, then):
+        if not errors:
+            then()
+            return
+        self.cql_editor.editor.set_errors(errors)
+        QMessageBox.warning(
+            self,
+            "Query Error",
+            "\n".join(e["message"] for e in errors),
+        )
+
+    def resolve_search_target(self, then):
+        """
+        Push the header filter, and header and material constraints found in
+        the query itself, down to the header and material indexes, then call
+        ``then(pgnfile, gamenumber range or None, progress range, extra cql
+        arguments)``; not at all when there is nothing to run. Scattered
+        candidates are first copied into a subset file in the background.
+        """
+        query = self.cql_editor.editor.toPlainText()
+        text = self.cql_editor.header_filter.text().strip()
+        predicates = parse_header_filter(text) if text else []
+        hinted = [parse_material(p[1]) for p in predicates if p[0] == "material"]
+        predicates = [p for p in predicates if p[0] != "material"]
+        inferred = analyze_query(query)
+        material = material_constraints(query)
+        extra_args = command_line_options(inferred)
+        if inferred or material:
+            self.log_panel.append(
+                f"<span style='color:blue'>From query: "
+                f"{describe(list(inferred) + list(material))}</span><br>"
+            )
+        predicates += [p for p in inferred if p[0] in INDEXED_FIELDS]
+        if text and is_compressed(self.pgnfilename):
+            QMessageBox.information(
+                self,
+                "Compressed File",
+                "Header and material filters need the indexes, which are not "
+                "built for compressed files.",
+            )
+            return
+        if (text and self.header_index is None) or (
+            hinted and self.position_index is None
+        ):
+            QMessageBox.information(
+                self, "Indexing", "The database indexes are still being built."
+            )
+            return
+        # Constraints inferred from the query are skipped while indexing;
+        # they still reach cql as command line options or as the query itself
+        numbers = None
+        if predicates and self.header_index is not None:
+            numbers = self.header_index.select(predicates)
+        constraints = sum(hinted, ()) + material
+        if constraints and self.position_index is not None:
+            reached = self.position_index.material.select(constraints)
+            numbers = (
+                reached if numbers is None else sorted(set(numbers).intersection(reached))
+            )
+        if numbers is None:
+            then(self.pgnfilename, None, (0, self.game_count), extra_args)
+            return
+        if not numbers:
+            QMessageBox.information(
+                self, "No Games", "No games match the header and material filters."
+            )
+            return
+        self.log_panel.append(
+            f"<span style='color:blue'>Candidates: {len(numbers)} of "
+            f"{len(self.header_index)} games</span><br>"
+        )
+        self.subset_target(
+            self.header_index,
+            self.pgnfilename,
+            numbers,
+            lambda *target: then(*target, extra_args),
+        )
 
     def open_pgn_file(self):
         filename, _ = QFileDialog.getOpenFileName(
-            self, "Open PGN File", "", "PGN Files (*.pgn)"
+            self,
+            "Open PGN File",
+            "",
+            "PGN Files (*.pgn *.pgnb *.pgn.gz *.pgn.bz2 *.pgn.xz *.pgn.zst)",
         )
         if filename:
+            self.close_database()
             self.pgnfilename = filename
             self.status_bar.showMessage(f"Opening {filename}... Please wait...")
             print(f"Opening {filename}... Please wait...")
             self.act_run.setEnabled(False)
-            counter = CounterProcess(self, self.pgnfilename)
-            counter.countFinished.connect(self.on_count_finished)
-            counter.start()
+            self.act_browse_catalog.setEnabled(False)
+            self.header_index = None
+            self.position_index = None
+            self.game_cache = None
+            if is_compressed(filename):
+                # Queries stream the archive through a pipe; the indexes need
+                # random access, so only the game count is computed
+                self.stream_counter = StreamCounter(filename, self)
+                self.stream_counter.countFinished.connect(self.on_count_finished)
+                self.stream_counter.failed.connect(self.on_error_received)
+                self.stream_counter.start()
+                self.watch_files([filename])
+                return
+            if is_block_pgn(filename):
+                # The block table already knows the game count
+                try:
+                    with BlockPgnReader(filename) as reader:
+                        self.on_count_finished(len(reader))
+                except (OSError, ValueError) as e:
+                    self.on_error_received(str(e))
+                    return
+            else:
+                counter = CounterProcess(self, self.pgnfilename)
+                counter.countFinished.connect(self.on_count_finished)
+                counter.start()
+            self.header_worker = HeaderIndexWorker(self, self.pgnfilename)
+            self.header_worker.finished.connect(self.on_header_index_ready)
+            self.header_worker.start()
+            self.watch_files([self.pgnfilename])
+
+    # ----- Index maintenance -----
+    def watch_files(self, paths: list[str]):
+        if self.file_watcher.files():
+            self.file_watcher.removePaths(self.file_watcher.files())
+        self.changed_files.clear()
+        self.file_watcher.addPaths(paths)
+
+    def on_file_changed(self, path: str):
+        self.changed_files.add(path)
+        self.refresh_timer.start()
+
+    def refresh_changed_files(self):
+        """Update the indexes of files changed on disk, incrementally."""
+        for path in sorted(self.changed_files):
+            if not os.path.exists(path):
+                self.changed_files.discard(path)
+                self.on_error_received(f"{path} was removed or renamed")
+                continue
+            # Editors that replace the file make the watcher drop it
+            if path not in self.file_watcher.files():
+                self.file_watcher.addPath(path)
+            if path == self.pgnfilename and is_compressed(path):
+                # Not indexed; cql reads the new content on its next run
+                self.changed_files.discard(path)
+                self.stream_counter = StreamCounter(path, self)
+                self.stream_counter.countFinished.connect(self.on_count_finished)
+                self.stream_counter.start()
+                self.log_panel.append(
+                    f"<span style='color:blue'>{os.path.basename(path)} changed, "
+                    "counting its games again</span><br>"
+                )
+                continue
+            if path == self.pgnfilename:
+                busy = any(
+                    worker is not None and worker.isRunning()
+                    for worker in (self.header_worker, self.position_worker)
+                )
+                if busy:
+                    continue
+                self.position_index = None
+                self.game_cache = None
+                self.header_worker = HeaderIndexWorker(self, path)
+                self.header_worker.finished.connect(self.on_header_index_ready)
+                self.header_worker.start()
+            elif self.database is not None and path in self.database.files:
+                if not self.database_loader.refresh(path):
+                    continue
+            else:
+                self.changed_files.discard(path)
+                continue
+            self.changed_files.discard(path)
+            self.log_panel.append(
+                f"<span style='color:blue'>{os.path.basename(path)} changed, "
+                "updating its indexes</span><br>"
+            )
+        if self.changed_files:
+            # Still being indexed; look again once that is done
+            self.refresh_timer.start()
+
+    def on_header_index_ready(self, index):
+        if index.pgnfile != self.pgnfilename:
+            return
+        self.header_index = index
+        self.game_count = len(index)
+        self.log_panel.append(
+            f"<span style='color:green'>Header index ready ({len(index)} games, "
+            f"{len(index.players)} players)</span><br>"
+        )
+        self.results_table.set_completion_names(index.players.top_names())
+        self.set_preview_sample(index)
+        self.catalog_file(index.pgnfile)
+        self.position_worker = PositionIndexWorker(self, index)
+        self.position_worker.finished.connect(self.on_position_index_ready)
+        self.position_worker.gameCacheReady.connect(self.on_game_cache_ready)
+        self.position_worker.start()
+
+    def set_preview_sample(self, index):
+        """Write evenly spaced games of the database to a preview sample file."""
+        step = max(1, len(index) // SAMPLE_SIZE)
+        numbers = list(range(1, len(index) + 1, step))[:SAMPLE_SIZE]
+        if not numbers:
+            return
+        # A new file each time: the preview may still be reading the old one
+        fd, sample = tempfile.mkstemp(prefix="qcql-sample-", suffix=".pgn")
+        os.close(fd)
+        self.sample_worker = SubsetWorker(index, numbers, sample, self)
+        self.sample_worker.finished.connect(
+            lambda path, pgnfile=index.pgnfile, size=len(numbers): (
+                self.on_preview_sample_ready(pgnfile, path, size)
+            )
+        )
+        self.sample_worker.failed.connect(self.on_error_received)
+        self.sample_worker.start()
+
+    def on_preview_sample_ready(self, pgnfile: str, path: str, size: int):
+        # Superseded by a newer sample or another file
+        if pgnfile != self.pgnfilename or path != self.sample_worker.out_path:
+            remove_file(path)
+            return
+        self.replace_preview_sample(path)
+        self.preview.set_sample(path, None, size)
+
+    def replace_preview_sample(self, path: str | None):
+        if self.preview_sample is not None:
+            remove_file(self.preview_sample)
+        self.preview_sample = path
+
+    def on_position_index_ready(self, index):
+        if index.pgnfile != self.pgnfilename:
+            return
+        self.position_index = index
+        self.log_panel.append(
+            f"<span style='color:green'>Position index ready ({len(index)} "
+            "positions)</span><br>"
+        )
+
+    def on_game_cache_ready(self, cache):
+        if cache.pgnfile == self.pgnfilename:
+            self.game_cache = cache
 
     def on_count_finished(self, count: int):
+        if self.pgnfilename is None:
+            return
         self.status_bar.showMessage(f"games on file {count} games")
         self.results_table.set_info_text(f"{count} games on file")
         self.act_run.setEnabled(True)
         self.game_count = count
+        if self.header_index is None:
+            # Leading games until the header index allows a spread-out sample
+            size = min(count, SAMPLE_SIZE)
+            self.preview.set_sample(self.pgnfilename, (1, size), size)
 
     def on_cql_finished(self, exitCode, exitStatus, output: str):
         print("CQL Process finished")
 
+    def convert_to_block_pgn(self):
+        source, _ = QFileDialog.getOpenFileName(
+            self,
+            "Convert PGN File",
+            "",
+            "PGN Files (*.pgn *.pgn.gz *.pgn.bz2 *.pgn.xz *.pgn.zst)",
+        )
+        if not source:
+            return
+        stem = source
+        if is_compressed(stem):
+            stem = os.path.splitext(stem)[0]
+        dest, _ = QFileDialog.getSaveFileName(
+            self,
+            "Save Block-Compressed PGN",
+            os.path.splitext(stem)[0] + ".pgnb",
+            "Block-Compressed PGN (*.pgnb)",
+        )
+        if not dest:
+            return
+        self.convert_worker = ConvertWorker(source, dest, self)
+        self.convert_worker.progress.connect(
+            lambda count: self.status_bar.showMessage(f"Converting: {count} games")
+        )
+        self.convert_worker.failed.connect(self.on_error_received)
+        self.convert_worker.finished.connect(
+            lambda path, count: self.log_panel.insertHtml(
+                f"<span style='color:green'>Wrote {count} games to {path}</span><br>"
+            )
+        )
+        self.act_convert.setEnabled(False)
+        self.convert_worker.finished.connect(lambda *_: self.act_convert.setEnabled(True))
+        self.convert_worker.failed.connect(lambda *_: self.act_convert.setEnabled(True))
+        self.convert_worker.start()
+
     def save_query(self):
         filename, _ = QFileDialog.getSaveFileName(
             self, "Save Query", "", "CQL Files (*.cql)"
@@ -487,12 +1559,59 @@ class ChessCQLApp(QMainWindow):
                 f.write(self.cql_editor.editor.toPlainText())
             self.status_bar.showMessage(f"Saved query to {filename}")
 
+    def annotate_results(self):
+        rows = self.results_table.model.rows()
+        if not rows:
+            QMessageBox.information(
+                self, "No Results", "Run a query before annotating its results."
+            )
+            return
+        self.cancel_annotation()
+        self.annotator = BatchAnnotator(rows, self)
+        self.annotator.progressUpdated.connect(
+            lambda done, total: self.status_bar.showMessage(
+                f"Annotating results: {done} of {total} games"
+            )
+        )
+        self.annotator.gameAnnotated.connect(self.results_table.model.update_row)
+        self.annotator.finished.connect(self.on_annotation_finished)
+        if not self.annotator.start():
+            self.annotator = None
+            QMessageBox.warning(
+                self, "No Engine", "No engine is available for batch annotation."
+            )
+            return
+        self.act_annotate.setEnabled(False)
+
+    def edit_engine_settings(self):
+        dlg = EngineSettingsDialog(self.engine_pool.config, self)
+        if dlg.exec_() == QDialog.Accepted:
+            # Every pooled engine, leased ones too, switches to the new settings
+            self.engine_pool.apply_config(dlg.values())
+            self.status_bar.showMessage("Engine settings applied")
+
+    def on_annotation_finished(self):
+        self.act_annotate.setEnabled(True)
+        self.status_bar.showMessage("Annotation finished")
+        self.log_panel.append(
+            "<span style='color:blue'>Engine annotation finished</span><br>"
+        )
+        self.annotator = None
+
+    def cancel_annotation(self):
+        if self.annotator is not None:
+            self.annotator.cancel()
+
     def clear_results_placeholder(self):
+        self.cancel_annotation()
         self.results_table.clear()
         self.log_panel.clear()
         self.log_panel.append("Results cleared")
 
-    def on_games(self, games: str):
+    def on_games(self, games: str, scopes: dict | None = None):
+        """Show cql matches; ``scopes`` maps files to the game ranges scanned."""
+        self.results_scopes = scopes or {}
+        self.cancel_annotation()
         self.results_table.clear()
         self.results_table.load_pgn_threaded(games)
 
@@ -505,6 +1624,28 @@ class ChessCQLApp(QMainWindow):
             QMessageBox.No,
         )
         if ok == QMessageBox.Yes:
+            self.cancel_annotation()
+            self.engine_pool.shutdown()
+            self.preview.shutdown()
+            if self.sample_worker is not None and self.sample_worker.isRunning():
+                self.sample_worker.wait()
+                remove_file(self.sample_worker.out_path)
+            self.replace_preview_sample(None)
+            for worker in self.subset_workers:
+                # The search it was for is not started any more
+                worker.finished.disconnect()
+                worker.wait()
+                remove_file(worker.out_path)
+            if self.windowed_search is not None:
+                self.windowed_search.discard()
+            if self.estimator is not None:
+                self.estimator.cancel()
+            self.validator.shutdown()
+            self.scheduler.shutdown()
+            self.close_database()
+            if self.join_worker is not None:
+                self.join_pending = None
+                self.join_worker.wait()
             a0.accept()
         else:
             a0.ignore()
@@ -10,12 +10,15 @@ from pgn_to_html import pgn_to_html
 class MoveManager(QObject):
     pgnChanged = pyqtSignal(str)
 
-    def __init__(self, pgn_str: str | None = None):
+    def __init__(self, pgn_str: str | None = None, game: chess.pgn.Game | None = None):
         super().__init__()
         self.html, self.nodes = "", []
         self.html_style = False  # True for dark theme
         self.game = chess.pgn.Game()
-        if pgn_str:
+        if game is not None:
+            # Already parsed, e.g. decoded from the game cache
+            self.load_game(game)
+        elif pgn_str:
             self.update_pgn(pgn_str)
         self.current_node = self.game
 
@@ -25,6 +28,11 @@ class MoveManager(QObject):
         self.game.setup(board)
         self.create_mapping()
 
+    def load_game(self, game: chess.pgn.Game):
+        self.game = game
+        self.current_node = self.game
+        self.create_mapping()
+
     def update_pgn(self, pgn_str: str):
         pgn_io = StringIO(pgn_str)
         game = chess.pgn.read_game(pgn_io)
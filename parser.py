@@ -18,7 +18,8 @@ import chess.pgn as chess_pgn
 class PgnTableModel(QtCore.QAbstractTableModel):
     """
     Read-only table model for PGN headers.
-    Columns: Event, Site, Date, Round, White, Black, Result, ECO, Moves (hidden in view)
+    Columns: Event, Site, Date, Round, White, Black, Result, ECO, File, Eval,
+    Swing, Moves (hidden in view; File only shown for multi-file databases)
     """
 
     HEADERS = [
@@ -32,8 +33,13 @@ class PgnTableModel(QtCore.QAbstractTableModel):
         "BlackElo",
         "Result",
         "ECO",
+        "File",
+        "Eval",
+        "Swing",
         "Moves",
     ]
+    # Columns sorted by the numeric value kept under "_<name>" in the row
+    NUMERIC_COLUMNS = {"Eval": "_eval", "Swing": "_swing"}
 
     def __init__(self, rows: List[Dict[str, str]] = None, parent=None):
         super().__init__(parent)
@@ -53,6 +59,12 @@ class PgnTableModel(QtCore.QAbstractTableModel):
             row = self._rows[index.row()]
             col_name = self.HEADERS[index.column()]
             return row.get(col_name, "")
+        if role == QtCore.Qt.UserRole:
+            row = self._rows[index.row()]
+            col_name = self.HEADERS[index.column()]
+            if col_name in self.NUMERIC_COLUMNS:
+                return row.get(self.NUMERIC_COLUMNS[col_name], float("-inf"))
+            return row.get(col_name, "")
         return None
 
     def headerData(
@@ -78,6 +90,18 @@ class PgnTableModel(QtCore.QAbstractTableModel):
         self._rows = rows
         self.endResetModel()
 
+    def rows(self) -> List[Dict[str, str]]:
+        return self._rows
+
+    def update_row(self, row_idx: int, values: Dict[str, str]):
+        """Merge ``values`` into a row and refresh it in attached views."""
+        if not 0 <= row_idx < len(self._rows):
+            return
+        self._rows[row_idx].update(values)
+        self.dataChanged.emit(
+            self.index(row_idx, 0), self.index(row_idx, len(self.HEADERS) - 1)
+        )
+
     def row_dict(self, row_idx: int) -> Dict[str, str]:
         """Full dict for the given row, including extra keys like '_pgn'."""
         if 0 <= row_idx < len(self._rows):
@@ -95,10 +119,13 @@ class PgnTableWidget(QtWidgets.QWidget):
     Public API:
       - load_pgn_text(pgn_text: str)
       - clear()
+      - set_completion_names(names: list)
       - gameSelected(dict) signal
+      - rowsLoaded() signal, after a threaded load
     """
 
     gameSelected = QtCore.pyqtSignal(dict)
+    rowsLoaded = QtCore.pyqtSignal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -127,6 +154,7 @@ class PgnTableWidget(QtWidgets.QWidget):
         self.proxy.setSourceModel(self.model)
         self.proxy.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
         self.proxy.setFilterKeyColumn(-1)  # search across all columns
+        self.proxy.setSortRole(QtCore.Qt.UserRole)
         self.table.setModel(self.proxy)
 
         # Hide Moves column by default
@@ -142,11 +170,21 @@ class PgnTableWidget(QtWidgets.QWidget):
         #self.worker.gameParsed.connect(print)
         self.worker.start()
 
+    def load_games_threaded(self, games, pgnfile: str):
+        """
+        Like load_pgn_threaded, from (game number, chess.pgn.Game) pairs of
+        the games of ``pgnfile``.
+        """
+        self.worker = PGNWorker(self, games=games, pgnfile=pgnfile)
+        self.worker.finished.connect(self.on_worker_finished)
+        self.worker.start()
+
     
     def on_worker_finished(self, rows: List[Dict[str, str]]):
         self.model.set_rows(rows)
         self._hide_moves_column()
         self.table.resizeColumnsToContents()
+        self.rowsLoaded.emit()
 
     # --- Public methods ---
     def load_pgn_text(self, pgn_text: str):
@@ -165,6 +203,13 @@ class PgnTableWidget(QtWidgets.QWidget):
     def set_info_text(self, text: str):
         self.info_label.setText(str(text))
 
+    def set_completion_names(self, names: List[str]):
+        """Offer player names from the database index in the filter box."""
+        completer = QtWidgets.QCompleter(names, self.filter_edit)
+        completer.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        completer.setFilterMode(QtCore.Qt.MatchContains)
+        self.filter_edit.setCompleter(completer)
+
     # --- Internal slots / helpers ---
     def _hide_moves_column(self):
         try:
@@ -172,6 +217,10 @@ class PgnTableWidget(QtWidgets.QWidget):
             self.table.setColumnHidden(moves_col, True)
         except ValueError:
             pass
+        # The source file column only matters for multi-file databases
+        file_col = PgnTableModel.HEADERS.index("File")
+        has_files = any(row.get("File") for row in self.model.rows())
+        self.table.setColumnHidden(file_col, not has_files)
 
     def _on_filter_text_changed(self, text: str):
         # Use wildcard to get "contains" behavior
@@ -190,6 +239,10 @@ class PgnTableWidget(QtWidgets.QWidget):
         payload = {h: row_data.get(h, "") for h in PgnTableModel.HEADERS}
         # Also include full raw PGN for consumer display
         payload["PGN"] = row_data.get("_pgn", "")
+        # Game number and the file it numbers, when known; lets the viewer
+        # load the game from the game cache of that file
+        payload["Number"] = row_data.get("_number")
+        payload["Source"] = row_data.get("_source")
         self.gameSelected.emit(payload)
 
     # --- Parsing ---
@@ -247,6 +300,7 @@ class PgnTableWidget(QtWidgets.QWidget):
                 "BlackElo": H.get("BlackElo", ""),
                 "Result": H.get("Result", ""),
                 "ECO": H.get("ECO", ""),
+                "File": H.get("SourceFile", ""),
                 # Keep moves for later use (hidden column)
                 "Moves": PgnTableWidget._game_moves_san(game),
                 # Extras not shown as columns:
@@ -260,14 +314,52 @@ class PGNWorker(QtCore.QThread):
     finished = QtCore.pyqtSignal(list)
     gameParsed = QtCore.pyqtSignal(int)
 
-    def __init__(self, parent=None, pgn_text: str = ""):
+    def __init__(self, parent=None, pgn_text: str = "", games=None, pgnfile: str = ""):
         self.pgn_text = pgn_text
+        self.games = games  # (game number, chess.pgn.Game) pairs, or None
+        self.pgnfile = pgnfile  # the file ``games`` are numbered in
         super().__init__(parent)
 
     def run(self):
-        rows = self._parse_pgn_text_to_rows(self.pgn_text)
+        if self.games is not None:
+            rows = self._games_to_rows(self.games)
+        else:
+            rows = self._parse_pgn_text_to_rows(self.pgn_text)
         self.finished.emit(rows)
 
+    def _games_to_rows(self, games) -> List[Dict[str, str]]:
+        rows: List[Dict[str, str]] = []
+        for number, game in games:
+            self.gameParsed.emit(len(rows))
+            if game is None or game.next() is None:
+                continue
+            row = self._game_to_row(game)
+            row["_number"] = number
+            row["_source"] = self.pgnfile
+            rows.append(row)
+        return rows
+
+    @staticmethod
+    def _game_to_row(game: chess_pgn.Game) -> Dict[str, str]:
+        H = game.headers  # chess.pgn.Headers
+        return {
+            "Event": H.get("Event", ""),
+            "Site": H.get("Site", ""),
+            "Date": PgnTableWidget._normalize_pgn_date(H.get("Date", "")),
+            "Round": H.get("Round", ""),
+            "White": H.get("White", ""),
+            "Black": H.get("Black", ""),
+            "WhiteElo": H.get("WhiteElo", ""),
+            "BlackElo": H.get("BlackElo", ""),
+            "Result": H.get("Result", ""),
+            "ECO": H.get("ECO", ""),
+            "File": H.get("SourceFile", ""),
+            # Keep moves for later use (hidden column)
+            "Moves": PgnTableWidget._game_moves_san(game),
+            # Extras not shown as columns:
+            "_pgn": str(game).strip(),
+        }
+
     def _parse_pgn_text_to_rows(self,pgn_text: str) -> List[Dict[str, str]]:
         """
         Convert PGN text into a list of rows (dicts). Each row includes:
@@ -284,26 +376,9 @@ class PGNWorker(QtCore.QThread):
             if game is None:
                 break
 
-            H = game.headers  # chess.pgn.Headers
             if len(list(game.mainline_moves())) == 0:
                 continue
-            row = {
-                "Event": H.get("Event", ""),
-                "Site": H.get("Site", ""),
-                "Date": PgnTableWidget._normalize_pgn_date(H.get("Date", "")),
-                "Round": H.get("Round", ""),
-                "White": H.get("White", ""),
-                "Black": H.get("Black", ""),
-                "WhiteElo": H.get("WhiteElo", ""),
-                "BlackElo": H.get("BlackElo", ""),
-                "Result": H.get("Result", ""),
-                "ECO": H.get("ECO", ""),
-                # Keep moves for later use (hidden column)
-                "Moves": PgnTableWidget._game_moves_san(game),
-                # Extras not shown as columns:
-                "_pgn": str(game).strip(),
-            }
-            rows.append(row)
+            rows.append(self._game_to_row(game))
         return rows
 
 
@@ -0,0 +1,544 @@
+"""
+Header catalog for PGN databases.
+
+The catalog is built once when a PGN file is opened, by a byte-level scan
+that only reads tag pairs, and is stored under ``data/index``. It maps
+CQL game numbers (1-based, file order) to byte offsets and the headers
+used for pushdown: players, event, year, Elo and result. Header predicates
+resolve to candidate game numbers, which are handed to CQL as a
+``-gamenumber`` range or as a pre-extracted subset file.
+
+Each stored index remembers a FileState of the PGN file it was built
+from. When the file changes, only the games from the first changed block
+onwards are scanned again, so a routine append costs a scan of the new
+games instead of a full reindex.
+"""
+
+import hashlib
+import os
+import pickle
+import re
+import shlex
+import unicodedata
+import zlib
+from array import array
+from bisect import bisect_left
+
+from PyQt5 import QtCore
+
+from blockpgn import GameSplitter, is_block_pgn, open_pgn, stream_size
+
+INDEX_ROOT = "data/index"
+RESULTS = ["1-0", "0-1", "1/2-1/2", "*"]
+TEXT_FIELDS = ("white", "black", "player", "event")
+PLAYER_FIELDS = ("white", "black", "player")
+INDEXED_FIELDS = TEXT_FIELDS + ("result", "year", "elo", "whiteelo", "blackelo")
+
+
+def index_dir(pgnfile: str) -> str:
+    """Directory holding every index built for ``pgnfile``."""
+    digest = hashlib.sha1(os.path.abspath(pgnfile).encode()).hexdigest()[:16]
+    path = os.path.join(INDEX_ROOT, digest)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_signature(pgnfile: str) -> tuple[int, float]:
+    stat = os.stat(pgnfile)
+    return stat.st_size, stat.st_mtime
+
+
+class FileState:
+    """
+    Size, mtime and sampled checksums of a file: the CRC of the first
+    ``SAMPLE`` bytes of every ``BLOCK``, plus the CRC of the last ``SAMPLE``
+    bytes. Capturing or checking reads a few KB per MB of file.
+    """
+
+    BLOCK = 1 << 20
+    SAMPLE = 4096
+
+    def __init__(self, size: int = 0, mtime: float = 0.0, samples=None, tail: int = 0):
+        self.size = size
+        self.mtime = mtime
+        self.samples = samples if samples is not None else array("I")
+        self.tail = tail
+
+    @classmethod
+    def capture(cls, path: str) -> "FileState":
+        size, mtime = file_signature(path)
+        with open(path, "rb") as f:
+            samples = array("I", cls._samples(f, size))
+            tail = cls._tail(f, size)
+        return cls(size, mtime, samples, tail)
+
+    @classmethod
+    def _samples(cls, f, size: int):
+        for start in range(0, size, cls.BLOCK):
+            f.seek(start)
+            yield zlib.crc32(f.read(min(cls.SAMPLE, size - start)))
+
+    @classmethod
+    def _tail(cls, f, size: int) -> int:
+        f.seek(max(0, size - cls.SAMPLE))
+        return zlib.crc32(f.read(size - f.tell()))
+
+    def changed_from(self, path: str) -> int | None:
+        """
+        Offset from which ``path`` may differ from the captured file (the old
+        size when it was only appended to), or None when the size is the
+        same and no sample differs. An edit that shifts the rest of the file
+        is noticed at the next sample, so it lies after the last sample
+        that still matches.
+        """
+        size, mtime = file_signature(path)
+        if (size, mtime) == (self.size, self.mtime):
+            return None
+        common = min(size, self.size)
+        with open(path, "rb") as f:
+            for block, sample in enumerate(self._samples(f, common)):
+                if block >= len(self.samples) or sample != self.samples[block]:
+                    return self._after(block)
+            blocks = -(-common // self.BLOCK)
+            if size < self.size:
+                return min(self._after(blocks), size)
+            if self._tail(f, self.size) != self.tail:
+                return min(self._after(blocks), max(0, self.size - self.SAMPLE))
+        return None if size == self.size else self.size
+
+    def _after(self, block: int) -> int:
+        """End of the sample of the block before ``block``."""
+        return (block - 1) * self.BLOCK + self.SAMPLE if block else 0
+
+
+def iter_game_headers(pgnfile: str, start: int = 0):
+    """Yield ``(offset, headers)`` for every game, reading only tag lines."""
+    with open_pgn(pgnfile) as f:
+        f.seek(start)
+        offset = game_offset = start
+        headers = None
+        splitter = GameSplitter()
+        for line in f:
+            if splitter.starts_game(line):
+                if headers is not None:
+                    yield game_offset, headers
+                headers = {}
+                game_offset = offset
+            match = splitter.tag
+            if match:
+                headers[match.group(1).decode("latin-1")] = match.group(2).decode(
+                    "utf-8", errors="replace"
+                )
+            offset += len(line)
+        if headers is not None:
+            yield game_offset, headers
+
+
+def _to_int(value: str) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def normalize_name(name: str) -> str:
+    """``Carlsen,Magnus`` and ``carlsen  magnus`` both become ``carlsen magnus``."""
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(re.split(r"[\W_]+", name.lower())).strip()
+
+
+def trigrams(text: str) -> set[str]:
+    return {
+        token[i : i + 3]
+        for token in text.split()
+        for i in range(len(token) - 2)
+    }
+
+
+def encode_postings(numbers: list[int]) -> bytes:
+    """Delta + varint encoding of ascending game numbers."""
+    out = bytearray()
+    previous = 0
+    for number in numbers:
+        delta = number - previous
+        previous = number
+        while delta >= 0x80:
+            out.append(delta & 0x7F | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_postings(data: bytes) -> list[int]:
+    numbers = []
+    value = shift = previous = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += value
+        numbers.append(previous)
+        value = shift = 0
+    return numbers
+
+
+class PlayerIndex:
+    """
+    Normalized player names mapped to compressed posting lists of game
+    numbers, one for games as White and one as Black. A trigram table over
+    the names narrows down the candidates of a query, which then match like
+    CQL's ``player`` filter: the normalized query is a substring of the
+    normalized name, so ``sen`` finds ``Carlsen, Magnus`` and ``Sen, Amit``.
+    Names where every query word starts a word (``Carlsen, M``) rank first.
+    """
+
+    def __init__(self):
+        self.names: list[str] = []  # display name of each normalized name
+        self.normalized: list[str] = []
+        self.white: list[bytes] = []
+        self.black: list[bytes] = []
+        self.counts = array("I")
+        self.trigram_table: dict[str, array] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def build(self, white: list[str], black: list[str]):
+        ids: dict[str, int] = {}
+        raw_ids: dict[str, int | None] = {}  # spellings repeat across games
+        postings: list[tuple[list[int], list[int]]] = []
+        for column, side in ((white, 0), (black, 1)):
+            for number, name in enumerate(column, 1):
+                if name in raw_ids:
+                    name_id = raw_ids[name]
+                else:
+                    key = normalize_name(name)
+                    name_id = ids.get(key) if key else None
+                    if key and name_id is None:
+                        name_id = ids[key] = len(self.names)
+                        self.names.append(name)
+                        self.normalized.append(key)
+                        postings.append(([], []))
+                    raw_ids[name] = name_id
+                if name_id is not None:
+                    postings[name_id][side].append(number)
+        for white_games, black_games in postings:
+            self.white.append(encode_postings(white_games))
+            self.black.append(encode_postings(black_games))
+            self.counts.append(len(white_games) + len(black_games))
+        table: dict[str, array] = {}
+        for name_id, key in enumerate(self.normalized):
+            for gram in trigrams(key):
+                table.setdefault(gram, array("I")).append(name_id)
+        self.trigram_table = table
+
+    def resolve(self, query: str) -> list[int]:
+        """
+        Ids of every name containing ``query``, word-prefix matches first.
+        The set is never smaller than the names CQL would match.
+        """
+        query = normalize_name(query)
+        if not query:
+            return []
+        grams = trigrams(query)
+        if grams:
+            lists = sorted(
+                (self.trigram_table.get(g, array("I")) for g in grams), key=len
+            )
+            candidates = set(lists[0]).intersection(*lists[1:])
+        else:
+            candidates = range(len(self.names))
+        words = query.split()
+        matches = [i for i in sorted(candidates) if query in self.normalized[i]]
+        # Ranking only; the prefix hits are a subset of the substring hits
+        return sorted(
+            matches,
+            key=lambda i: not all(
+                any(part.startswith(word) for part in self.normalized[i].split())
+                for word in words
+            ),
+        )
+
+    def games(self, query: str, side: str = "player") -> list[int]:
+        """Ascending game numbers of ``query`` as White, Black or either."""
+        numbers = set()
+        for name_id in self.resolve(query):
+            if side in ("player", "white"):
+                numbers.update(decode_postings(self.white[name_id]))
+            if side in ("player", "black"):
+                numbers.update(decode_postings(self.black[name_id]))
+        return sorted(numbers)
+
+    def top_names(self, limit: int = 50000) -> list[str]:
+        """Display names ordered by number of games, for completers."""
+        order = sorted(range(len(self.names)), key=lambda i: -self.counts[i])
+        return [self.names[i] for i in order[:limit]]
+
+
+class HeaderIndex:
+    """Columnar header catalog; list position ``i`` is game number ``i + 1``."""
+
+    VERSION = 3
+    COLUMNS = (
+        "offsets", "white", "black", "event", "year", "white_elo", "black_elo", "result"
+    )
+
+    def __init__(self, pgnfile: str):
+        self.pgnfile = pgnfile
+        self.file_state = FileState()
+        self.players = PlayerIndex()
+        self.offsets = array("Q")
+        self.white: list[str] = []
+        self.black: list[str] = []
+        self.event: list[str] = []
+        self.year = array("H")
+        self.white_elo = array("H")
+        self.black_elo = array("H")
+        self.result = array("b")
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    # ---------- Building ----------
+    def add(self, offset: int, headers: dict):
+        self.offsets.append(offset)
+        self.white.append(headers.get("White", ""))
+        self.black.append(headers.get("Black", ""))
+        self.event.append(headers.get("Event", ""))
+        self.year.append(_to_int(headers.get("Date", "")[:4]))
+        self.white_elo.append(min(_to_int(headers.get("WhiteElo")), 65535))
+        self.black_elo.append(min(_to_int(headers.get("BlackElo")), 65535))
+        result = headers.get("Result", "*")
+        self.result.append(RESULTS.index(result) if result in RESULTS else 3)
+
+    def build(self, progress=None, start: int = 0):
+        """Scan games from byte ``start`` (a game boundary) to the end."""
+        for number, (offset, headers) in enumerate(
+            iter_game_headers(self.pgnfile, start), len(self) + 1
+        ):
+            self.add(offset, headers)
+            if progress and number % 10000 == 0:
+                progress(number)
+        self.players = PlayerIndex()
+        self.players.build(self.white, self.black)
+        self.file_state = FileState.capture(self.pgnfile)
+
+    def refresh(self, progress=None) -> int | None:
+        """
+        Bring the catalog up to date with the file on disk. Games starting
+        after the first changed byte are scanned again, and so is the game
+        before them, which may run into the change. Returns the first game
+        number scanned again, or None when the file did not change.
+        """
+        changed = self.file_state.changed_from(self.pgnfile)
+        if changed is None:
+            self.file_state.mtime = file_signature(self.pgnfile)[1]
+            return None
+        if is_block_pgn(self.pgnfile):
+            changed = 0  # .pgnb files are rewritten whole by the converter
+        keep = max(0, bisect_left(self.offsets, changed) - 1)
+        start = self.offsets[keep] if keep < len(self) else 0
+        self.truncate(keep)
+        self.build(progress, start)
+        return keep + 1
+
+    def truncate(self, count: int):
+        """Forget every game after the first ``count``."""
+        for name in self.COLUMNS:
+            del getattr(self, name)[count:]
+
+    # ---------- Persistence ----------
+    @staticmethod
+    def path_for(pgnfile: str) -> str:
+        return os.path.join(index_dir(pgnfile), "headers.idx")
+
+    def save(self):
+        with open(self.path_for(self.pgnfile), "wb") as f:
+            pickle.dump((self.VERSION, self.__dict__), f)
+
+    @classmethod
+    def load(cls, pgnfile: str) -> "HeaderIndex | None":
+        """Load a stored catalog; ``refresh`` brings it up to date with the file."""
+        try:
+            with open(cls.path_for(pgnfile), "rb") as f:
+                version, state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        if version != cls.VERSION:
+            return None
+        index = cls(pgnfile)
+        index.__dict__.update(state)
+        return index
+
+    # ---------- Queries ----------
+    def select(self, predicates: list[tuple]) -> list[int]:
+        """Game numbers (1-based, ascending) matching every predicate."""
+        candidates = None
+        # Player predicates come straight from the posting lists
+        for field, value in (p for p in predicates if p[0] in PLAYER_FIELDS):
+            if not normalize_name(value):
+                # Punctuation only; the names index cannot narrow it down
+                continue
+            games = self.players.games(value, field)
+            candidates = (
+                games if candidates is None else sorted(set(candidates).intersection(games))
+            )
+        candidates = range(len(self)) if candidates is None else [n - 1 for n in candidates]
+        for predicate in predicates:
+            if predicate[0] in PLAYER_FIELDS:
+                continue
+            test = self._compile(predicate)
+            candidates = [i for i in candidates if test(i)]
+        return [i + 1 for i in candidates]
+
+    def _compile(self, predicate: tuple):
+        field = predicate[0]
+        if field in TEXT_FIELDS:
+            needle = predicate[1].lower()
+            column = getattr(self, field)
+            return lambda i: needle in column[i].lower()
+        if field == "result":
+            code = RESULTS.index(predicate[1])
+            return lambda i: self.result[i] == code
+        low, high = predicate[1], predicate[2]
+        if field == "year":
+            return lambda i: low <= self.year[i] <= high
+        if field == "elo":
+            return lambda i: (
+                low <= self.white_elo[i] <= high and low <= self.black_elo[i] <= high
+            )
+        if field in ("whiteelo", "blackelo"):
+            column = self.white_elo if field == "whiteelo" else self.black_elo
+            return lambda i: low <= column[i] <= high
+        raise ValueError(f"Unknown header field: {field}")
+
+    def game_span(self, number: int, file_size: int) -> tuple[int, int]:
+        """Byte range ``[start, end)`` of game ``number``."""
+        start = self.offsets[number - 1]
+        end = self.offsets[number] if number < len(self) else file_size
+        return start, end
+
+
+def parse_range(text: str) -> tuple[int, int]:
+    """Parse ``2600-2700``, ``2600-``, ``-2700``, ``>=2600``, ``<2700`` or ``2015``."""
+    text = text.strip()
+    for op in (">=", "<=", ">", "<"):
+        if text.startswith(op):
+            value = int(text[len(op):])
+            return {
+                ">=": (value, 65535),
+                ">": (value + 1, 65535),
+                "<=": (0, value),
+                "<": (0, value - 1),
+            }[op]
+    if "-" in text:
+        low, high = text.split("-", 1)
+        return int(low) if low else 0, int(high) if high else 65535
+    value = int(text)
+    return value, value
+
+
+def parse_header_filter(text: str) -> list[tuple]:
+    """
+    Parse ``field:value`` terms such as
+    ``player:"Carlsen, Magnus" year:2015-2020 elo:>=2600 result:1-0``
+    or ``material:KRvKB``.
+    Raises ValueError on unknown fields or malformed values.
+    """
+    predicates = []
+    for term in shlex.split(text):
+        field, sep, value = term.partition(":")
+        field = field.lower()
+        if not sep or not value:
+            raise ValueError(f"Expected field:value, got '{term}'")
+        if field in TEXT_FIELDS:
+            predicates.append((field, value))
+        elif field == "result":
+            if value not in RESULTS:
+                raise ValueError(f"Unknown result '{value}'")
+            predicates.append((field, value))
+        elif field in ("year", "elo", "whiteelo", "blackelo"):
+            predicates.append((field, *parse_range(value)))
+        elif field == "material":
+            # Resolved against the material index, see position_index
+            predicates.append((field, value))
+        else:
+            raise ValueError(f"Unknown header field '{field}'")
+    return predicates
+
+
+def to_ranges(numbers: list[int]) -> list[tuple[int, int]]:
+    """Collapse ascending game numbers into inclusive ``(first, last)`` runs."""
+    ranges = []
+    for number in numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], number)
+        else:
+            ranges.append((number, number))
+    return ranges
+
+
+def write_subset(index: HeaderIndex, numbers: list[int], out_path: str):
+    """Copy the selected games, in order, into a new PGN file."""
+    with open_pgn(index.pgnfile) as src, open(out_path, "wb") as dst:
+        file_size = stream_size(src)
+        for first, last in to_ranges(numbers):
+            start, _ = index.game_span(first, file_size)
+            _, end = index.game_span(last, file_size)
+            src.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = src.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                remaining -= len(chunk)
+            dst.write(b"\n")
+
+
+class SubsetWorker(QtCore.QThread):
+    """Runs ``write_subset`` off the GUI thread."""
+
+    finished = QtCore.pyqtSignal(str)  # out_path
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(
+        self, index: HeaderIndex, numbers: list[int], out_path: str, parent=None
+    ):
+        super().__init__(parent)
+        self.index = index
+        self.numbers = numbers
+        self.out_path = out_path
+
+    def run(self):
+        try:
+            write_subset(self.index, self.numbers, self.out_path)
+        except OSError as e:
+            try:
+                os.remove(self.out_path)
+            except OSError:
+                pass
+            self.failed.emit(f"Could not write {self.out_path}: {e}")
+            return
+        self.finished.emit(self.out_path)
+
+
+class HeaderIndexWorker(QtCore.QThread):
+    finished = QtCore.pyqtSignal(object)
+    progress = QtCore.pyqtSignal(int)
+
+    def __init__(self, parent=None, pgnfile: str = ""):
+        super().__init__(parent)
+        self.pgnfile = pgnfile
+
+    def run(self):
+        index = HeaderIndex.load(self.pgnfile)
+        if index is None:
+            index = HeaderIndex(self.pgnfile)
+            index.build(self.progress.emit)
+            index.save()
+        elif index.refresh(self.progress.emit) is not None:
+            index.save()
+        self.finished.emit(index)
@@ -0,0 +1,399 @@
+"""
+Zobrist position index for exact-position search.
+
+Every mainline position of every game is hashed with the polyglot Zobrist
+keys of its pieces only, like CQL's ``fen`` filter compares piece placement
+only (side to move, castling and en passant are ignored), and stored as a sorted array of keys with a parallel array of
+``(game number, ply)`` postings. A lookup is a binary search, so "all games
+reaching this FEN" is answered in milliseconds without running CQL. The
+index is built in the background from the header catalog offsets, which
+keeps its game numbers identical to the ones CQL uses.
+
+The same pass records the material signatures each game reaches (see
+MaterialIndex), used to prune endgame queries before CQL runs, and fills
+the binary game cache (see game_cache.py) with the parsed games.
+
+Entries are collected in ``array('Q')`` chunks; every full chunk is sorted
+and spilled to a file next to the index, and the chunk files are merged
+into the final arrays, so a build never holds more than one chunk of
+unsorted entries. The arrays are saved raw after a small pickled header.
+
+When the PGN file changes, ``refresh`` drops the games from the first
+changed one onwards and indexes them again, merging the new entries into
+the sorted arrays instead of rebuilding everything.
+"""
+
+import heapq
+import os
+import pickle
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from io import StringIO
+
+import chess
+import chess.pgn
+import chess.polyglot
+from PyQt5 import QtCore
+
+from blockpgn import is_block_pgn, open_pgn, stream_size
+from game_cache import GameCache, load_index_config
+from pgn_index import FileState, HeaderIndex, index_dir
+
+PLY_BITS = 16
+CHUNK_ENTRIES = 1 << 21  # entries sorted in memory before going to disk
+MERGE_READ = 1 << 16  # entries read at a time from each chunk file
+# Order of the per-side counts in a material signature
+MATERIAL_PIECES = "QRBNPqrbnp"
+PIECE_TYPES = [chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT, chess.PAWN]
+
+
+PLACEMENT_HASHER = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+
+
+def position_hash(fen: str) -> int:
+    """Hash of the piece placement field of ``fen``; raises ValueError if invalid."""
+    return PLACEMENT_HASHER.hash_board(chess.BaseBoard(fen.split()[0]))
+
+
+def read_game_text(index: HeaderIndex, number: int, f=None) -> str:
+    """Raw PGN text of game ``number``; ``f`` is an open binary handle to reuse."""
+    if f is None:
+        with open_pgn(index.pgnfile) as f:
+            return read_game_text(index, number, f)
+    start, end = index.game_span(number, stream_size(f))
+    f.seek(start)
+    return f.read(end - start).decode("utf-8", errors="replace")
+
+
+def iter_games(index: HeaderIndex, numbers: list[int]):
+    """(number, chess.pgn.Game) pairs of the games ``numbers``, parsed lazily."""
+    with open_pgn(index.pgnfile) as f:
+        for number in numbers:
+            text = read_game_text(index, number, f)
+            yield number, chess.pgn.read_game(StringIO(text))
+
+
+def material_signature(board: chess.Board) -> tuple[int, ...]:
+    """Piece counts in MATERIAL_PIECES order (kings are implied)."""
+    return tuple(
+        board.pieces_mask(piece_type, color).bit_count()
+        for color in (chess.WHITE, chess.BLACK)
+        for piece_type in PIECE_TYPES
+    )
+
+
+def parse_material(text: str) -> tuple[tuple[str, int, int], ...]:
+    """
+    Parse a material hint such as ``KRvKB`` or ``KRPPvKR`` into count
+    constraints. Queens, rooks and minor pieces are exact; pawns are only
+    constrained when the hint names at least one.
+    """
+    white, sep, black = text.upper().partition("V")
+    if not sep or not white.startswith("K") or not black.startswith("K"):
+        raise ValueError(f"Expected material like KRvKB, got '{text}'")
+    has_pawns = "P" in white + black
+    constraints = []
+    for side, pieces in ((str.upper, white[1:]), (str.lower, black[1:])):
+        for piece in "QRBNP":
+            if piece == "P" and not has_pawns:
+                continue
+            count = pieces.count(piece)
+            constraints.append((side(piece), count, count))
+        if set(pieces) - set("QRBNP"):
+            raise ValueError(f"Unknown piece in material '{text}'")
+    return tuple(constraints)
+
+
+def satisfies(signature: tuple[int, ...], constraints) -> bool:
+    for pieces, low, high in constraints:
+        count = sum(signature[MATERIAL_PIECES.index(p)] for p in pieces)
+        if not low <= count <= high:
+            return False
+    return True
+
+
+class MaterialIndex:
+    """
+    Material signatures reached by each game. Distinct signatures get an id
+    and every game keeps a bitset (a Python int) of the ids it reached.
+    """
+
+    def __init__(self):
+        self.signatures: list[tuple[int, ...]] = []
+        self.ids: dict[tuple[int, ...], int] = {}
+        self.games: list[int] = []  # position i is game number i + 1
+
+    def add_game(self, number: int, signatures: set[tuple[int, ...]]):
+        while len(self.games) < number:
+            self.games.append(0)
+        bits = 0
+        for signature in signatures:
+            sig_id = self.ids.get(signature)
+            if sig_id is None:
+                sig_id = self.ids[signature] = len(self.signatures)
+                self.signatures.append(signature)
+            bits |= 1 << sig_id
+        self.games[number - 1] = bits
+
+    def select(self, constraints) -> list[int]:
+        """Game numbers reaching at least one signature meeting ``constraints``."""
+        mask = 0
+        for sig_id, signature in enumerate(self.signatures):
+            if satisfies(signature, constraints):
+                mask |= 1 << sig_id
+        if not mask:
+            return []
+        return [i + 1 for i, bits in enumerate(self.games) if bits & mask]
+
+
+def _sorted_chunk(keys: array, postings: array) -> tuple[array, array]:
+    """
+    Parallel arrays ordered by key. Postings are appended in game and ply
+    order and the sort is stable, so equal keys keep them sorted.
+    """
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return (
+        array("Q", map(keys.__getitem__, order)),
+        array("Q", map(postings.__getitem__, order)),
+    )
+
+
+def _read_chunk(path: str, count: int):
+    """``(key, posting)`` pairs of a spilled chunk, read a slice at a time."""
+    with open(path, "rb") as f:
+        for start in range(0, count, MERGE_READ):
+            size = min(MERGE_READ, count - start)
+            keys, postings = array("Q"), array("Q")
+            f.seek(start * keys.itemsize)
+            keys.fromfile(f, size)
+            f.seek((count + start) * postings.itemsize)
+            postings.fromfile(f, size)
+            yield from zip(keys, postings)
+
+
+class _ChunkSorter:
+    """
+    Collects index entries in array chunks of CHUNK_ENTRIES. Full chunks are
+    sorted and written to ``directory`` (keys, then postings); ``sources``
+    gives every chunk as a sorted stream for a k-way merge.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.keys = array("Q")
+        self.postings = array("Q")
+        self.chunks: list[tuple[str, int]] = []  # path, entries
+
+    def add(self, key: int, posting: int):
+        self.keys.append(key)
+        self.postings.append(posting)
+        if len(self.keys) >= CHUNK_ENTRIES:
+            self._spill()
+
+    def _spill(self):
+        keys, postings = _sorted_chunk(self.keys, self.postings)
+        path = os.path.join(self.directory, f"chunk-{len(self.chunks)}.bin")
+        with open(path, "wb") as f:
+            keys.tofile(f)
+            postings.tofile(f)
+        self.chunks.append((path, len(keys)))
+        self.keys, self.postings = array("Q"), array("Q")
+
+    def sources(self) -> list:
+        keys, postings = _sorted_chunk(self.keys, self.postings)
+        self.keys, self.postings = array("Q"), array("Q")
+        spilled = [_read_chunk(path, count) for path, count in self.chunks]
+        return spilled + [zip(keys, postings)]
+
+
+class PositionIndex:
+    """Sorted Zobrist keys with parallel ``game << 16 | ply`` postings."""
+
+    VERSION = 5
+
+    def __init__(self, pgnfile: str):
+        self.pgnfile = pgnfile
+        self.file_state = FileState()
+        self.game_count = 0
+        self.keys = array("Q")
+        self.postings = array("Q")
+        self.material = MaterialIndex()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    # ---------- Building ----------
+    def build(self, header_index: HeaderIndex, progress=None, games: GameCache = None):
+        with self._workdir() as workdir:
+            sorter = _ChunkSorter(workdir)
+            self._index_games(header_index, 1, sorter, progress, games)
+            self._merge(sorter.sources())
+        self.game_count = len(header_index)
+        self.file_state = FileState.capture(self.pgnfile)
+
+    def refresh(
+        self, header_index: HeaderIndex, progress=None, games: GameCache = None
+    ) -> int | None:
+        """
+        Re-index the games from the first one the file changed in, using the
+        up-to-date ``header_index``. Returns that game number, or None.
+        """
+        changed = self.file_state.changed_from(self.pgnfile)
+        if changed is None and self.game_count == len(header_index):
+            return None
+        first = self.game_count + 1
+        if changed is not None and is_block_pgn(self.pgnfile):
+            first = 1  # .pgnb files are rewritten whole by the converter
+        elif changed is not None:
+            first = min(first, max(0, bisect_left(header_index.offsets, changed) - 1) + 1)
+        kept = (
+            (k, p) for k, p in zip(self.keys, self.postings) if p >> PLY_BITS < first
+        )
+        del self.material.games[first - 1 :]
+        if games is not None:
+            games.truncate(first - 1)
+        with self._workdir() as workdir:
+            sorter = _ChunkSorter(workdir)
+            self._index_games(header_index, first, sorter, progress, games)
+            self._merge([kept] + sorter.sources())
+        self.game_count = len(header_index)
+        self.file_state = FileState.capture(self.pgnfile)
+        return first
+
+    def _index_games(
+        self,
+        header_index: HeaderIndex,
+        first: int,
+        sorter: _ChunkSorter,
+        progress=None,
+        games=None,
+    ):
+        """
+        Add the entries of games ``first``..end to ``sorter``; records their
+        material too, and appends the games to the ``games`` cache when given.
+        """
+        with open_pgn(self.pgnfile) as f:
+            for number in range(first, len(header_index) + 1):
+                game = chess.pgn.read_game(
+                    StringIO(read_game_text(header_index, number, f))
+                )
+                if games is not None:
+                    games.add(game)
+                if game is None:
+                    continue
+                board = game.board()
+                sorter.add(*self._entry(board, number, 0))
+                signatures = {material_signature(board)}
+                for ply, move in enumerate(game.mainline_moves(), 1):
+                    # Material only changes on captures and promotions
+                    changes = board.is_capture(move) or move.promotion
+                    board.push(move)
+                    sorter.add(*self._entry(board, number, ply))
+                    if changes:
+                        signatures.add(material_signature(board))
+                self.material.add_game(number, signatures)
+                if progress and number % 1000 == 0:
+                    progress(number)
+
+    def _workdir(self):
+        """Scratch directory for spilled chunks, next to the index itself."""
+        return tempfile.TemporaryDirectory(
+            prefix="positions-", dir=index_dir(self.pgnfile)
+        )
+
+    def _merge(self, sources: list):
+        """Merge sorted ``(key, posting)`` streams into the index arrays."""
+        keys, postings = array("Q"), array("Q")
+        for key, posting in heapq.merge(*sources):
+            keys.append(key)
+            postings.append(posting)
+        self.keys, self.postings = keys, postings
+
+    @staticmethod
+    def _entry(board: chess.Board, number: int, ply: int) -> tuple[int, int]:
+        key = PLACEMENT_HASHER.hash_board(board)
+        return key, number << PLY_BITS | min(ply, (1 << PLY_BITS) - 1)
+
+    # ---------- Persistence ----------
+    @staticmethod
+    def path_for(pgnfile: str) -> str:
+        return os.path.join(index_dir(pgnfile), "positions.idx")
+
+    def save(self):
+        """A pickled header with the entry count, then the raw arrays."""
+        state = {
+            "file_state": self.file_state,
+            "game_count": self.game_count,
+            "material": self.material,
+            "entries": len(self.keys),
+        }
+        with open(self.path_for(self.pgnfile), "wb") as f:
+            pickle.dump((self.VERSION, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.keys.tofile(f)
+            self.postings.tofile(f)
+
+    @classmethod
+    def load(cls, pgnfile: str) -> "PositionIndex | None":
+        index = cls(pgnfile)
+        try:
+            with open(cls.path_for(pgnfile), "rb") as f:
+                version, state = pickle.load(f)
+                if version != cls.VERSION:
+                    return None
+                index.keys.fromfile(f, state["entries"])
+                index.postings.fromfile(f, state["entries"])
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        index.file_state = state["file_state"]
+        index.game_count = state["game_count"]
+        index.material = state["material"]
+        return index
+
+    # ---------- Queries ----------
+    def lookup(self, fen: str) -> list[tuple[int, int]]:
+        """``(game number, ply)`` of every occurrence of the piece placement."""
+        key = position_hash(fen)
+        low = bisect_left(self.keys, key)
+        high = bisect_right(self.keys, key, low)
+        mask = (1 << PLY_BITS) - 1
+        return [(p >> PLY_BITS, p & mask) for p in self.postings[low:high]]
+
+    def games(self, fen: str) -> list[int]:
+        """Game numbers (ascending) reaching the position at least once."""
+        return sorted({number for number, _ in self.lookup(fen)})
+
+
+class PositionIndexWorker(QtCore.QThread):
+    finished = QtCore.pyqtSignal(object)
+    gameCacheReady = QtCore.pyqtSignal(object)
+    progress = QtCore.pyqtSignal(int)
+
+    def __init__(self, parent=None, header_index: HeaderIndex = None):
+        super().__init__(parent)
+        self.header_index = header_index
+
+    def run(self):
+        pgnfile = self.header_index.pgnfile
+        caching = load_index_config()["game_cache"]
+        games = GameCache.load(pgnfile) if caching else None
+        index = PositionIndex.load(pgnfile)
+        if caching and index is not None and (
+            games is None or len(games) != index.game_count
+        ):
+            # The game cache is filled by the indexing pass; redo both
+            index = None
+        if index is None:
+            index = PositionIndex(pgnfile)
+            games = GameCache(pgnfile) if caching else None
+            index.build(self.header_index, self.progress.emit, games)
+            index.save()
+            if games is not None:
+                games.save()
+        elif index.refresh(self.header_index, self.progress.emit, games) is not None:
+            index.save()
+            if games is not None:
+                games.save()
+        if games is not None:
+            self.gameCacheReady.emit(games)
+        self.finished.emit(index)
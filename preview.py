@@ -0,0 +1,155 @@
+"""
+Live query preview.
+
+While the user types, the current query is run (debounced) against a fixed
+sample of a few thousand games in a low-priority background cql process.
+Stale runs are killed when the text changes again and results are cached by
+query hash, so the pane shows the match count and first hits within a
+second or two instead of waiting for a full scan.
+"""
+
+import hashlib
+import re
+from collections import OrderedDict
+
+from PyQt5 import QtCore, QtWidgets
+
+from process import CQLProcess, count_games
+
+SAMPLE_SIZE = 3000
+TAG_RE = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+
+
+def summarize_games(pgn_text: str, limit: int) -> list[str]:
+    """One ``White - Black (Result), Event`` line for the first games."""
+    lines = []
+    headers = None
+    for line in pgn_text.splitlines():
+        match = TAG_RE.match(line)
+        if match:
+            if headers is None:
+                headers = {}
+            headers[match.group(1)] = match.group(2)
+        elif headers is not None and line.strip():
+            lines.append(
+                f"{headers.get('White', '?')} - {headers.get('Black', '?')} "
+                f"({headers.get('Result', '*')}), {headers.get('Event', '')}"
+            )
+            headers = None
+            if len(lines) >= limit:
+                break
+    return lines
+
+
+class QueryPreview(QtWidgets.QWidget):
+    """Match count and first hits of the editor query on a sample of games."""
+
+    DEBOUNCE_MS = 700
+    MAX_HITS = 50
+    CACHE_SIZE = 64
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.enabled_box = QtWidgets.QCheckBox("Live preview", self)
+        self.enabled_box.setChecked(True)
+        self.status_label = QtWidgets.QLabel("Open a PGN file to preview queries", self)
+        self.hits_list = QtWidgets.QListWidget(self)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(4, 4, 4, 4)
+        layout.addWidget(self.enabled_box)
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.hits_list, 1)
+
+        self.query = ""
+        self.pgnfile = None
+        self.gamenumbers = None
+        self.sample_size = 0
+        self.cache: OrderedDict[str, tuple[int, list[str]]] = OrderedDict()
+        self.running_key = None
+        self.restart_pending = False
+        self.failed = False
+        self.output = []
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.DEBOUNCE_MS)
+        self.timer.timeout.connect(self.run_preview)
+
+        self.process = CQLProcess(self, low_priority=True)
+        self.process.gamesReceived.connect(self.output.append)
+        self.process.errorReceived.connect(self.on_error)
+        self.process.finished.connect(self.on_finished)
+        self.enabled_box.toggled.connect(self.on_toggled)
+
+    # ---------- Public ----------
+    def set_sample(self, pgnfile: str, gamenumbers: tuple[int, int] | None, size: int):
+        """Use ``pgnfile`` (optionally a game-number range of it) as the sample."""
+        self.pgnfile = pgnfile
+        self.gamenumbers = gamenumbers
+        self.sample_size = size
+        self.cache.clear()
+        self.schedule(self.query)
+
+    def schedule(self, query: str):
+        self.query = query
+        if self.enabled_box.isChecked() and self.pgnfile and query.strip():
+            self.timer.start()
+
+    def shutdown(self):
+        self.timer.stop()
+        if self.process.state() != QtCore.QProcess.NotRunning:
+            self.process.kill()
+            self.process.waitForFinished(1000)
+
+    # ---------- Running ----------
+    def cache_key(self) -> str:
+        text = f"{self.pgnfile}|{self.gamenumbers}|{self.query}"
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def run_preview(self):
+        key = self.cache_key()
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.show_result(*self.cache[key])
+            return
+        if self.process.state() != QtCore.QProcess.NotRunning:
+            # Drop the stale run; on_finished starts the new one
+            self.restart_pending = True
+            self.process.kill()
+            return
+        self.running_key = key
+        self.failed = False
+        self.output.clear()
+        self.status_label.setText(f"Previewing on {self.sample_size} games...")
+        self.process.search(self.query, self.pgnfile, self.gamenumbers)
+
+    def on_finished(self, exitCode, exitStatus):
+        if self.restart_pending:
+            self.restart_pending = False
+            self.run_preview()
+            return
+        if exitStatus != QtCore.QProcess.NormalExit or self.failed:
+            return
+        pgn_text = "\n".join(self.output)
+        result = (count_games(pgn_text), summarize_games(pgn_text, self.MAX_HITS))
+        self.cache[self.running_key] = result
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        if self.running_key == self.cache_key():
+            self.show_result(*result)
+
+    def on_error(self, error: str):
+        self.failed = True
+        self.status_label.setText(f"Query error: {error.splitlines()[0] if error else ''}")
+        self.hits_list.clear()
+
+    def on_toggled(self, checked: bool):
+        if checked:
+            self.schedule(self.query)
+        else:
+            self.timer.stop()
+
+    def show_result(self, count: int, hits: list[str]):
+        self.status_label.setText(f"{count} matches in a sample of {self.sample_size} games")
+        self.hits_list.clear()
+        self.hits_list.addItems(hits)
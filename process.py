@@ -1,6 +1,38 @@
-from PyQt5.QtCore import pyqtSignal, QProcess
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from PyQt5.QtCore import pyqtSignal, QObject, QProcess
 from PyQt5.QtWidgets import QApplication, QMainWindow
 
+from blockpgn import is_block_pgn
+from compressed import PipeFeeder, is_compressed
+from pgn_index import SubsetWorker
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def count_games(pgn_text: str) -> int:
+    """Number of games in PGN text, counted by their tag sections."""
+    count = 0
+    in_tags = False
+    for line in pgn_text.splitlines():
+        if line.startswith("["):
+            if not in_tags:
+                count += 1
+                in_tags = True
+        elif line.strip():
+            in_tags = False
+    return count
+
 
 class CounterProcess(QProcess):
     countFinished = pyqtSignal(int)
@@ -28,9 +60,18 @@ class CQLProcess(QProcess):
     finishedEXecution = pyqtSignal(int, int, str)
     finishedSuccessfully = pyqtSignal()
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, low_priority: bool = False):
         super().__init__(parent)
         self.setProgram("cql")
+        self.low_priority = low_priority
+        # Each process gets its own query file, so concurrent runs never
+        # read each other's query
+        fd, self.cqlfile = tempfile.mkstemp(prefix="qcql-", suffix=".cql")
+        os.close(fd)
+        self.destroyed.connect(lambda *_, path=self.cqlfile: _remove_file(path))
+        self.feeder = None  # streams a compressed input into a FIFO
+        self.game_offset = 0  # games before the first one fed to cql
+        self.errorOccurred.connect(self.on_process_error)
         self.readyReadStandardOutput.connect(self.read_data)
         self.finished.connect(self.on_finished)
         self.readyReadStandardError.connect(self.read_error)
@@ -39,12 +80,50 @@ class CQLProcess(QProcess):
         self.collecting_games = False
         self.gamedata = ""
 
-    def search(self, cqlquery: str, pgnfile: str):
-        with open("temp.cql", "w") as f:
+    def search(
+        self,
+        cqlquery: str,
+        pgnfile: str,
+        gamenumbers: tuple[int, int] | None = None,
+        extra_args: list[str] | None = None,
+        span: tuple[int, int] | None = None,
+    ):
+        """
+        Run ``cqlquery`` on ``pgnfile``. ``span`` is the byte range of the
+        ``gamenumbers`` games in a plain PGN file, when known: only that
+        range is fed to cql, which then does not read the games before it.
+        """
+        with open(self.cqlfile, "w") as f:
             f.write(cqlquery)
-        cqlfile = "temp.cql"
-        self.setProgram("cql")
-        self.setArguments(["-gui", "--guipgnstdout", "-input", pgnfile, cqlfile])
+        self.stop_feeder()
+        self.game_offset = 0
+        if gamenumbers is not None and not is_compressed(pgnfile) and (
+            span is not None or is_block_pgn(pgnfile)
+        ):
+            # Only the requested games are streamed (for .pgnb files, only
+            # their blocks); cql numbers them from 1, so progress is shifted
+            self.feeder = PipeFeeder(pgnfile, self, gamenumbers, span)
+            self.game_offset = gamenumbers[0] - 1
+            gamenumbers = None
+        elif is_compressed(pgnfile) or is_block_pgn(pgnfile):
+            self.feeder = PipeFeeder(pgnfile, self)
+        if self.feeder is not None:
+            self.feeder.failed.connect(self.errorReceived)
+            self.feeder.start()
+            pgnfile = self.feeder.fifo
+        arguments = ["-gui", "--guipgnstdout", "-input", pgnfile]
+        if gamenumbers is not None:
+            arguments += ["-gamenumber", f"{gamenumbers[0]}", f"{gamenumbers[1]}"]
+        if extra_args:
+            arguments += extra_args
+        arguments.append(self.cqlfile)
+        if self.low_priority and shutil.which("nice"):
+            # Background runs must not slow down the user's own searches
+            self.setProgram("nice")
+            self.setArguments(["-n", "19", "cql"] + arguments)
+        else:
+            self.setProgram("cql")
+            self.setArguments(arguments)
         self.start()
 
     def paginate_games(self, cqlfile: str, start, end):
@@ -58,7 +137,17 @@ class CQLProcess(QProcess):
         print(errors.data().decode())
         self.errorsReceivedFromStderr.emit(errors.data().decode())
 
+    def stop_feeder(self):
+        if self.feeder is not None:
+            self.feeder.stop()
+            self.feeder = None
+
+    def on_process_error(self, error):
+        if error == QProcess.FailedToStart:
+            self.stop_feeder()
+
     def on_finished(self, exitCode, exitStatus):
+        self.stop_feeder()
         output = self.readAllStandardOutput().data().decode()
         error = self.readAllStandardError().data().decode()
         print(output, error)
@@ -128,7 +217,7 @@ class CQLProcess(QProcess):
     def handle_variable(self, name: str, value: str):
         if name == "currentgamenumber":
             try:
-                self.progressUpdated.emit(int(value))
+                self.progressUpdated.emit(int(value) + self.game_offset)
             except ValueError:
                 pass
         else:
@@ -136,6 +225,293 @@ class CQLProcess(QProcess):
             self.statsReceived.emit({name: value.strip()})
 
 
+class WindowedSearch(QObject):
+    """
+    Runs a query over consecutive game-number windows and pauses once
+    ``limit`` matches have been found, so a query under development shows
+    its first hits in seconds. The window starts small and doubles while
+    nothing matches. ``resume`` continues from the first unscanned game.
+    The search stops with ``failed`` when cql reports an error or does not
+    exit cleanly. ``owned_files`` are deleted once the search finishes,
+    fails or is discarded.
+    """
+
+    gamesReceived = pyqtSignal(str)  # every match found so far
+    progressUpdated = pyqtSignal(int)  # current game number
+    paused = pyqtSignal(int)  # next game number to scan
+    finished = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    MIN_WINDOW = 1000
+    MAX_WINDOW = 256000
+
+    def __init__(
+        self,
+        cqlquery: str,
+        pgnfile: str,
+        first: int,
+        last: int,
+        extra_args: list[str] | None = None,
+        parent=None,
+    ):
+        super().__init__(parent)
+        self.cqlquery = cqlquery
+        self.pgnfile = pgnfile
+        self.last = last
+        self.extra_args = extra_args
+        self.next_game = first
+        self.window = self.MIN_WINDOW
+        self.window_end = first
+        self.games: list[str] = []
+        self.matches = 0
+        self.target = 0
+        self.cancelled = False
+        self.error = ""
+        self.window_games = 0  # len(self.games) when the window started
+        self.window_matches = 0  # self.matches when the window started
+        self.owned_files: list[str] = []  # temporary inputs, e.g. a subset file
+        self.process = CQLProcess(self)
+        self.process.gamesReceived.connect(self.on_games)
+        self.process.progressUpdated.connect(self.progressUpdated)
+        self.process.errorReceived.connect(self.on_error)
+        self.process.errorOccurred.connect(self.on_process_error)
+        self.process.finished.connect(self.on_window_finished)
+
+    def start(self, limit: int):
+        self.resume(limit)
+
+    def resume(self, limit: int):
+        """Scan until ``limit`` more matches are found or the file ends."""
+        self.cancelled = False
+        self.error = ""
+        self.target = self.matches + limit
+        self._next_window()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.process.state() != QProcess.NotRunning:
+            self.process.kill()
+
+    def discard(self):
+        """Stop for good: the search can no longer be resumed."""
+        self.cancel()
+        if self.is_running():
+            self.process.waitForFinished(1000)
+        self.remove_owned_files()
+
+    def remove_owned_files(self):
+        for path in self.owned_files:
+            _remove_file(path)
+        self.owned_files.clear()
+
+    def is_running(self) -> bool:
+        return self.process.state() != QProcess.NotRunning
+
+    def has_more(self) -> bool:
+        return self.next_game <= self.last
+
+    def _next_window(self):
+        if not self.has_more():
+            self.remove_owned_files()
+            self.finished.emit()
+            return
+        self.window_end = min(self.next_game + self.window - 1, self.last)
+        self.window_games = len(self.games)
+        self.window_matches = self.matches
+        self.process.search(
+            self.cqlquery,
+            self.pgnfile,
+            (self.next_game, self.window_end),
+            self.extra_args,
+        )
+
+    def on_games(self, pgn_text: str):
+        if pgn_text.strip():
+            self.games.append(pgn_text)
+            self.matches += count_games(pgn_text)
+
+    def on_error(self, error: str):
+        # cql may still be running; the search fails once it has finished
+        if not self.error:
+            self.error = error
+
+    def on_process_error(self, error):
+        if error == QProcess.FailedToStart:
+            self._fail("cql could not be started")
+
+    def _fail(self, error: str):
+        # The failed window's output may be incomplete: keep only the
+        # windows that finished cleanly
+        del self.games[self.window_games :]
+        self.matches = self.window_matches
+        self.remove_owned_files()
+        self.failed.emit(error)
+
+    def on_window_finished(self, exitCode, exitStatus):
+        if self.cancelled:
+            self.paused.emit(self.next_game)
+            return
+        if self.error or exitStatus != QProcess.NormalExit or exitCode != 0:
+            if self.error:
+                self._fail(self.error)
+            elif exitStatus != QProcess.NormalExit:
+                self._fail("cql crashed")
+            else:
+                self._fail(f"cql exited with code {exitCode}")
+            return
+        self.next_game = self.window_end + 1
+        self.gamesReceived.emit("\n".join(self.games))
+        if self.matches >= self.target:
+            if self.has_more():
+                self.paused.emit(self.next_game)
+            else:
+                self.remove_owned_files()
+                self.finished.emit()
+            return
+        if self.matches == 0:
+            self.window = min(self.window * 2, self.MAX_WINDOW)
+        self._next_window()
+
+
+class QueryEstimator(QObject):
+    """
+    Runs a query over a random sample of game-number windows and projects
+    the match count (with a 95% confidence interval from the spread between
+    windows), the throughput and the wall time of a full scan.
+
+    With a ``header_index`` of ``pgnfile``, the sampled games are first
+    copied into a temporary file in the background and cql only reads that
+    file, so the timing does not include skipping the rest of the file to
+    reach them. That file and the ``owned_files`` are deleted once the
+    estimate is ready, fails or is cancelled.
+    """
+
+    progressUpdated = pyqtSignal(int, int)  # windows done, windows total
+    estimateReady = pyqtSignal(dict)
+    failed = pyqtSignal(str)
+
+    def __init__(
+        self,
+        cqlquery: str,
+        pgnfile: str,
+        first: int,
+        last: int,
+        extra_args: list[str] | None = None,
+        windows: int = 12,
+        window_size: int = 250,
+        header_index=None,
+        parent=None,
+    ):
+        super().__init__(parent)
+        self.cqlquery = cqlquery
+        self.pgnfile = pgnfile
+        self.first = first
+        self.population = last - first + 1
+        self.extra_args = extra_args
+        self.window_size = max(1, min(window_size, self.population))
+        slots = self.population // self.window_size
+        starts = random.sample(range(slots), min(windows, slots))
+        self.ranges = sorted(
+            (first + i * self.window_size, first + (i + 1) * self.window_size - 1)
+            for i in starts
+        )
+        self.index = header_index
+        if header_index is not None and (
+            header_index.pgnfile != pgnfile or last > len(header_index)
+        ):
+            self.index = None
+        self.sample = None  # temporary file of the sampled games
+        self.sample_worker = None
+        self.owned_files: list[str] = []  # temporary inputs, e.g. a subset file
+        self.counts: list[int] = []
+        self.elapsed = 0.0
+        self.started_at = 0.0
+        self.cancelled = False
+        self.process = CQLProcess(self)
+        self.process.gamesReceived.connect(self.on_games)
+        self.process.finished.connect(self.on_window_finished)
+
+    def start(self):
+        if self.index is None:
+            self._next_window()
+            return
+        fd, self.sample = tempfile.mkstemp(prefix="qcql-estimate-", suffix=".pgn")
+        os.close(fd)
+        self.owned_files.append(self.sample)
+        numbers = [n for low, high in self.ranges for n in range(low, high + 1)]
+        self.sample_worker = SubsetWorker(self.index, numbers, self.sample, self)
+        self.sample_worker.finished.connect(lambda _: self._next_window())
+        self.sample_worker.failed.connect(self._fail)
+        self.sample_worker.start()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.sample_worker is not None and self.sample_worker.isRunning():
+            self.sample_worker.finished.disconnect()
+            self.sample_worker.wait()
+        if self.process.state() != QProcess.NotRunning:
+            self.process.kill()
+            self.process.waitForFinished(1000)
+        self.remove_owned_files()
+
+    def remove_owned_files(self):
+        for path in self.owned_files:
+            _remove_file(path)
+        self.owned_files.clear()
+
+    def _fail(self, error: str):
+        self.remove_owned_files()
+        self.failed.emit(error)
+
+    def _next_window(self):
+        i = len(self.counts)
+        self.counts.append(0)
+        self.started_at = time.monotonic()
+        if self.sample is not None:
+            # Window i is games i * size + 1 .. (i + 1) * size of the sample
+            window = (i * self.window_size + 1, (i + 1) * self.window_size)
+            self.process.search(self.cqlquery, self.sample, window, self.extra_args)
+        else:
+            window = self.ranges[i]
+            self.process.search(self.cqlquery, self.pgnfile, window, self.extra_args)
+
+    def on_games(self, pgn_text: str):
+        self.counts[-1] += count_games(pgn_text)
+
+    def on_window_finished(self, exitCode, exitStatus):
+        if self.cancelled:
+            return
+        self.elapsed += time.monotonic() - self.started_at
+        self.progressUpdated.emit(len(self.counts), len(self.ranges))
+        if len(self.counts) < len(self.ranges):
+            self._next_window()
+            return
+        self.remove_owned_files()
+        self.estimateReady.emit(self.estimate())
+
+    def estimate(self) -> dict:
+        k = len(self.counts)
+        sampled = k * self.window_size
+        rates = [c / self.window_size for c in self.counts]
+        rate = sum(rates) / k
+        variance = sum((r - rate) ** 2 for r in rates) / (k - 1) if k > 1 else 0.0
+        # Finite population correction for sampling windows without replacement
+        correction = 1 - sampled / self.population
+        margin = 1.96 * math.sqrt(variance / k * correction) * self.population
+        matches = rate * self.population
+        games_per_sec = sampled / self.elapsed if self.elapsed else 0.0
+        return {
+            "sampled": sampled,
+            "population": self.population,
+            "sample_matches": sum(self.counts),
+            "matches": matches,
+            "low": max(0.0, matches - margin),
+            "high": min(float(self.population), matches + margin),
+            "games_per_sec": games_per_sec,
+            "seconds": self.population / games_per_sec if games_per_sec else 0.0,
+        }
+
+
 class Window(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -0,0 +1,366 @@
+"""
+Static analysis of CQL text to find header constraints.
+
+The body of a CQL query is an implicit conjunction of its top-level
+filters, so a top-level ``player "Carlsen"`` or ``year >= 2000`` holds for
+every matching game. Such conjuncts are extracted here as header-index
+predicates (same tuples as ``pgn_index.parse_header_filter``) or as the
+matching ``-player``/``-year``/``-result`` command line options.
+
+Anything that could change the meaning (``or``/``∨`` or any unknown symbol
+at the top level, color transforms, ``not``/``if`` or an operator before
+the filter) makes the analyzer skip that filter, so the result is always a
+superset of the games CQL would match.
+"""
+
+import json
+import re
+
+import chess
+
+from editor import CQL_FUNCTIONS, CQL_KEYWORDS
+
+FILTERS_FILE = "data/filters.json"
+# Piece placement made of standard FEN characters only
+PLACEMENT_RE = re.compile(r"[pnbrqkPNBRQK1-8/]+")
+
+TOKEN_RE = re.compile(
+    r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+    |(?P<string>"(?:[^"\\]|\\.)*")
+    |(?P<number>\d+)
+    |(?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    |(?P<op>~~|==|!=|<=|>=|->|<-|[<>=])
+    |(?P<open>[({\[])
+    |(?P<close>[)}\]])
+    |(?P<other>\S)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+PIECE_LETTERS_RE = re.compile(r"[QRBNPqrbnp]+")
+RESULT_RE = re.compile(r'\s*("?)(1-0|0-1|1/2-1/2)\1')
+COMPARISONS = {"<", ">", "<=", ">=", "=="}
+HEADER_FILTERS = {"player", "result", "year", "elo", "event", "site"}
+# Top-level tokens that make the body something other than a plain conjunction
+OR_TOKENS = {"or", "∨"}
+UNSAFE_TOKENS = OR_TOKENS | {"flipcolor", "reversecolor"}
+AND_TOKENS = {"and", "∧"}
+# Symbols that are known not to change the top-level conjunction; any other
+# symbol (``∨``, ``|``, unicode piece designators ...) turns analysis off
+NEUTRAL_SYMBOLS = {"#", "∧"}
+# Filters that take no argument, so a header filter after them starts anew
+STANDALONE_FILTERS = {
+    "btm", "wtm", "check", "mate", "stalemate", "initial", "terminal",
+    "mainline", "variation", "true", "false",
+}
+
+# cql(...) header parameters that leave the set of searched positions as
+# it is; anything else (variations, gamenumber, matchcount ...) may not
+NEUTRAL_PARAMETERS = {"input", "output", "quiet", "silent", "matchstring"}
+FILE_PARAMETERS = {"input", "output"}
+WHITESPACE_RE = re.compile(r"\s")
+
+_filter_names = None
+
+
+def filter_names() -> set[str]:
+    """Filter keywords from data/filters.json plus the highlighter tables."""
+    global _filter_names
+    if _filter_names is None:
+        names = set(CQL_KEYWORDS) | set(CQL_FUNCTIONS)
+        try:
+            with open(FILTERS_FILE, "r") as f:
+                names |= {entry["name"] for entry in json.load(f)}
+        except Exception as e:
+            print("Error loading filters.", e)
+        _filter_names = {name.lower() for name in names}
+    return _filter_names
+
+
+def tokenize(text: str) -> list[tuple[str, str, int, int]]:
+    """``(kind, value, start, end)`` tokens with comments dropped."""
+    tokens = []
+    for m in TOKEN_RE.finditer(text):
+        kind = m.lastgroup
+        if kind != "comment":
+            tokens.append((kind, m.group(), m.start(), m.end()))
+    return tokens
+
+
+def _body_start(tokens: list) -> int:
+    """Index of the first token after the ``cql(...)`` header."""
+    if len(tokens) > 1 and tokens[0][1].lower() == "cql" and tokens[1][1] == "(":
+        depth = 0
+        for i, token in enumerate(tokens[1:], 1):
+            if token[0] == "open":
+                depth += 1
+            elif token[0] == "close":
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+    return 0
+
+
+def _neutral_header(text: str, tokens: list) -> bool:
+    """
+    True when the ``cql(...)`` header only has parameters that do not
+    change which positions are searched, so an index built from the
+    mainline of every game can answer for the query.
+    """
+    end = _body_start(tokens)
+    if end == 0:
+        return True
+    header_end = tokens[end - 1][2]
+    header = tokens[2 : end - 1]
+    i = 0
+    while i < len(header):
+        kind, value, _, stop = header[i]
+        word = value.lower()
+        if kind != "ident" or word not in NEUTRAL_PARAMETERS:
+            return False
+        i += 1
+        if i < len(header) and (word == "matchstring" or header[i][0] == "string"):
+            i += 1
+        elif i < len(header) and word in FILE_PARAMETERS:
+            # An unquoted file name runs to the next blank, whatever its tokens
+            blank = WHITESPACE_RE.search(text, header[i][2], header_end)
+            path_end = blank.start() if blank else header_end
+            while i < len(header) and header[i][2] < path_end:
+                i += 1
+    return True
+
+
+def _top_level(tokens: list) -> list:
+    """Depth-0 tokens of the query body, without the ``cql(...)`` header."""
+    top = []
+    depth = 0
+    for token in tokens[_body_start(tokens):]:
+        if token[0] == "open":
+            if depth == 0:
+                top.append(token)
+            depth += 1
+        elif token[0] == "close":
+            depth = max(0, depth - 1)
+            if depth == 0:
+                top.append(token)
+        elif depth == 0:
+            top.append(token)
+    return top
+
+
+def _is_unsafe(top: list) -> bool:
+    """True when the top-level tokens are not a plain conjunction."""
+    for kind, value, _, _ in top:
+        if kind == "ident" and value.lower() in UNSAFE_TOKENS:
+            return True
+        if kind == "other" and value not in NEUTRAL_SYMBOLS:
+            return True
+    return False
+
+
+def _binds_previous(after) -> bool:
+    """True when ``after`` makes the filter before it part of a larger term."""
+    return after is not None and (after[0] == "op" or after[1].lower() in OR_TOKENS)
+
+
+def _starts_statement(prev) -> bool:
+    """True when a filter after ``prev`` is a new top-level conjunct."""
+    if prev is None or prev[1].lower() in AND_TOKENS:
+        return True
+    if prev[0] in ("string", "number", "close"):
+        return True
+    # Any keyword that takes an argument (not, if, sort, message ...) or an
+    # operator binds the following filter, so only a bare filter name that
+    # is not one of these counts as the end of a previous conjunct.
+    return prev[0] == "ident" and prev[1].lower() in STANDALONE_FILTERS
+
+
+def _string_value(token) -> str:
+    return token[1][1:-1].replace('\\"', '"')
+
+
+def _comparison_range(op: str, value: int) -> tuple[int, int]:
+    return {
+        ">": (value + 1, 65535),
+        ">=": (value, 65535),
+        "<": (0, value - 1),
+        "<=": (0, value),
+        "==": (value, value),
+    }[op]
+
+
+def analyze_query(text: str) -> list[tuple]:
+    """Header predicates implied by the top-level conjuncts of ``text``."""
+    tokens = tokenize(text)
+    top = _top_level(tokens)
+    if _is_unsafe(top):
+        return []
+    names = filter_names()
+    predicates = []
+    for i, token in enumerate(top):
+        word = token[1].lower()
+        if token[0] != "ident" or word not in HEADER_FILTERS or word not in names:
+            continue
+        if not _starts_statement(top[i - 1] if i else None):
+            continue
+        rest = top[i + 1 : i + 4]
+        found, used = _match_header(word, rest, text, token)
+        if found is None:
+            continue
+        after = top[i + 1 + used] if i + 1 + used < len(top) else None
+        if _binds_previous(after):
+            continue
+        predicates.append(found)
+    return predicates
+
+
+def _match_header(word: str, rest: list, text: str, token):
+    """Return ``(predicate, tokens consumed)`` or ``(None, 0)``."""
+    if word in ("player", "event", "site"):
+        color = None
+        if word == "player" and rest and rest[0][1].lower() in ("white", "black"):
+            color, rest = rest[0][1].lower(), rest[1:]
+        if rest and rest[0][0] == "string":
+            field = color or word
+            return (field, _string_value(rest[0])), 2 if color else 1
+        return None, 0
+    if word == "result":
+        m = RESULT_RE.match(text, token[3])
+        if not m:
+            return None, 0
+        # Count the tokens covered by the result literal
+        used = sum(1 for t in rest if t[2] < m.end())
+        return ("result", m.group(2)), used
+    if word == "year":
+        if len(rest) >= 2 and rest[0][1] in COMPARISONS and rest[1][0] == "number":
+            return ("year", *_comparison_range(rest[0][1], int(rest[1][1]))), 2
+        return None, 0
+    if word == "elo":
+        if (
+            len(rest) >= 3
+            and rest[0][1].lower() in ("white", "black")
+            and rest[1][1] in COMPARISONS
+            and rest[2][0] == "number"
+        ):
+            field = f"{rest[0][1].lower()}elo"
+            return (field, *_comparison_range(rest[1][1], int(rest[2][1]))), 3
+    return None, 0
+
+
+def command_line_options(predicates: list[tuple]) -> list[str]:
+    """CQL command line options (see data/cmd.json) implied by ``predicates``."""
+    options = []
+    seen = set()
+    year_low, year_high = 0, 9999
+    for predicate in predicates:
+        field = predicate[0]
+        if field == "year":
+            year_low = max(year_low, predicate[1])
+            year_high = min(year_high, predicate[2])
+            continue
+        # The command line takes one value per option
+        if field in seen or field not in ("player", "white", "black", "result", "event", "site"):
+            continue
+        seen.add(field)
+        options += [f"-{field}", predicate[1]]
+    if (year_low, year_high) != (0, 9999):
+        options += ["-year", str(year_low), str(year_high)]
+    return options
+
+
+def describe(predicates: list[tuple]) -> str:
+    parts = []
+    for predicate in predicates:
+        if len(predicate) == 3:
+            parts.append(f"{predicate[0]}:{predicate[1]}-{predicate[2]}")
+        else:
+            parts.append(f'{predicate[0]}:"{predicate[1]}"')
+    return " ".join(parts)
+
+
+def exact_position(text: str) -> str | None:
+    """
+    The piece placement of a query whose whole body is a single
+    ``fen "..."`` filter. None for anything the position index cannot
+    answer exactly, such as CQL's extended FEN characters (``A``, ``a``,
+    ``.``, ``_``), an invalid placement, or header parameters such as
+    ``variations`` that reach positions the mainline index does not have.
+    """
+    tokens = tokenize(text)
+    if not _neutral_header(text, tokens):
+        return None
+    top = _top_level(tokens)
+    if not (
+        len(top) == 2
+        and top[0][0] == "ident"
+        and top[0][1].lower() == "fen"
+        and top[1][0] == "string"
+    ):
+        return None
+    fields = _string_value(top[1]).split()
+    if not fields or not PLACEMENT_RE.fullmatch(fields[0]):
+        return None
+    try:
+        chess.BaseBoard(fields[0])
+    except ValueError:
+        return None
+    return fields[0]
+
+
+def material_constraints(text: str) -> tuple[tuple[str, int, int], ...]:
+    """
+    Piece count comparisons among the top-level conjuncts, such as
+    ``Q == 0``, ``#[Rr] == 2`` or ``P < 3``, as ``(pieces, low, high)``
+    constraints for the material index, whose signatures come from the
+    mainline only. Nothing is returned for queries whose header reaches
+    other positions, such as ``cql(variations)``.
+    """
+    tokens = tokenize(text)
+    body = tokens[_body_start(tokens):]
+    if not _neutral_header(text, tokens) or _is_unsafe(_top_level(tokens)):
+        return ()
+    constraints = []
+    depth = 0
+    prev = None
+    i = 0
+    while i < len(body):
+        token = body[i]
+        if depth == 0:
+            found, used = _match_count(body, i)
+            after = body[i + used] if found and i + used < len(body) else None
+            if found and _starts_statement(prev) and not _binds_previous(after):
+                constraints.append(found)
+                prev = body[i + used - 1]
+                i += used
+                continue
+        if token[0] == "open":
+            depth += 1
+        elif token[0] == "close":
+            depth = max(0, depth - 1)
+        if depth == 0:
+            prev = token
+        i += 1
+    return tuple(constraints)
+
+
+def _match_count(body: list, i: int):
+    """Match ``#? designator op number`` at ``body[i]``: ``(constraint, used)``."""
+    j = i
+    if body[j][1] == "#":
+        j += 1
+    if j < len(body) and body[j][1] == "[":
+        if j + 2 >= len(body) or body[j + 2][1] != "]":
+            return None, 0
+        letters = body[j + 1]
+        j += 3
+    elif j < len(body):
+        letters = body[j]
+        j += 1
+    else:
+        return None, 0
+    if letters[0] != "ident" or not PIECE_LETTERS_RE.fullmatch(letters[1]):
+        return None, 0
+    if j + 1 >= len(body) or body[j][1] not in COMPARISONS or body[j + 1][0] != "number":
+        return None, 0
+    low, high = _comparison_range(body[j][1], int(body[j + 1][1]))
+    return (letters[1], low, high), j + 2 - i
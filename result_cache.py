@@ -0,0 +1,126 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+from validator import normalize_query
+
+RESULT_CACHE_FILE = "data/resultcache.sqlite"
+HEAD_BYTES = 1 << 20
+TAIL_BYTES = 1 << 16
+
+
+def query_key(cqlquery: str, extra_args: list[str] | None = None) -> str:
+    """Hash of the query text and the cql options that change its matches."""
+    text = normalize_query(cqlquery) + "\0" + "\0".join(extra_args or [])
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def prefix_fingerprint(pgnfile: str, size: int) -> str:
+    """Hash of the head and the tail of the first ``size`` bytes of the file."""
+    digest = hashlib.sha1()
+    with open(pgnfile, "rb") as f:
+        digest.update(f.read(min(size, HEAD_BYTES)))
+        f.seek(max(0, size - TAIL_BYTES))
+        digest.update(f.read(size - f.tell()))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk store of query results per (query hash, PGN file).
+
+    Each entry keeps the last game number scanned and the matches found up
+    to it, along with the file size and a fingerprint of the file at that
+    point. PGN databases are append-only, so as long as the old prefix is
+    unchanged a re-run only needs to scan the games appended since; any
+    other change to the file invalidates the entry.
+    """
+
+    _instance = None
+
+    @classmethod
+    def instance(cls) -> "ResultCache":
+        if cls._instance is None:
+            cls._instance = ResultCache()
+        return cls._instance
+
+    def __init__(self, path: str = RESULT_CACHE_FILE, max_entries: int = 500):
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                query TEXT NOT NULL,
+                pgnfile TEXT NOT NULL,
+                last_game INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                matches TEXT NOT NULL,
+                used REAL NOT NULL,
+                PRIMARY KEY (query, pgnfile)
+            )"""
+        )
+        self.conn.commit()
+
+    def get(self, key: str, pgnfile: str) -> dict | None:
+        """``{"last_game", "matches"}`` if the file only grew since the scan."""
+        pgnfile = os.path.abspath(pgnfile)
+        row = self.conn.execute(
+            "SELECT last_game, size, fingerprint, matches FROM results "
+            "WHERE query = ? AND pgnfile = ?",
+            (key, pgnfile),
+        ).fetchone()
+        if row is None:
+            return None
+        last_game, size, fingerprint, matches = row
+        try:
+            unchanged = os.path.getsize(pgnfile) >= size and (
+                prefix_fingerprint(pgnfile, size) == fingerprint
+            )
+        except OSError:
+            unchanged = False
+        if not unchanged:
+            self.conn.execute(
+                "DELETE FROM results WHERE query = ? AND pgnfile = ?", (key, pgnfile)
+            )
+            self.conn.commit()
+            return None
+        self.conn.execute(
+            "UPDATE results SET used = ? WHERE query = ? AND pgnfile = ?",
+            (time.time(), key, pgnfile),
+        )
+        self.conn.commit()
+        return {"last_game": last_game, "matches": matches}
+
+    def put(self, key: str, pgnfile: str, last_game: int, matches: str):
+        """Record that games 1..``last_game`` of ``pgnfile`` gave ``matches``."""
+        pgnfile = os.path.abspath(pgnfile)
+        try:
+            size = os.path.getsize(pgnfile)
+            fingerprint = prefix_fingerprint(pgnfile, size)
+        except OSError:
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results "
+            "(query, pgnfile, last_game, size, fingerprint, matches, used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, pgnfile, last_game, size, fingerprint, matches, time.time()),
+        )
+        self.conn.execute(
+            "DELETE FROM results WHERE rowid NOT IN "
+            "(SELECT rowid FROM results ORDER BY used DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+        self.conn.commit()
+
+    def put_job(self, job):
+        """
+        Record the matches of a finished whole-file QueryJob. Only jobs that
+        succeeded are stored: a crashed or failed run may have missed games.
+        """
+        if job.cache_key is None or not job.succeeded:
+            return
+        self.put(job.cache_key, job.source or job.pgnfile, job.last, job.result_text)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,62 @@
+"""
+Joining cql results against the header catalog, for files whose games
+share the same headers.
+"""
+
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import HeaderCatalog  # noqa: E402
+
+
+def result_row(white: str) -> dict:
+    return {
+        "Event": "Rapid",
+        "Date": "2024-01-01",
+        "Round": "?",
+        "White": white,
+        "Black": "Bob",
+    }
+
+
+@pytest.fixture()
+def catalog(tmp_path):
+    # Games 1-6 alternate between two pairings with identical headers
+    pgnfile = tmp_path / "games.pgn"
+    with open(pgnfile, "w") as f:
+        for number in range(1, 7):
+            white = "Alice" if number % 2 else "Carol"
+            f.write(
+                f'[Event "Rapid"]\n[Date "2024.01.01"]\n[White "{white}"]\n'
+                f'[Black "Bob"]\n[Result "1-0"]\n\n{number}. e4 1-0\n\n'
+            )
+    catalog = HeaderCatalog(str(tmp_path / "catalog.sqlite"))
+    catalog.sync(str(pgnfile))
+    yield catalog, str(pgnfile)
+    catalog.close()
+
+
+def test_duplicates_follow_file_order(catalog):
+    catalog, pgnfile = catalog
+    rows = [result_row("Carol"), result_row("Alice"), result_row("Alice")]
+    # Matches of games 2, 3 and 5: each Alice is after the Carol before it
+    assert catalog.join_results(pgnfile, rows) == [2, 3, 5]
+
+
+def test_join_stays_in_the_scanned_ranges(catalog):
+    catalog, pgnfile = catalog
+    rows = [result_row("Alice"), result_row("Carol")]
+    assert catalog.join_results(pgnfile, rows, [(4, 6)]) == [5, 6]
+    assert catalog.join_results(pgnfile, rows, [(3, 3), (6, 6)]) == [3, 6]
+
+
+def test_numbered_rows_keep_their_number(catalog):
+    catalog, pgnfile = catalog
+    numbered = dict(result_row("Alice"), _number=5, _source=pgnfile)
+    rows = [result_row("Alice"), numbered]
+    assert catalog.join_results(pgnfile, rows) == [1, 5]
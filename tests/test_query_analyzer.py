@@ -0,0 +1,70 @@
+"""Header and material pushdown must never narrow what cql would match."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from query_analyzer import (  # noqa: E402
+    analyze_query,
+    command_line_options,
+    exact_position,
+    material_constraints,
+)
+
+START = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR"
+
+
+def test_plain_conjunction_is_pushed_down():
+    predicates = analyze_query('cql() player "A" year >= 2000')
+    assert predicates == [("player", "A"), ("year", 2000, 65535)]
+    assert command_line_options(predicates) == ["-player", "A", "-year", "2000", "9999"]
+
+
+def test_unicode_and_is_a_conjunction():
+    assert analyze_query('cql() player "A" ∧ check') == [("player", "A")]
+
+
+@pytest.mark.parametrize("op", ["or", "∨"])
+def test_or_between_header_filters(op):
+    assert analyze_query(f'cql() player "A" {op} player "B"') == []
+
+
+@pytest.mark.parametrize("op", ["or", "∨"])
+def test_or_after_the_filter(op):
+    assert analyze_query(f'cql() player "A" {op} check') == []
+    assert material_constraints(f"cql() Q == 0 {op} check") == ()
+
+
+@pytest.mark.parametrize("op", ["or", "∨"])
+def test_or_before_the_filter(op):
+    assert analyze_query(f'cql() check {op} player "A"') == []
+
+
+def test_unknown_symbol_disables_pushdown():
+    assert analyze_query('cql() player "A" | check') == []
+
+
+def test_material_count_with_hash():
+    assert material_constraints("cql() #[Rr] == 2") == (("Rr", 2, 2),)
+
+
+@pytest.mark.parametrize(
+    "header", ["cql()", "cql(quiet)", "cql(input /tmp/a-b.pgn)", 'cql(input "x y.pgn")']
+)
+def test_exact_position_with_neutral_header(header):
+    assert exact_position(f'{header} fen "{START} w KQkq - 0 1"') == START
+
+
+@pytest.mark.parametrize(
+    "header", ["cql(variations)", "cql(input x.pgn variations)", "cql(gamenumber 1 9)"]
+)
+def test_exact_position_needs_the_mainline(header):
+    assert exact_position(f'{header} fen "{START} w KQkq - 0 1"') is None
+
+
+def test_material_needs_the_mainline():
+    assert material_constraints("cql(quiet) Q == 0") == (("Q", 0, 0),)
+    assert material_constraints("cql(variations) Q == 0") == ()
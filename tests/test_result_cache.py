@@ -0,0 +1,96 @@
+"""
+Result caching of query jobs, against a fake cql on PATH.
+
+The fake prints one match for every game number that is a multiple of 5
+in its -gamenumber range; FAKE_CQL_EXIT makes it exit with that code after
+printing its matches, like a cql that crashed late.
+"""
+
+import os
+import stat
+import sys
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5 import QtCore, QtWidgets  # noqa: E402
+
+from jobs import DONE, FAILED, JobScheduler  # noqa: E402
+from result_cache import ResultCache, query_key  # noqa: E402
+
+FAKE_CQL = """#!{python}
+import os, sys
+args = sys.argv
+i = args.index("-gamenumber")
+low, high = int(args[i + 1]), int(args[i + 2])
+print("<CqlGuiPgn>")
+for n in range(low, high + 1):
+    if n % 5 == 0:
+        print(f'[Event "G{{n}}"]\\n[Result "*"]\\n\\n1. e4 *\\n')
+print("</CqlGuiPgn>")
+sys.stdout.flush()
+sys.exit(int(os.environ.get("FAKE_CQL_EXIT", "0")))
+"""
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def fake_cql(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "cql"
+    script.write_text(FAKE_CQL.format(python=sys.executable))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return monkeypatch
+
+
+@pytest.fixture
+def pgnfile(tmp_path):
+    path = tmp_path / "games.pgn"
+    path.write_text(
+        "".join(f'[Event "E{n}"]\n[Result "*"]\n\n1. d4 *\n\n' for n in range(1, 31))
+    )
+    return str(path)
+
+
+def run_job(app, pgnfile, cache_key):
+    scheduler = JobScheduler(
+        {"cpu_budget": 1, "threads_per_job": 1, "window_games": 10, "window_unindexed": True}
+    )
+    job = scheduler.submit("cql()\ncheck", pgnfile, None, (0, 30))
+    job.cache_key = cache_key
+    loop = QtCore.QEventLoop()
+    job.finished.connect(lambda _: loop.quit())
+    QtCore.QTimer.singleShot(20000, loop.quit)
+    loop.exec_()
+    return job
+
+
+def test_clean_run_is_cached(app, fake_cql, pgnfile, tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite"))
+    key = query_key("cql()\ncheck")
+    job = run_job(app, pgnfile, key)
+    assert job.status == DONE and job.succeeded
+    cache.put_job(job)
+    entry = cache.get(key, pgnfile)
+    assert entry["last_game"] == 30
+    assert entry["matches"].count("[Event ") == 6
+
+
+def test_failed_run_is_not_cached(app, fake_cql, pgnfile, tmp_path):
+    fake_cql.setenv("FAKE_CQL_EXIT", "3")
+    cache = ResultCache(str(tmp_path / "cache.sqlite"))
+    key = query_key("cql()\ncheck")
+    job = run_job(app, pgnfile, key)
+    assert job.status == FAILED and not job.succeeded
+    # The first window's matches were printed, but must not become the
+    # cached result of the whole file
+    cache.put_job(job)
+    assert cache.get(key, pgnfile) is None
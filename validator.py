@@ -0,0 +1,154 @@
+"""
+Background syntax validation of CQL queries.
+
+The query is compiled by running cql against a one-game PGN, debounced
+while the user types. Verdicts are cached by a hash of the normalized text,
+so ``check`` can refuse a full-database run on a query that is known not to
+parse without starting cql again, and otherwise answers once the
+background run has its verdict, without blocking the GUI.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+from collections import OrderedDict
+
+from PyQt5 import QtCore
+
+from process import CQLProcess
+
+TINY_PGN = '[Event "?"]\n[Result "*"]\n\n*\n'
+LOCATION_RE = re.compile(r"line\s*:?\s*(\d+)(?:\D{1,12}col(?:umn)?\s*:?\s*(\d+))?", re.I)
+
+
+def normalize_query(text: str) -> str:
+    """Drop trailing whitespace only, so error line numbers stay valid."""
+    return "\n".join(line.rstrip() for line in text.rstrip().splitlines())
+
+
+def parse_errors(messages: list[str]) -> list[dict]:
+    """``{"message", "line", "column"}`` dicts; line/column are 1-based or 0."""
+    errors = []
+    for message in messages:
+        match = LOCATION_RE.search(message)
+        line = int(match.group(1)) if match else 0
+        column = int(match.group(2)) if match and match.group(2) else 0
+        errors.append({"message": message.strip(), "line": line, "column": column})
+    return errors
+
+
+class QueryValidator(QtCore.QObject):
+    validated = QtCore.pyqtSignal(list)  # errors for the latest text
+
+    DEBOUNCE_MS = 400
+    CACHE_SIZE = 256
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.text = ""
+        self.running_key = None
+        self.restart_pending = False
+        self.pending_check = None  # (cache key, callback) waiting for a verdict
+        self.messages: list[str] = []
+        self.stderr: list[str] = []
+        self.cache: OrderedDict[str, list[dict]] = OrderedDict()
+        self.pgnfile = os.path.join(tempfile.gettempdir(), f"qcql-tiny-{os.getpid()}.pgn")
+        with open(self.pgnfile, "w") as f:
+            f.write(TINY_PGN)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.DEBOUNCE_MS)
+        self.timer.timeout.connect(self.run_validation)
+
+        self.check_timer = QtCore.QTimer(self)
+        self.check_timer.setSingleShot(True)
+        self.check_timer.timeout.connect(self.on_check_timeout)
+
+        self.process = CQLProcess(self, low_priority=True)
+        self.process.errorReceived.connect(self.messages.append)
+        self.process.errorsReceivedFromStderr.connect(self.stderr.append)
+        self.process.finished.connect(self.on_finished)
+
+    @staticmethod
+    def cache_key(text: str) -> str:
+        return hashlib.sha1(normalize_query(text).encode()).hexdigest()
+
+    def schedule(self, text: str):
+        self.text = text
+        key = self.cache_key(text)
+        if key in self.cache:
+            self.timer.stop()
+            self.validated.emit(self.cache[key])
+        elif text.strip():
+            self.timer.start()
+        else:
+            self.validated.emit([])
+
+    def run_validation(self):
+        if self.process.state() != QtCore.QProcess.NotRunning:
+            self.restart_pending = True
+            self.process.kill()
+            return
+        self.running_key = self.cache_key(self.text)
+        self.messages.clear()
+        self.stderr.clear()
+        self.process.search(normalize_query(self.text), self.pgnfile)
+
+    def on_finished(self, exitCode, exitStatus):
+        if self.restart_pending:
+            self.restart_pending = False
+            self.run_validation()
+            return
+        if exitStatus != QtCore.QProcess.NormalExit:
+            return
+        messages = self.messages
+        if not messages and exitCode != 0:
+            messages = ["".join(self.stderr).strip() or f"cql exited with code {exitCode}"]
+        errors = parse_errors(messages)
+        self.cache[self.running_key] = errors
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        if self.running_key == self.cache_key(self.text):
+            self.validated.emit(errors)
+        pending = self.pending_check
+        if pending is not None and pending[0] == self.running_key:
+            self._answer_check(errors)
+
+    def check(self, text: str, then, timeout_ms: int = 5000):
+        """
+        Call ``then(errors)`` for ``text``: at once with a cached verdict,
+        otherwise when the validation run for it finishes. ``then(None)``
+        when cql gives no verdict within ``timeout_ms``. A newer check
+        replaces one still waiting.
+        """
+        key = self.cache_key(text)
+        if key in self.cache:
+            then(self.cache[key])
+            return
+        self.pending_check = (key, then)
+        self.check_timer.start(timeout_ms)
+        running = self.process.state() != QtCore.QProcess.NotRunning
+        if running and self.running_key == key and not self.restart_pending:
+            return  # the debounced run of this text is already under way
+        self.timer.stop()
+        self.text = text
+        self.run_validation()
+
+    def on_check_timeout(self):
+        self._answer_check(None)
+
+    def _answer_check(self, errors: list[dict] | None):
+        _, then = self.pending_check
+        self.pending_check = None
+        self.check_timer.stop()
+        then(errors)
+
+    def shutdown(self):
+        self.timer.stop()
+        self.check_timer.stop()
+        self.pending_check = None
+        if self.process.state() != QtCore.QProcess.NotRunning:
+            self.process.kill()
+            self.process.waitForFinished(1000)